@@ -0,0 +1,49 @@
+"""submissions
+
+Revision ID: 3f2a9c1d7b40
+Revises: daca6179358a
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c1d7b40'
+down_revision: Union[str, Sequence[str], None] = 'daca6179358a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'submissions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('task_id', sa.Integer(), nullable=False),
+        sa.Column('language', sa.String(), nullable=False),
+        sa.Column('passed', sa.Boolean(), nullable=True),
+        sa.Column('results', sa.Text(), nullable=True),
+        sa.Column('cpu_time_ms', sa.Integer(), nullable=True),
+        sa.Column('wall_time_ms', sa.Integer(), nullable=True),
+        sa.Column('peak_rss_kb', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['task_id'], ['tasks.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_submissions_id'), 'submissions', ['id'], unique=False)
+    op.create_index(op.f('ix_submissions_task_id'), 'submissions', ['task_id'], unique=False)
+    op.create_index(op.f('ix_submissions_user_id'), 'submissions', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_submissions_user_id'), table_name='submissions')
+    op.drop_index(op.f('ix_submissions_task_id'), table_name='submissions')
+    op.drop_index(op.f('ix_submissions_id'), table_name='submissions')
+    op.drop_table('submissions')
@@ -0,0 +1,30 @@
+"""task list indexes
+
+Revision ID: 8b1e4d2a6c93
+Revises: 3f2a9c1d7b40
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1e4d2a6c93'
+down_revision: Union[str, Sequence[str], None] = '3f2a9c1d7b40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_tasks_language_id', 'tasks', ['language', 'id'], unique=False)
+    op.create_index('ix_tasks_difficulty_id', 'tasks', ['difficulty', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tasks_difficulty_id', table_name='tasks')
+    op.drop_index('ix_tasks_language_id', table_name='tasks')
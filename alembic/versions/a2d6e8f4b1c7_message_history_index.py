@@ -0,0 +1,27 @@
+"""message history index
+
+Revision ID: a2d6e8f4b1c7
+Revises: f9c3b7e1d2a4
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a2d6e8f4b1c7'
+down_revision: Union[str, Sequence[str], None] = 'f9c3b7e1d2a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_messages_timestamp_id', 'messages', ['timestamp', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_timestamp_id', table_name='messages')
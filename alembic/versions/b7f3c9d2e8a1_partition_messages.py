@@ -0,0 +1,99 @@
+"""partition messages by month
+
+Revision ID: b7f3c9d2e8a1
+Revises: a2d6e8f4b1c7
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7f3c9d2e8a1'
+down_revision: Union[str, Sequence[str], None] = 'a2d6e8f4b1c7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Секции на столько месяцев вперёд; дальше их создаёт app/chat_archive.py
+PARTITIONS_AHEAD = 2
+
+
+def _next_month(month: datetime.date) -> datetime.date:
+    return (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Секционированной таблице нужен первичный ключ с ключом секционирования,
+    # поэтому таблица создаётся заново, а данные переносятся
+    op.drop_index('ix_messages_timestamp_id', table_name='messages')
+    op.drop_index('ix_messages_id', table_name='messages')
+    op.execute("ALTER TABLE messages RENAME TO messages_old")
+    op.execute("ALTER TABLE messages_old RENAME CONSTRAINT messages_pkey TO messages_old_pkey")
+    op.execute("ALTER TABLE messages_old RENAME CONSTRAINT messages_user_id_fkey TO messages_old_user_id_fkey")
+    op.execute(
+        "CREATE TABLE messages ("
+        " id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),"
+        " user_id INTEGER NOT NULL REFERENCES users (id),"
+        " content TEXT NOT NULL,"
+        " timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),"
+        " PRIMARY KEY (id, timestamp)"
+        ") PARTITION BY RANGE (timestamp)"
+    )
+    # Последовательность принадлежала старой таблице и удалилась бы вместе с ней
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    # Страховка для строк вне созданных секций; в норме пуста
+    op.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+
+    connection = op.get_bind()
+    first, current = connection.execute(sa.text(
+        "SELECT date_trunc('month', coalesce(min(timestamp), now()))::date, date_trunc('month', now())::date "
+        "FROM messages_old")).one()
+    last = current
+    for _ in range(PARTITIONS_AHEAD):
+        last = _next_month(last)
+    month = min(first, current)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE messages_p{month:%Y%m} PARTITION OF messages "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+        )
+        month = _next_month(month)
+
+    op.execute(
+        "INSERT INTO messages (id, user_id, content, timestamp) "
+        "SELECT id, user_id, content, coalesce(timestamp, now()) FROM messages_old"
+    )
+    op.drop_table('messages_old')
+    op.create_index('ix_messages_id', 'messages', ['id'], unique=False)
+    op.create_index('ix_messages_timestamp_id', 'messages', ['timestamp', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Архивированные (удалённые из БД) месяцы не возвращаются — они остаются в файлах архива
+    op.execute("ALTER TABLE messages RENAME TO messages_partitioned")
+    op.execute("ALTER TABLE messages_partitioned RENAME CONSTRAINT messages_pkey TO messages_partitioned_pkey")
+    op.execute("ALTER TABLE messages_partitioned RENAME CONSTRAINT messages_user_id_fkey "
+               "TO messages_partitioned_user_id_fkey")
+    op.create_table(
+        'messages',
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('messages_id_seq')"), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute(
+        "INSERT INTO messages (id, user_id, content, timestamp) "
+        "SELECT id, user_id, content, timestamp FROM messages_partitioned"
+    )
+    op.drop_table('messages_partitioned')
+    op.create_index('ix_messages_id', 'messages', ['id'], unique=False)
+    op.create_index('ix_messages_timestamp_id', 'messages', ['timestamp', 'id'], unique=False)
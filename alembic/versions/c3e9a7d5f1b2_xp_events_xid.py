@@ -0,0 +1,37 @@
+"""xp events transaction ids
+
+Revision ID: c3e9a7d5f1b2
+Revises: b7f3c9d2e8a1
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e9a7d5f1b2'
+down_revision: Union[str, Sequence[str], None] = 'b7f3c9d2e8a1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Существующие события получают xid этой миграции — все они уже закоммичены
+    op.add_column('xp_events', sa.Column('xid', sa.BigInteger(),
+                                         server_default=sa.text("(pg_current_xact_id()::text::bigint)"),
+                                         nullable=False))
+    op.create_index('ix_xp_events_xid_id', 'xp_events', ['xid', 'id'], unique=False)
+    op.add_column('rollup_cursors', sa.Column('last_xid', sa.BigInteger(), server_default='0', nullable=False))
+    # Курсор остаётся на прежнем last_event_id внутри xid миграции: неучтённые события доберутся
+    op.execute("UPDATE rollup_cursors SET last_xid = pg_current_xact_id()::text::bigint")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('rollup_cursors', 'last_xid')
+    op.drop_index('ix_xp_events_xid_id', table_name='xp_events')
+    op.drop_column('xp_events', 'xid')
@@ -0,0 +1,32 @@
+"""users transaction ids
+
+Revision ID: d5b1f8e3a9c4
+Revises: c3e9a7d5f1b2
+Create Date: 2026-10-18 23:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5b1f8e3a9c4'
+down_revision: Union[str, Sequence[str], None] = 'c3e9a7d5f1b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('xid', sa.BigInteger(),
+                                     server_default=sa.text("(pg_current_xact_id()::text::bigint)"),
+                                     nullable=False))
+    op.create_index(op.f('ix_users_xid'), 'users', ['xid'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_users_xid'), table_name='users')
+    op.drop_column('users', 'xid')
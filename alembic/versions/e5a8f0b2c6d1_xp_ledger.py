@@ -0,0 +1,75 @@
+"""xp ledger and rollups
+
+Revision ID: e5a8f0b2c6d1
+Revises: c47d19e3a5f2
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a8f0b2c6d1'
+down_revision: Union[str, Sequence[str], None] = 'c47d19e3a5f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'xp_events',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('source_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_xp_events_user_id'), 'xp_events', ['user_id'], unique=False)
+    op.create_table(
+        'xp_daily',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('xp', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'day'),
+    )
+    op.create_index('ix_xp_daily_day_xp', 'xp_daily', ['day', 'xp'], unique=False)
+    op.create_table(
+        'xp_weekly',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('week', sa.Date(), nullable=False),
+        sa.Column('xp', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'week'),
+    )
+    op.create_index('ix_xp_weekly_week_xp', 'xp_weekly', ['week', 'xp'], unique=False)
+    op.create_table(
+        'rollup_cursors',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('last_event_id', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('name'),
+    )
+    # Существующий XP из user_tasks переносим в журнал, чтобы сводки сошлись с total_xp по задачам
+    op.execute(
+        "INSERT INTO xp_events (user_id, amount, source, source_id, created_at) "
+        "SELECT ut.user_id, COALESCE(t.xp_reward, 0), 'task', ut.task_id, COALESCE(ut.completed_at, now()) "
+        "FROM user_tasks ut JOIN tasks t ON t.id = ut.task_id ORDER BY ut.completed_at"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('rollup_cursors')
+    op.drop_index('ix_xp_weekly_week_xp', table_name='xp_weekly')
+    op.drop_table('xp_weekly')
+    op.drop_index('ix_xp_daily_day_xp', table_name='xp_daily')
+    op.drop_table('xp_daily')
+    op.drop_index(op.f('ix_xp_events_user_id'), table_name='xp_events')
+    op.drop_table('xp_events')
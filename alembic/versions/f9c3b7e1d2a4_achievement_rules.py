@@ -0,0 +1,50 @@
+"""achievement rules and user progress
+
+Revision ID: f9c3b7e1d2a4
+Revises: e5a8f0b2c6d1
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f9c3b7e1d2a4'
+down_revision: Union[str, Sequence[str], None] = 'e5a8f0b2c6d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('achievements', sa.Column('code', sa.String(), nullable=True))
+    op.create_unique_constraint('uq_achievements_code', 'achievements', ['code'])
+    op.create_table(
+        'user_progress',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('tasks_solved', sa.Integer(), nullable=False),
+        sa.Column('languages', postgresql.ARRAY(sa.String()), nullable=False),
+        sa.Column('streak_days', sa.Integer(), nullable=False),
+        sa.Column('best_streak_days', sa.Integer(), nullable=False),
+        sa.Column('last_active_day', sa.Date(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    # Счётчики по уже решённым задачам; серии дней по истории не восстанавливаем — начинаем с 1
+    op.execute(
+        "INSERT INTO user_progress (user_id, tasks_solved, languages, streak_days, best_streak_days, last_active_day) "
+        "SELECT ut.user_id, count(*), array_agg(DISTINCT coalesce(lower(t.language), '')), 1, 1, "
+        "max(ut.completed_at)::date "
+        "FROM user_tasks ut JOIN tasks t ON t.id = ut.task_id GROUP BY ut.user_id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_progress')
+    op.drop_constraint('uq_achievements_code', 'achievements', type_='unique')
+    op.drop_column('achievements', 'code')
@@ -0,0 +1,319 @@
+"""
+Правила достижений.
+
+Достижение с правилом — порог по одному из счётчиков пользователя: решённые
+задачи, число языков, лучшая серия дней подряд (user_progress) или total_xp.
+Правила объявлены ниже (RULES) и при старте приложения сводятся с таблицей
+achievements по коду (achievements.code).
+
+Проверка при решении задачи инкрементальная: complete_task в том же запросе
+обновляет user_progress и возвращает счётчики до и после (см.
+crud.complete_task_statement), а здесь выбираются правила, чей порог пересечён
+(до < порог <= после). История пользователя не пересматривается; на каждую
+посылку — ноль дополнительных запросов, если порог не пересечён.
+
+Новое правило применяется ко всем пользователям пакетами (backfill): один
+INSERT ... SELECT по диапазону id пользователей на пакет, каждый пакет — своя
+короткая транзакция, между пакетами пауза, чтобы не мешать запросам сайта.
+Выдача достижения (в обоих режимах) добавляет бонусный XP в журнал и к total_xp;
+если бонус сам пересёк порог правила по total_xp, это правило выдаётся следом
+(и так далее, пока новые пороги не кончатся).
+"""
+import asyncio
+import os
+from typing import List, Optional
+
+from sqlalchemy import case, func, insert, literal, select, update
+from sqlalchemy.dialects.postgresql import array, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import database, leaderboard, models, user_cache
+
+ACHIEVEMENT_BACKFILL_CHUNK = int(os.environ.get("ACHIEVEMENT_BACKFILL_CHUNK", "1000"))
+ACHIEVEMENT_BACKFILL_PAUSE = float(os.environ.get("ACHIEVEMENT_BACKFILL_PAUSE", "0.05"))
+
+# Счётчики, по которым можно задать правило, и их SQL-выражения над users LEFT JOIN user_progress
+METRICS = {
+    "tasks_solved": func.coalesce(models.UserProgress.tasks_solved, 0),
+    "languages": func.coalesce(func.cardinality(models.UserProgress.languages), 0),
+    "streak_days": func.coalesce(models.UserProgress.best_streak_days, 0),
+    "total_xp": func.coalesce(models.User.total_xp, 0),
+}
+
+
+class Rule:
+    def __init__(self, code: str, title: str, description: str, xp_bonus: int, metric: str, threshold: int):
+        if metric not in METRICS:
+            raise ValueError(f"Неизвестный счётчик правила: {metric}")
+        self.code = code
+        self.title = title
+        self.description = description
+        self.xp_bonus = xp_bonus
+        self.metric = metric
+        self.threshold = threshold
+
+    def crossed(self, before: dict, after: dict) -> bool:
+        """Порог пересечён этим событием (счётчики только растут)."""
+        return before[self.metric] < self.threshold <= after[self.metric]
+
+    def condition(self):
+        """Условие правила в SQL — для пакетного применения."""
+        return METRICS[self.metric] >= self.threshold
+
+
+RULES = [
+    Rule("first_task", "Первый шаг", "Решить первую задачу", 50, "tasks_solved", 1),
+    Rule("tasks_10", "Десять задач", "Решить 10 задач", 100, "tasks_solved", 10),
+    Rule("tasks_50", "Полсотни", "Решить 50 задач", 300, "tasks_solved", 50),
+    Rule("polyglot_3", "Полиглот", "Решить задачи на трёх языках программирования", 150, "languages", 3),
+    Rule("streak_3", "Три дня подряд", "Решать задачи три дня подряд", 50, "streak_days", 3),
+    Rule("streak_7", "Неделя без перерыва", "Решать задачи семь дней подряд", 200, "streak_days", 7),
+    Rule("xp_1000", "Первая тысяча", "Набрать 1000 XP", 0, "total_xp", 1000),
+    Rule("xp_10000", "Десять тысяч", "Набрать 10000 XP", 0, "total_xp", 10000),
+]
+RULES_BY_CODE = {rule.code: rule for rule in RULES}
+
+
+def progress_ctes(user_id: int, solved):
+    """
+    CTE для complete_task_statement: счётчики до события и обновление user_progress.
+    solved — CTE с колонкой language решённой задачи (пустой, если задача уже была решена).
+    Все части запроса видят один снимок БД, поэтому progress_before — значения до обновления.
+    """
+    progress = models.UserProgress.__table__
+    before = (
+        select(progress.c.tasks_solved, func.cardinality(progress.c.languages).label("languages"),
+               progress.c.best_streak_days)
+        .where(progress.c.user_id == user_id)
+        .cte("progress_before")
+    )
+
+    today = func.current_date()
+    language = func.coalesce(func.lower(solved.c.language), "")
+    statement = pg_insert(progress).from_select(
+        ["user_id", "tasks_solved", "languages", "streak_days", "best_streak_days", "last_active_day"],
+        select(literal(user_id), literal(1), array([language]), literal(1), literal(1), today))
+    streak = case(
+        (progress.c.last_active_day == today, progress.c.streak_days),
+        (progress.c.last_active_day == today - 1, progress.c.streak_days + 1),
+        else_=1,
+    )
+    after = statement.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={
+            "tasks_solved": progress.c.tasks_solved + 1,
+            "languages": case((progress.c.languages.any(statement.excluded.languages[1]), progress.c.languages),
+                              else_=func.array_cat(progress.c.languages, statement.excluded.languages)),
+            "streak_days": streak,
+            "best_streak_days": func.greatest(progress.c.best_streak_days, streak),
+            "last_active_day": today,
+        },
+    ).returning(progress.c.user_id, progress.c.tasks_solved,
+                func.cardinality(progress.c.languages).label("languages"),
+                progress.c.best_streak_days).cte("progress_after")
+    return before, after
+
+
+def progress_columns(before, after) -> list:
+    """Колонки RETURNING для complete_task_statement: счётчики до (before_*) и после события."""
+    return [
+        func.coalesce(select(before.c.tasks_solved).scalar_subquery(), 0).label("before_tasks_solved"),
+        func.coalesce(select(before.c.languages).scalar_subquery(), 0).label("before_languages"),
+        func.coalesce(select(before.c.best_streak_days).scalar_subquery(), 0).label("before_streak_days"),
+        after.c.tasks_solved,
+        after.c.languages,
+        after.c.best_streak_days.label("streak_days"),
+    ]
+
+
+def crossed_rules(row) -> List[Rule]:
+    """Правила, чей порог пересекла строка результата complete_task_statement."""
+    before = {
+        "tasks_solved": row.before_tasks_solved,
+        "languages": row.before_languages,
+        "streak_days": row.before_streak_days,
+        "total_xp": row.total_xp - (row.xp_reward or 0),
+    }
+    after = {
+        "tasks_solved": row.tasks_solved,
+        "languages": row.languages,
+        "streak_days": row.streak_days,
+        "total_xp": row.total_xp,
+    }
+    return [rule for rule in RULES if rule.crossed(before, after)]
+
+
+def bonus_rules(total_xp: int, xp_bonus: int) -> List[Rule]:
+    """Правила по total_xp, чей порог пересёк бонус достижения (total_xp — уже с бонусом)."""
+    before, after = {"total_xp": total_xp - xp_bonus}, {"total_xp": total_xp}
+    return [rule for rule in RULES if rule.metric == "total_xp" and rule.crossed(before, after)]
+
+
+def award_statement(achievement_id: int, xp_bonus: int, condition):
+    """
+    Выдаёт достижение всем пользователям, подходящим под condition (над users LEFT JOIN
+    user_progress), кроме уже получивших его, и начисляет бонус. Возвращает (id, total_xp)
+    получивших.
+    """
+    candidates = (
+        select(models.User.id, literal(achievement_id))
+        .select_from(models.User.__table__.outerjoin(models.UserProgress.__table__))
+        .where(condition)
+    )
+    awarded = (
+        pg_insert(models.UserAchievement)
+        .from_select(["user_id", "achievement_id"], candidates)
+        .on_conflict_do_nothing(index_elements=["user_id", "achievement_id"])
+        .returning(models.UserAchievement.user_id)
+        .cte("awarded")
+    )
+    statement = (
+        update(models.User)
+        .where(models.User.id == awarded.c.user_id)
+        .values(total_xp=func.coalesce(models.User.total_xp, 0) + xp_bonus)
+        .returning(models.User.id, models.User.total_xp)
+    )
+    if xp_bonus:
+        ledger = (
+            insert(models.XpEvent)
+            .from_select(["user_id", "amount", "source", "source_id"],
+                         select(awarded.c.user_id, literal(xp_bonus), literal("achievement"), literal(achievement_id)))
+            .cte("achievement_ledger")
+        )
+        statement = statement.add_cte(ledger)
+    return statement
+
+
+class AchievementEngine:
+    def __init__(self, backfill_chunk: int, backfill_pause: float):
+        self.backfill_chunk = backfill_chunk
+        self.backfill_pause = backfill_pause
+        self.achievement_ids = {}  # код правила -> id достижения; заполняется при старте
+        self._backfills = set()
+        self.awarded = 0
+        self.backfilled = 0
+
+    def achievement_id(self, rule: Rule) -> Optional[int]:
+        # Вне приложения (скрипты) правила не сведены с БД — выдачу пропускаем, её догонит backfill
+        return self.achievement_ids.get(rule.code)
+
+    def after_award(self, rows):
+        """Обновляет кэши после выдачи: rows — (id, total_xp) из award_statement."""
+        for user_id, total_xp in rows:
+            user_cache.cache.invalidate(user_id)
+            leaderboard.board.update(user_id, total_xp)
+        self.awarded += len(rows)
+
+    @staticmethod
+    def _queue_bonus_rules(pending: List[Rule], seen: set, rule: Rule, rows):
+        # Бонус выданного достижения мог пересечь порог правил по total_xp
+        for user_id, total_xp in rows:
+            for bonus_rule in bonus_rules(total_xp, rule.xp_bonus):
+                if bonus_rule.code not in seen:
+                    seen.add(bonus_rule.code)
+                    pending.append(bonus_rule)
+
+    async def award(self, db: AsyncSession, rules: List[Rule], user_id: int) -> List[str]:
+        """Выдаёт пользователю достижения по пересечённым правилам (после commit complete_task)."""
+        granted = []
+        pending, seen = list(rules), {rule.code for rule in rules}
+        while pending:
+            rule = pending.pop(0)
+            achievement_id = self.achievement_id(rule)
+            if achievement_id is None:
+                continue
+            rows = (await db.execute(award_statement(achievement_id, rule.xp_bonus,
+                                                     models.User.id == user_id))).all()
+            await db.commit()
+            self.after_award(rows)
+            if rows:
+                granted.append(rule.title)
+                self._queue_bonus_rules(pending, seen, rule, rows)
+        return granted
+
+    def award_sync(self, db: Session, rules: List[Rule], user_id: int) -> List[str]:
+        """То же, что award, для синхронной сессии (crud.complete_task)."""
+        granted = []
+        pending, seen = list(rules), {rule.code for rule in rules}
+        while pending:
+            rule = pending.pop(0)
+            achievement_id = self.achievement_id(rule)
+            if achievement_id is None:
+                continue
+            rows = db.execute(award_statement(achievement_id, rule.xp_bonus, models.User.id == user_id)).all()
+            db.commit()
+            self.after_award(rows)
+            if rows:
+                granted.append(rule.title)
+                self._queue_bonus_rules(pending, seen, rule, rows)
+        return granted
+
+    async def sync_rules(self, db: AsyncSession) -> List[Rule]:
+        """Заводит достижения для правил без строки в achievements; возвращает новые правила."""
+        created = await db.scalars(
+            pg_insert(models.Achievement)
+            .values([{"code": rule.code, "title": rule.title, "description": rule.description,
+                      "xp_bonus": rule.xp_bonus} for rule in RULES])
+            .on_conflict_do_nothing()
+            .returning(models.Achievement.code))
+        new_codes = set(created)
+        rows = await db.execute(select(models.Achievement.code, models.Achievement.id)
+                                .where(models.Achievement.code.in_(RULES_BY_CODE)))
+        self.achievement_ids = dict(rows.all())
+        await db.commit()
+        return [rule for rule in RULES if rule.code in new_codes]
+
+    async def backfill(self, rule: Rule) -> int:
+        """Применяет правило ко всем пользователям пакетами по id; возвращает число выданных."""
+        achievement_id = self.achievement_id(rule)
+        if achievement_id is None:
+            return 0
+        total = 0
+        async with database.AsyncSessionLocal() as db:
+            max_id = await db.scalar(select(func.max(models.User.id))) or 0
+            await db.commit()
+            for start in range(0, max_id, self.backfill_chunk):
+                chunk = (models.User.id > start) & (models.User.id <= start + self.backfill_chunk)
+                rows = (await db.execute(award_statement(achievement_id, rule.xp_bonus,
+                                                         chunk & rule.condition()))).all()
+                await db.commit()
+                self.after_award(rows)
+                total += len(rows)
+                self.backfilled += len(rows)
+                for user_id, total_xp in rows:
+                    # Бонус пересёк порог по total_xp — догоняем эти правила для пользователя
+                    await self.award(db, bonus_rules(total_xp, rule.xp_bonus), user_id)
+                await asyncio.sleep(self.backfill_pause)
+        return total
+
+    def start_backfill(self, rule: Rule) -> bool:
+        """Запускает backfill правила в фоне; False, если он уже идёт."""
+        if rule.code in self._backfills:
+            return False
+        self._backfills.add(rule.code)
+        task = asyncio.create_task(self.backfill(rule))
+        task.add_done_callback(lambda t: self._backfill_done(rule, t))
+        return True
+
+    def _backfill_done(self, rule: Rule, task):
+        self._backfills.discard(rule.code)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Ошибка применения правила {rule.code}: {task.exception()}")
+
+    async def start(self):
+        async with database.AsyncSessionLocal() as db:
+            new_rules = await self.sync_rules(db)
+        for rule in new_rules:
+            self.start_backfill(rule)
+
+    def stats(self) -> dict:
+        return {
+            "rules": len(RULES),
+            "awarded": self.awarded,
+            "backfilled": self.backfilled,
+            "backfills_running": sorted(self._backfills),
+        }
+
+
+engine = AchievementEngine(ACHIEVEMENT_BACKFILL_CHUNK, ACHIEVEMENT_BACKFILL_PAUSE)
@@ -0,0 +1,162 @@
+"""
+Асинхронные версии функций app/crud.py для эндпоинтов (AsyncSession + asyncpg).
+
+Имена и поведение совпадают с синхронными функциями в crud.py, которые
+остаются для скриптов и кода, выполняемого при старте приложения.
+"""
+import asyncio
+import json
+from typing import List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from . import crud, models, schemas, user_cache, completion_index, leaderboard, achievements, chat_writer
+
+
+# --- Пользователи ---
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    return await db.get(models.User, user_id)
+
+
+async def get_user_by_email(db: AsyncSession, email: str) -> Optional[models.User]:
+    return await db.scalar(select(models.User).where(models.User.email == email))
+
+
+async def create_user(db: AsyncSession, user_create_schema: schemas.UserCreate, hashed_password: str):
+    user = models.User(
+        name=user_create_schema.name,
+        last_name=user_create_schema.last_name,
+        email=user_create_schema.email,
+        password=hashed_password,
+        role=user_create_schema.role,
+        total_xp=0  # Устанавливаем начальный XP
+    )
+    db.add(user)
+    await db.commit()
+    await db.refresh(user)
+    leaderboard.board.update(user.id, user.total_xp, user.name, user.avatar)
+    return user
+
+
+# --- Задачи (Tasks) ---
+
+async def get_task_by_id(db: AsyncSession, task_id: int) -> Optional[models.Task]:
+    """Возвращает задачу по её ID."""
+    return await db.get(models.Task, task_id)
+
+
+async def get_completed_task_ids_by_user(db: AsyncSession, user_id: int) -> List[int]:
+    """Возвращает список ID задач, выполненных пользователем."""
+    result = await db.scalars(select(models.UserTask.task_id).where(models.UserTask.user_id == user_id))
+    return list(result)
+
+
+async def create_task(db: AsyncSession, task_schema: schemas.TaskCreate):
+    """Создает новую задачу по программированию."""
+    db_task = models.Task(**task_schema.model_dump())
+    db.add(db_task)
+    await db.commit()
+    await db.refresh(db_task)
+    return db_task
+
+
+async def get_all_tasks(db: AsyncSession) -> List[models.Task]:
+    """Возвращает список всех задач."""
+    return list(await db.scalars(select(models.Task)))
+
+
+async def get_tasks_by_user_id(db: AsyncSession, user_id: int) -> List[models.Task]:
+    """Возвращает список задач, выполненных пользователем."""
+    return list(await db.scalars(
+        select(models.Task).join(models.UserTask).where(models.UserTask.user_id == user_id)))
+
+
+async def is_task_completed(db: AsyncSession, user_id: int, task_id: int) -> bool:
+    """Проверяет, выполнил ли пользователь задачу."""
+    return await db.get(models.UserTask, (user_id, task_id)) is not None
+
+
+async def complete_task(db: AsyncSession, user_id: int, task_id: int):
+    """Отмечает задачу как выполненную и начисляет XP (атомарно, см. crud.complete_task_statement)."""
+    for attempt in range(crud.COMPLETE_TASK_RETRIES + 1):
+        try:
+            row = (await db.execute(crud.complete_task_statement(user_id, task_id))).first()
+            await db.commit()
+            break
+        except DBAPIError as e:
+            await db.rollback()
+            if attempt == crud.COMPLETE_TASK_RETRIES or not crud.is_retryable_error(e):
+                raise
+            await asyncio.sleep(0.01 * 2 ** attempt)
+
+    if row is None:
+        # Ничего не начислено — выясняем причину (редкий путь, отдельный запрос)
+        task = None
+        if await db.get(models.User, user_id) is not None:
+            task = await db.get(models.Task, task_id)
+        if task is not None:
+            # Задача уже была выполнена (возможно, через другой процесс)
+            completion_index.index.add(user_id, task_id)
+        return crud.complete_task_result(None, task)
+
+    user_cache.cache.invalidate(user_id)
+    completion_index.index.add(user_id, task_id)
+    leaderboard.board.update(user_id, row.total_xp)
+    # Достижения — только если событие пересекло порог правила
+    granted = await achievements.engine.award(db, achievements.crossed_rules(row), user_id)
+    return crud.complete_task_result(row, None, granted)
+
+
+async def create_submission(db: AsyncSession, user_id: int, task_id: int, language: str, passed: bool,
+                            results: list, metrics: dict):
+    """Сохраняет посылку с результатами и метриками проверки."""
+    submission = models.Submission(
+        user_id=user_id,
+        task_id=task_id,
+        language=language,
+        passed=passed,
+        results=json.dumps(results, ensure_ascii=False),
+        cpu_time_ms=metrics.get("cpu_time_ms"),
+        wall_time_ms=metrics.get("wall_time_ms"),
+        peak_rss_kb=metrics.get("peak_rss_kb"),
+    )
+    db.add(submission)
+    await db.commit()
+    await db.refresh(submission)
+    return submission
+
+
+# --- Достижения (Achievements) ---
+
+async def create_achievement(db: AsyncSession, achievement_schema: schemas.AchievementCreate):
+    """Создает новое достижение (используется админом)."""
+    db_achievement = models.Achievement(
+        title=achievement_schema.title,
+        description=achievement_schema.description,
+        xp_bonus=achievement_schema.xp_bonus
+    )
+    db.add(db_achievement)
+    await db.commit()
+    await db.refresh(db_achievement)
+    return db_achievement
+
+
+# --- Чат (Messages) ---
+
+async def send_message(db: AsyncSession, user_id: int, content: str, user_name: Optional[str] = None) -> dict:
+    """
+    Отправляет новое сообщение в чат: запись в БД и рассылка клиентам идут пакетами
+    в фоне (chat_writer). Возвращает сообщение в формате API.
+    """
+    return await chat_writer.writer.submit(db, user_id, content, user_name)
+
+
+async def get_recent_messages(db: AsyncSession, limit: int = 50) -> List[models.Message]:
+    """Возвращает последние сообщения из чата, присоединяя информацию о пользователе."""
+    return list(await db.scalars(
+        select(models.Message).options(joinedload(models.Message.user))
+        .order_by(models.Message.timestamp.desc()).limit(limit)))
@@ -1,4 +1,5 @@
 # app/auth.py
+import os
 import bcrypt
 from jose import jwt
 from datetime import datetime, timedelta
@@ -6,10 +7,12 @@ from datetime import datetime, timedelta
 SECRET_KEY = "super-secret-jwt-key-for-dev"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 1
+# Стоимость bcrypt; при её изменении пароли перехэшируются при следующем входе
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
 
 def hash_password(password: str) -> str:
     pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(pwd_bytes, salt)
     return hashed.decode('utf-8')
 
@@ -18,6 +21,15 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     hash_bytes = hashed_password.encode('utf-8')
     return bcrypt.checkpw(pwd_bytes, hash_bytes)
 
+def needs_rehash(hashed_password: str) -> bool:
+    """True, если хэш создан с другой стоимостью bcrypt, чем BCRYPT_ROUNDS."""
+    # Формат bcrypt: $2b$<стоимость>$<соль и хэш>
+    parts = hashed_password.split("$")
+    try:
+        return int(parts[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
@@ -0,0 +1,283 @@
+"""
+Загрузка аватаров и их уменьшенные копии в WebP.
+
+Загрузка читается из тела запроса потоком: multipart разбирается по мере
+поступления кусков, файл пишется во временный файл на диске, а при превышении
+AVATAR_MAX_BYTES приём прерывается сразу — весь файл в памяти не держится.
+
+Дальше фоновая обработка в пуле процессов (Pillow занимает процессор)
+делает из оригинала квадратные WebP AVATAR_SIZES пикселей:
+uploads/avatars/avatar-<id>-<версия>-<размер>.webp. Оригинал не хранится.
+Когда копии готовы, users.avatar указывает на самую большую, а шаблоны выбирают
+нужный размер фильтром avatar (sized_url). Версия в имени файла меняется при
+каждой загрузке, поэтому файлы можно кэшировать в браузере без ограничения срока.
+
+Очередь обработки ограничена AVATAR_MAX_PENDING: при переполнении выбрасывается
+Saturated, и эндпоинт отвечает 503.
+"""
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import re
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, ImageOps
+from sqlalchemy import select, update
+from starlette.requests import Request
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:
+    import multipart
+    from multipart.multipart import parse_options_header
+
+from . import database, leaderboard, models, user_cache
+
+AVATAR_DIR = Path("uploads/avatars")
+AVATAR_URL_PREFIX = "/uploads/avatars"
+AVATAR_MAX_BYTES = int(os.environ.get("AVATAR_MAX_BYTES", 5 * 1024 * 1024))
+AVATAR_MAX_PIXELS = int(os.environ.get("AVATAR_MAX_PIXELS", 40_000_000))
+AVATAR_SIZES = (32, 64, 256)
+AVATAR_WEBP_QUALITY = int(os.environ.get("AVATAR_WEBP_QUALITY", "80"))
+AVATAR_WORKERS = int(os.environ.get("AVATAR_WORKERS", "2"))
+AVATAR_MAX_PENDING = int(os.environ.get("AVATAR_MAX_PENDING", "32"))
+ALLOWED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+# Запас на заголовки multipart сверх размера файла при проверке Content-Length
+MULTIPART_OVERHEAD = 16 * 1024
+
+SIZED_AVATAR = re.compile(r"^(" + re.escape(AVATAR_URL_PREFIX) + r"/avatar-\d+-[0-9a-f]+)-\d+\.webp$")
+
+
+class UploadError(Exception):
+    """Загрузка отклонена; status_code и detail — для HTTPException."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class Saturated(Exception):
+    """Очередь обработки аватаров заполнена; загрузку нужно повторить позже."""
+
+
+def sized_url(avatar: Optional[str], size: int) -> Optional[str]:
+    """URL копии аватара нужного размера (фильтр шаблонов avatar); внешние и старые URL — как есть."""
+    if not avatar:
+        return avatar
+    match = SIZED_AVATAR.match(avatar)
+    if match is None:
+        return avatar
+    # Берём ближайшую копию не меньше запрошенного размера
+    size = next((s for s in AVATAR_SIZES if s >= size), AVATAR_SIZES[-1])
+    return f"{match[1]}-{size}.webp"
+
+
+class _UploadReceiver:
+    """Колбэки потокового разбора multipart: файл поля field пишется в target."""
+
+    def __init__(self, field: str, target, limit: int):
+        self.field = field
+        self.target = target
+        self.limit = limit
+        self.size = 0
+        self.filename = None
+        self.content_type = None
+        self._headers = {}
+        self._header_name = b""
+        self._header_value = b""
+        self._writing = False
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._writing = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if options.get(b"name", b"").decode("utf-8", "replace") != self.field or b"filename" not in options:
+            return
+        if self.filename is not None:
+            raise UploadError(400, "Можно загрузить только один файл")
+        self.filename = options[b"filename"].decode("utf-8", "replace")
+        self.content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+        self._writing = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if not self._writing:
+            return
+        self.size += end - start
+        if self.size > self.limit:
+            raise UploadError(413, f"Файл слишком большой (макс. {self.limit // (1024 * 1024)} МБ)")
+        self.target.write(data[start:end])
+
+    def on_part_end(self):
+        self._writing = False
+
+
+async def receive_upload(request: Request, field: str = "file") -> tuple:
+    """
+    Принимает файл поля field из multipart-запроса потоком во временный файл.
+    Возвращает (путь, имя файла); UploadError, если файл не подходит.
+    """
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit() and int(length) > AVATAR_MAX_BYTES + MULTIPART_OVERHEAD:
+        raise UploadError(413, f"Файл слишком большой (макс. {AVATAR_MAX_BYTES // (1024 * 1024)} МБ)")
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    if b"boundary" not in params:
+        raise UploadError(400, "Ожидается multipart/form-data")
+
+    fd, path = tempfile.mkstemp(prefix="avatar-", suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as target:
+            receiver = _UploadReceiver(field, target, AVATAR_MAX_BYTES)
+            parser = multipart.MultipartParser(params[b"boundary"], {
+                "on_part_begin": receiver.on_part_begin,
+                "on_part_data": receiver.on_part_data,
+                "on_part_end": receiver.on_part_end,
+                "on_header_field": receiver.on_header_field,
+                "on_header_value": receiver.on_header_value,
+                "on_header_end": receiver.on_header_end,
+                "on_headers_finished": receiver.on_headers_finished,
+            })
+            async for chunk in request.stream():
+                parser.write(chunk)
+            parser.finalize()
+
+        if receiver.filename is None or receiver.size == 0:
+            raise UploadError(400, "Файл не передан")
+        if not receiver.content_type.startswith("image/"):
+            raise UploadError(400, "Разрешены только изображения")
+        if Path(receiver.filename).suffix.lower() not in ALLOWED_EXTENSIONS:
+            raise UploadError(400, "Недопустимое расширение файла")
+        return path, receiver.filename
+    except BaseException as e:
+        os.unlink(path)
+        if isinstance(e, Exception) and not isinstance(e, UploadError):
+            raise UploadError(400, "Не удалось разобрать загрузку") from e
+        raise
+
+
+def render_variants(source: str, prefix: str, sizes: tuple, quality: int, max_pixels: int) -> list:
+    """Квадратные WebP-копии изображения source: prefix-<размер>.webp (выполняется в пуле процессов)."""
+    with Image.open(source) as image:
+        if image.width * image.height > max_pixels:
+            raise ValueError("Слишком большое изображение")
+        # JPEG можно декодировать сразу в уменьшенном виде — быстрее и меньше памяти
+        image.draft("RGB", (max(sizes) * 2, max(sizes) * 2))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        paths = []
+        for size in sorted(sizes, reverse=True):
+            variant = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            path = f"{prefix}-{size}.webp"
+            variant.save(path, "WEBP", quality=quality, method=4)
+            paths.append(path)
+        return paths
+
+
+def _remove_avatar_files(avatar: Optional[str]):
+    # Все копии прежнего аватара (или старый файл-оригинал) из uploads/avatars
+    if not avatar or not avatar.startswith(AVATAR_URL_PREFIX + "/"):
+        return
+    match = SIZED_AVATAR.match(avatar)
+    names = [f"{match[1]}-{size}.webp" for size in AVATAR_SIZES] if match else [avatar]
+    for name in names:
+        path = AVATAR_DIR / Path(name).name
+        if path.exists():
+            path.unlink()
+
+
+class AvatarPipeline:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._tasks = set()
+        self._latest = {}  # id пользователя -> версия последней загрузки
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"))
+        return self._executor
+
+    def submit(self, user_id: int, source: str) -> str:
+        """Ставит загруженный файл в обработку; возвращает будущий URL аватара."""
+        if len(self._tasks) >= self.max_pending:
+            self.rejected += 1
+            os.unlink(source)
+            raise Saturated()
+        version = uuid.uuid4().hex[:12]
+        self._latest[user_id] = version
+        prefix = f"avatar-{user_id}-{version}"
+        task = asyncio.create_task(self._process(user_id, version, source, prefix))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return f"{AVATAR_URL_PREFIX}/{prefix}-{max(AVATAR_SIZES)}.webp"
+
+    async def _process(self, user_id: int, version: str, source: str, prefix: str):
+        avatar_url = f"{AVATAR_URL_PREFIX}/{prefix}-{max(AVATAR_SIZES)}.webp"
+        try:
+            paths = await asyncio.get_running_loop().run_in_executor(
+                self._pool(), render_variants, source, str(AVATAR_DIR / prefix), AVATAR_SIZES,
+                AVATAR_WEBP_QUALITY, AVATAR_MAX_PIXELS)
+        except Exception as e:
+            self.failed += 1
+            print(f"Не удалось обработать аватар пользователя {user_id}: {e}")
+            return
+        finally:
+            os.unlink(source)
+
+        if self._latest.get(user_id) != version:
+            # Пока шла обработка, пользователь загрузил новый аватар
+            for path in paths:
+                Path(path).unlink(missing_ok=True)
+            return
+        async with database.AsyncSessionLocal() as db:
+            old_avatar = await db.scalar(
+                select(models.User.avatar).where(models.User.id == user_id).with_for_update())
+            await db.execute(update(models.User).where(models.User.id == user_id).values(avatar=avatar_url))
+            await db.commit()
+        user_cache.cache.invalidate(user_id)
+        leaderboard.board.update_profile(user_id, avatar=avatar_url)
+        if old_avatar != avatar_url:
+            _remove_avatar_files(old_avatar)
+        self._latest.pop(user_id, None)
+        self.processed += 1
+
+    async def stop(self):
+        """Дожидается начатой обработки и закрывает пул (при shutdown)."""
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._tasks),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+pipeline = AvatarPipeline(AVATAR_WORKERS, AVATAR_MAX_PENDING)
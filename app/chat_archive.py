@@ -0,0 +1,323 @@
+"""
+Секции сообщений чата по месяцам и архив старых месяцев.
+
+Таблица messages секционирована по timestamp (миграция b7f3c9d2e8a1): секция
+messages_pГГГГММ на каждый месяц и messages_default на всякий случай. Фоновая
+задача раз в CHAT_ARCHIVE_INTERVAL секунд:
+  * создаёт секции на CHAT_PARTITIONS_AHEAD месяцев вперёд (строки месяца, уже
+    попавшие в messages_default, переносятся в его секцию — иначе Postgres её не создаст);
+  * месяцы старше CHAT_HOT_MONTHS (считая текущий) выгружает в
+    CHAT_ARCHIVE_DIR/messages-ГГГГ-ММ.<min id>-<max id>.ndjson.gz — по строке
+    JSON на сообщение в формате API, — после чего секция отсоединяется и удаляется.
+Файл пишется во временный, синхронизируется на диск и переименовывается до
+удаления секции в той же транзакции; если commit не прошёл, файл перезапишется
+при следующем запуске, а пока секция есть, история читается из БД.
+Из нескольких процессов uvicorn работу делает один (advisory lock).
+
+history() отдаёт страницы истории из БД, а когда горячие месяцы кончаются —
+из архива: файлы месяца читаются целиком и держатся в памяти (LRU на
+CHAT_ARCHIVE_CACHE месяцев). Диапазон id в имени файла позволяет найти
+архивированное сообщение по id, открыв только файлы, в диапазон которых оно попадает. Горячие запросы (кэш chat_cache) ограничены
+последними CHAT_HOT_DAYS днями и затрагивают только свежие секции.
+"""
+import asyncio
+import bisect
+import datetime
+import gzip
+import json
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import func, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from . import chat_hub, database, models
+
+CHAT_ARCHIVE_DIR = Path(os.environ.get("CHAT_ARCHIVE_DIR", "archive/messages"))
+CHAT_ARCHIVE_INTERVAL = float(os.environ.get("CHAT_ARCHIVE_INTERVAL", "3600"))
+CHAT_HOT_MONTHS = int(os.environ.get("CHAT_HOT_MONTHS", "3"))
+CHAT_PARTITIONS_AHEAD = int(os.environ.get("CHAT_PARTITIONS_AHEAD", "2"))
+CHAT_ARCHIVE_CHUNK = int(os.environ.get("CHAT_ARCHIVE_CHUNK", "5000"))
+CHAT_ARCHIVE_CACHE = int(os.environ.get("CHAT_ARCHIVE_CACHE", "4"))
+CHAT_HOT_DAYS = float(os.environ.get("CHAT_HOT_DAYS", "7"))
+LOCK_KEY = 0x63686174  # pg_try_advisory_xact_lock для задачи архивации
+PARTITION_NAME = re.compile(r"^messages_p(\d{4})(\d{2})$")
+ARCHIVE_NAME = re.compile(r"^messages-(\d{4})-(\d{2})(?:\.(\d+)-(\d+))?\.ndjson\.gz$")
+
+
+def month_start(value: datetime.date) -> datetime.date:
+    return datetime.date(value.year, value.month, 1)
+
+
+def next_month(month: datetime.date) -> datetime.date:
+    return (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def hot_since() -> datetime.datetime:
+    """Нижняя граница timestamp для горячих запросов чата (отсекает старые секции)."""
+    return datetime.datetime.now() - datetime.timedelta(days=CHAT_HOT_DAYS)
+
+
+def _payloads(messages) -> List[dict]:
+    return [chat_hub.message_payload(message, message.user.name if message.user else None) for message in messages]
+
+
+def _write_archive(path: Path, chunks: List[str]):
+    # Временный файл -> fsync -> rename: на диске либо полный архив месяца, либо ничего
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+            for chunk in chunks:
+                archive.write(chunk.encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    # Файл того же месяца под другим именем мог остаться от прерванной архивации
+    for other in path.parent.glob(path.name[:len("messages-YYYY-MM")] + "*.ndjson.gz"):
+        if other != path:
+            other.unlink(missing_ok=True)
+
+
+def _read_archive(path: Path) -> list:
+    entries = []
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        for line in archive:
+            payload = json.loads(line)
+            entries.append((datetime.datetime.fromisoformat(payload["timestamp"]), payload["id"], payload))
+    entries.sort(key=lambda entry: entry[:2])
+    return entries
+
+
+class ChatArchive:
+    def __init__(self, directory: Path, interval: float, hot_months: int, ahead: int, chunk: int, cache_months: int):
+        self.directory = directory
+        self.interval = interval
+        self.hot_months = hot_months
+        self.ahead = ahead
+        self.chunk = chunk
+        self.cache_months = cache_months
+        self.db_months = set()  # месяцы, чьи секции есть в БД
+        self._cache = OrderedDict()  # месяц -> [(timestamp, id, сообщение)] по возрастанию
+        self._task = None
+        self.archived_months = 0
+        self.recovered_months = 0  # месяцы, чьи строки пришлось переносить из messages_default
+        self.archived_messages = 0
+        self.archive_reads = 0
+
+    def path(self, month: datetime.date, ids: Optional[tuple] = None) -> Path:
+        """Файл архива месяца; ids — (min id, max id) его сообщений."""
+        suffix = f".{ids[0]}-{ids[1]}" if ids else ""
+        return self.directory / f"messages-{month:%Y-%m}{suffix}.ndjson.gz"
+
+    def archived(self) -> dict:
+        """Архив месяцев, которых уже нет в БД: месяц -> (файл, (min id, max id) или None), по убыванию."""
+        files = {}
+        for path in sorted(self.directory.glob("messages-*.ndjson.gz")):
+            match = ARCHIVE_NAME.match(path.name)
+            if match is None:
+                continue
+            month = datetime.date(int(match[1]), int(match[2]), 1)
+            if month in self.db_months:
+                continue
+            ids = (int(match[3]), int(match[4])) if match[3] else None
+            if month not in files or ids is not None:
+                files[month] = (path, ids)
+        return dict(sorted(files.items(), reverse=True))
+
+    async def _partitions(self, db: AsyncSession) -> dict:
+        names = await db.scalars(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'messages'::regclass"))
+        partitions = {}
+        for name in names:
+            match = PARTITION_NAME.match(name)
+            if match:
+                partitions[datetime.date(int(match[1]), int(match[2]), 1)] = name
+        return partitions
+
+    async def _ensure_partitions(self, db: AsyncSession, existing: dict):
+        await db.execute(text("CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT"))
+        month = month_start(datetime.date.today())
+        for _ in range(self.ahead + 1):
+            if month not in existing:
+                await self._create_partition(db, month)
+            month = next_month(month)
+
+    async def _create_partition(self, db: AsyncSession, month: datetime.date):
+        """
+        Создаёт секцию месяца. Строки этого месяца, попавшие в messages_default (секции ещё
+        не было), Postgres не даст оставить там — они переносятся в новую секцию.
+        """
+        start, end = month.isoformat(), next_month(month).isoformat()
+        in_month = f"timestamp >= '{start}' AND timestamp < '{end}'"
+        stray = await db.scalar(text(f"SELECT EXISTS (SELECT 1 FROM messages_default WHERE {in_month})"))
+        if stray:
+            await db.execute(text(
+                f"CREATE TEMP TABLE messages_stray AS SELECT * FROM messages_default WHERE {in_month}"))
+            await db.execute(text(f"DELETE FROM messages_default WHERE {in_month}"))
+        await db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS messages_p{month:%Y%m} PARTITION OF messages "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"))
+        if stray:
+            await db.execute(text("INSERT INTO messages SELECT * FROM messages_stray"))
+            await db.execute(text("DROP TABLE messages_stray"))
+            self.recovered_months += 1
+
+    async def _archive(self, db: AsyncSession, month: datetime.date, name: str) -> int:
+        """Выгружает месяц в файл и удаляет его секцию (в открытой транзакции с блокировкой)."""
+        start, end = datetime.datetime.combine(month, datetime.time()), \
+            datetime.datetime.combine(next_month(month), datetime.time())
+        chunks = []
+        after = (start - datetime.timedelta(microseconds=1), 0)
+        count = 0
+        ids = None
+        while True:
+            # Пакетами по (timestamp, id) в пределах месяца — читается только его секция
+            rows = list(await db.scalars(
+                select(models.Message).options(joinedload(models.Message.user))
+                .where(models.Message.timestamp >= start, models.Message.timestamp < end,
+                       tuple_(models.Message.timestamp, models.Message.id) > after)
+                .order_by(models.Message.timestamp, models.Message.id)
+                .limit(self.chunk)))
+            if not rows:
+                break
+            chunks.append("".join(json.dumps(payload, ensure_ascii=False) + "\n" for payload in _payloads(rows)))
+            count += len(rows)
+            low, high = min(row.id for row in rows), max(row.id for row in rows)
+            ids = (min(ids[0], low), max(ids[1], high)) if ids else (low, high)
+            after = (rows[-1].timestamp, rows[-1].id)
+            db.expunge_all()
+        await asyncio.to_thread(_write_archive, self.path(month, ids), chunks)
+        await db.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+        await db.execute(text(f"DROP TABLE {name}"))
+        return count
+
+    async def run_once(self) -> int:
+        """Создаёт будущие секции и архивирует старые; возвращает число архивированных месяцев."""
+        archived = 0
+        async with database.AsyncSessionLocal() as db:
+            if not await db.scalar(select(func.pg_try_advisory_xact_lock(LOCK_KEY))):
+                # Этим занят другой процесс; просто обновляем список секций
+                self.db_months = set(await self._partitions(db))
+                await db.rollback()
+                return 0
+            partitions = await self._partitions(db)
+            await self._ensure_partitions(db, partitions)
+            await db.commit()
+
+            cutoff = month_start(datetime.date.today())
+            for _ in range(self.hot_months - 1):
+                cutoff = month_start(cutoff - datetime.timedelta(days=1))
+            for month, name in sorted(partitions.items()):
+                if month >= cutoff:
+                    continue
+                if not await db.scalar(select(func.pg_try_advisory_xact_lock(LOCK_KEY))):
+                    break
+                count = await self._archive(db, month, name)
+                await db.commit()
+                self._cache.pop(month, None)
+                self.archived_months += 1
+                self.archived_messages += count
+                archived += 1
+            self.db_months = set(await self._partitions(db))
+            await db.commit()
+        return archived
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Ошибка обслуживания секций чата: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        # Секции текущего месяца должны быть до первой записи сообщений
+        await self.run_once()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _month(self, month: datetime.date, path: Path) -> list:
+        entries = self._cache.get(month)
+        if entries is None:
+            entries = await asyncio.to_thread(_read_archive, path)
+            self.archive_reads += 1
+            self._cache[month] = entries
+            if len(self._cache) > self.cache_months:
+                self._cache.popitem(last=False)
+        self._cache.move_to_end(month)
+        return entries
+
+    async def find(self, message_id: int) -> Optional[tuple]:
+        """(timestamp, id) архивированного сообщения или None."""
+        for month, (path, ids) in self.archived().items():
+            # Открываем только файлы, в диапазон id которых сообщение попадает
+            if ids is not None and not ids[0] <= message_id <= ids[1]:
+                continue
+            for timestamp, entry_id, _ in await self._month(month, path):
+                if entry_id == message_id:
+                    return timestamp, entry_id
+        return None
+
+    async def before(self, anchor: tuple, limit: int) -> List[dict]:
+        """До limit архивированных сообщений перед anchor=(timestamp, id), от новых к старым."""
+        result = []
+        for month, (path, _) in self.archived().items():
+            if month > anchor[0].date():
+                continue
+            entries = await self._month(month, path)
+            position = bisect.bisect_left(entries, anchor, key=lambda entry: entry[:2])
+            for i in range(position - 1, -1, -1):
+                result.append(entries[i][2])
+                if len(result) == limit:
+                    return result
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "db_months": len(self.db_months),
+            "archived_months": self.archived_months,
+            "archived_messages": self.archived_messages,
+            "recovered_months": self.recovered_months,
+            "archive_reads": self.archive_reads,
+            "cached_months": len(self._cache),
+        }
+
+
+archive = ChatArchive(CHAT_ARCHIVE_DIR, CHAT_ARCHIVE_INTERVAL, CHAT_HOT_MONTHS, CHAT_PARTITIONS_AHEAD,
+                      CHAT_ARCHIVE_CHUNK, CHAT_ARCHIVE_CACHE)
+
+
+async def history(db: AsyncSession, before_id: int, limit: int) -> List[dict]:
+    """Страница истории: limit сообщений перед before_id по (timestamp, id), по возрастанию; с архивом."""
+    anchor = (await db.execute(
+        select(models.Message.timestamp, models.Message.id).where(models.Message.id == before_id))).first()
+    if anchor is None:
+        anchor = await archive.find(before_id)
+        if anchor is None:
+            return []
+    anchor = tuple(anchor)
+    # Граница — значения, а не подзапрос: секции новее anchor отсекаются при планировании
+    rows = list(await db.scalars(
+        select(models.Message).options(joinedload(models.Message.user))
+        .where(tuple_(models.Message.timestamp, models.Message.id) < anchor)
+        .order_by(models.Message.timestamp.desc(), models.Message.id.desc())
+        .limit(limit)))
+    page = _payloads(rows)
+    if len(page) < limit:
+        # Горячие месяцы кончились — продолжаем из архива
+        oldest = (rows[-1].timestamp, rows[-1].id) if rows else anchor
+        page += await archive.before(oldest, limit - len(page))
+    return page[::-1]
@@ -0,0 +1,151 @@
+"""
+Кэш последних сообщений чата.
+
+Последние CHAT_BUFFER_SIZE сообщений держатся в памяти кольцевым буфером
+(deque с maxlen) уже в формате API, с именами авторов. Буфер загружается из БД
+при первом запросе и дальше пополняется каждой доставкой хаба chat_hub —
+сообщениями этого и (с бэкендом postgres) других процессов.
+
+GET /api/chat/messages:
+  без параметров — последние limit сообщений из буфера;
+  ?since_id=N    — сообщения новее N (дельта для опроса); если клиент уже всё
+                   получил, пустой ответ без запроса к БД;
+  ?before_id=N   — страница истории старше N (chat_archive.history).
+В БД уходят только дельты, начинающиеся раньше буфера, и история. Буфер и
+дельты охватывают последние CHAT_HOT_DAYS дней (chat_archive.hot_since), поэтому
+их запросы затрагивают только свежие секции messages.
+"""
+import asyncio
+import bisect
+import os
+from collections import deque
+from typing import List
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from . import chat_archive, chat_hub, models
+
+CHAT_BUFFER_SIZE = int(os.environ.get("CHAT_BUFFER_SIZE", "200"))
+
+
+def _payloads(messages) -> List[dict]:
+    return [chat_hub.message_payload(message, message.user.name if message.user else None) for message in messages]
+
+
+class ChatBuffer:
+    def __init__(self, size: int):
+        self.size = size
+        self._messages = deque(maxlen=size)  # по возрастанию id
+        self._loaded = False
+        self._complete = False  # в буфере весь горячий чат (сообщений за CHAT_HOT_DAYS меньше size)
+        self._pending = None  # доставки во время загрузки из БД
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    def append(self, payload: dict):
+        """Новое сообщение от хаба (вызывается на каждую доставку)."""
+        if self._pending is not None:
+            self._pending.append(payload)
+        elif self._loaded:
+            self._insert(payload)
+
+    def _insert(self, payload: dict):
+        messages = self._messages
+        if not messages or payload["id"] > messages[-1]["id"]:
+            if len(messages) == self.size:
+                self._complete = False
+            messages.append(payload)
+            return
+        # Из другого процесса сообщения могут прийти не по порядку id
+        position = bisect.bisect_left([message["id"] for message in messages], payload["id"])
+        if position < len(messages) and messages[position]["id"] == payload["id"]:
+            return
+        if position == 0 and len(messages) == self.size:
+            return
+        if len(messages) == self.size:
+            messages.popleft()
+            self._complete = False
+            position -= 1
+        messages.insert(position, payload)
+
+    def reset(self):
+        """Буфер мог пропустить сообщения — следующий запрос загрузит его заново."""
+        self._loaded = False
+        self._messages.clear()
+
+    async def _ensure_loaded(self, db: AsyncSession):
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            self._pending = []
+            try:
+                rows = list(await db.scalars(
+                    select(models.Message).options(joinedload(models.Message.user))
+                    .where(models.Message.timestamp >= chat_archive.hot_since())
+                    .order_by(models.Message.id.desc()).limit(self.size)))
+            except BaseException:
+                self._pending = None
+                raise
+            self._messages.clear()
+            self._messages.extend(_payloads(reversed(rows)))
+            self._complete = len(rows) < self.size
+            self._loaded = True
+            pending, self._pending = self._pending, None
+            for payload in pending:
+                self._insert(payload)
+            self.loads += 1
+
+    def _covers(self, since_id: int) -> bool:
+        # В буфере все сообщения новее since_id
+        return self._complete or (bool(self._messages) and since_id >= self._messages[0]["id"])
+
+    async def latest(self, db: AsyncSession, limit: int) -> List[dict]:
+        """Последние limit сообщений по возрастанию id."""
+        await self._ensure_loaded(db)
+        if limit <= len(self._messages) or self._complete:
+            self.hits += 1
+            return list(self._messages)[-limit:]
+        self.misses += 1
+        rows = list(await db.scalars(
+            select(models.Message).options(joinedload(models.Message.user))
+            .where(models.Message.timestamp >= chat_archive.hot_since())
+            .order_by(models.Message.id.desc()).limit(limit)))
+        return _payloads(reversed(rows))
+
+    async def since(self, db: AsyncSession, since_id: int, limit: int) -> List[dict]:
+        """До limit сообщений новее since_id, начиная с самого старого из них."""
+        await self._ensure_loaded(db)
+        messages = self._messages
+        if self._covers(since_id):
+            self.hits += 1
+            if not messages or since_id >= messages[-1]["id"]:
+                return []
+            ids = [message["id"] for message in messages]
+            start = bisect.bisect_right(ids, since_id)
+            return [messages[i] for i in range(start, min(len(messages), start + limit))]
+        self.misses += 1
+        rows = await db.scalars(
+            select(models.Message).options(joinedload(models.Message.user))
+            .where(models.Message.id > since_id, models.Message.timestamp >= chat_archive.hot_since())
+            .order_by(models.Message.id).limit(limit))
+        return _payloads(rows)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._messages),
+            "loaded": self._loaded,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+        }
+
+
+buffer = ChatBuffer(CHAT_BUFFER_SIZE)
+chat_hub.hub.add_listener(buffer)
+
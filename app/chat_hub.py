@@ -0,0 +1,211 @@
+"""
+Рассылка сообщений чата подключённым клиентам (/ws/chat).
+
+Сообщение публикуется один раз после записи в БД (chat_writer), а
+хаб раскладывает его по очередям подписчиков этого процесса; каждый веб-сокет
+забирает сообщения из своей очереди. Вместо опроса /api/chat/messages каждым
+клиентом — одна запись и одна рассылка на сообщение.
+
+Доставку между процессами uvicorn выбирает CHAT_PUBSUB_BACKEND:
+  memory   — внутри процесса (один воркер, по умолчанию);
+  postgres — через LISTEN/NOTIFY: публикация делает pg_notify, а каждый процесс
+             слушает канал на отдельном соединении asyncpg и раздаёт
+             сообщения своим подписчикам (в том числе и публикующий процесс).
+
+Помимо веб-сокетов, на хаб подписываются слушатели внутри процесса (add_listener,
+например кэш последних сообщений chat_cache): append(сообщение) на каждую
+доставку и reset() после переподключения к каналу, когда часть сообщений могла
+быть пропущена.
+
+Очередь подписчика ограничена CHAT_SUBSCRIBER_QUEUE сообщениями: клиент, который
+не успевает читать, отключается, а не копит память сервера.
+"""
+import asyncio
+import json
+import os
+from typing import Optional
+
+import asyncpg
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+
+from . import database, models
+
+CHAT_PUBSUB_BACKEND = os.environ.get("CHAT_PUBSUB_BACKEND", "memory")
+CHAT_CHANNEL = os.environ.get("CHAT_CHANNEL", "chat_messages")
+CHAT_SUBSCRIBER_QUEUE = int(os.environ.get("CHAT_SUBSCRIBER_QUEUE", "100"))
+CHAT_LISTEN_RETRY = float(os.environ.get("CHAT_LISTEN_RETRY", "2"))
+# Полезная нагрузка NOTIFY ограничена 8000 байтами; длинные сообщения передаются по id
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+
+def message_payload(message: models.Message, user_name: Optional[str]) -> dict:
+    """Сообщение в формате API чата."""
+    return {
+        "id": message.id,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat() if message.timestamp else None,
+        "user_id": message.user_id,
+        "user_name": user_name or "Удаленный пользователь",
+    }
+
+
+class MemoryBackend:
+    """Доставка внутри процесса: публикация сразу раздаётся подписчикам."""
+
+    name = "memory"
+
+    def __init__(self, deliver):
+        self.deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish_many(self, payloads: list):
+        for payload in payloads:
+            self.deliver(payload)
+
+
+class PostgresBackend:
+    """Доставка между процессами через PostgreSQL LISTEN/NOTIFY."""
+
+    name = "postgres"
+
+    def __init__(self, deliver, reset, channel: str, retry: float):
+        self.deliver = deliver
+        self.reset = reset
+        self.channel = channel
+        self.retry = retry
+        self._listener = None
+        self.reconnects = 0
+
+    def _dsn(self) -> str:
+        # Та же база, что у async_engine, но для asyncpg напрямую (без драйвера в схеме URL)
+        return database.async_engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+    def _on_notify(self, connection, pid, channel, raw: str):
+        payload = json.loads(raw)
+        if "content" in payload:
+            self.deliver(payload)
+        else:
+            asyncio.get_running_loop().create_task(self._deliver_by_id(payload["id"]))
+
+    async def _deliver_by_id(self, message_id: int):
+        async with database.AsyncSessionLocal() as db:
+            message = await db.scalar(select(models.Message).options(joinedload(models.Message.user))
+                                      .where(models.Message.id == message_id))
+        if message is not None:
+            self.deliver(message_payload(message, message.user.name if message.user else None))
+
+    async def _listen(self):
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self._dsn())
+                await connection.add_listener(self.channel, self._on_notify)
+                # Пока канал не слушался, сообщения могли пройти мимо
+                self.reset()
+                # Ждём, пока соединение живо; при обрыве переподключаемся
+                while not connection.is_closed():
+                    await asyncio.sleep(self.retry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Ошибка подписки на канал чата {self.channel}: {e}")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            self.reconnects += 1
+            await asyncio.sleep(self.retry)
+
+    async def start(self):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    async def publish_many(self, payloads: list):
+        # Все уведомления пачки — одно соединение и одна транзакция
+        async with database.async_engine.connect() as connection:
+            for payload in payloads:
+                raw = json.dumps(payload, ensure_ascii=False)
+                if len(raw.encode()) > NOTIFY_PAYLOAD_LIMIT:
+                    raw = json.dumps({"id": payload["id"]})
+                await connection.execute(select(func.pg_notify(self.channel, raw)))
+            await connection.commit()
+
+
+class ChatHub:
+    def __init__(self, backend: str, channel: str, queue_size: int, retry: float):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._listeners = []
+        if backend == "postgres":
+            self.backend = PostgresBackend(self._deliver, self.reset, channel, retry)
+        else:
+            self.backend = MemoryBackend(self._deliver)
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def reset(self):
+        """Сообщает слушателям, что часть сообщений могла не дойти."""
+        for listener in self._listeners:
+            listener.reset()
+
+    def _deliver(self, payload: dict):
+        for listener in self._listeners:
+            listener.append(payload)
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(payload)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                # Клиент не успевает читать: None в очереди — сигнал веб-сокету закрыться
+                self._subscribers.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+                self.dropped += 1
+
+    async def publish(self, payload: dict):
+        await self.publish_many([payload])
+
+    async def publish_many(self, payloads: list):
+        await self.backend.publish_many(payloads)
+        self.published += len(payloads)
+
+    async def start(self):
+        await self.backend.start()
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+hub = ChatHub(CHAT_PUBSUB_BACKEND, CHAT_CHANNEL, CHAT_SUBSCRIBER_QUEUE, CHAT_LISTEN_RETRY)
@@ -0,0 +1,227 @@
+"""
+Отложенная пакетная запись сообщений чата (write-behind).
+
+send_message не пишет сообщение в БД сам: ему сразу выдаётся id из блока,
+заранее взятого из последовательности messages_id_seq (один запрос на
+CHAT_ID_BLOCK сообщений), и сообщение встаёт в очередь процесса. Фоновая задача
+сбрасывает очередь в messages многострочным INSERT — через CHAT_FLUSH_INTERVAL
+секунд после первого сообщения пачки или сразу, как наберётся CHAT_FLUSH_BATCH
+сообщений, — одной транзакцией, после чего рассылает пачку через chat_hub.
+Всплеск сообщений превращается в несколько INSERT и commit вместо commit на каждое.
+
+Время сообщения — по часам БД, как у default=now(): вместе с блоком id берётся
+localtimestamp, и дальше к нему прибавляется время по time.monotonic(). Так
+messages, секционированная по месяцам времени БД, не получает строк в чужую
+(или DEFAULT) секцию на границе месяца из-за расхождения часов или часового пояса.
+
+Гарантии сохранности:
+  * ответ клиенту уходит до записи в БД; при аварийном завершении процесса
+    (kill -9, падение машины) теряются сообщения за последний интервал сброса;
+  * при штатной остановке (shutdown) очередь сбрасывается полностью;
+  * клиенты (веб-сокеты, кэш chat_cache) видят сообщение только после commit —
+    несохранённое сообщение никому не показывается;
+  * если БД недоступна, несохранённая часть пачки возвращается в начало очереди
+    и сбрасывается повторно (сбросы идут по одному, порядок не меняется);
+  * при CHAT_WRITE_MAX_PENDING сообщениях в очереди новое сообщение в неё не
+    ставится: send_message выбрасывает Saturated (эндпоинт отвечает 503), и
+    повтор отправки не создаёт дубликата;
+  * строка, которую БД отвергла (например, автор удалён), пропускается с записью в лог.
+
+id выдаются блоками на процесс, поэтому при нескольких процессах uvicorn
+сообщения разных процессов нумеруются не по времени отправки: для дельт
+?since_id= с несколькими воркерами используйте /ws/chat или уменьшите CHAT_ID_BLOCK.
+"""
+import asyncio
+import datetime
+import os
+import time
+from collections import deque
+
+from sqlalchemy import func, insert, literal_column, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import chat_hub, database, models
+
+CHAT_FLUSH_INTERVAL = float(os.environ.get("CHAT_FLUSH_INTERVAL", "0.01"))
+CHAT_FLUSH_BATCH = int(os.environ.get("CHAT_FLUSH_BATCH", "500"))
+CHAT_ID_BLOCK = int(os.environ.get("CHAT_ID_BLOCK", "100"))
+CHAT_WRITE_MAX_PENDING = int(os.environ.get("CHAT_WRITE_MAX_PENDING", "10000"))
+
+
+class Saturated(Exception):
+    """Очередь записи сообщений заполнена; отправку нужно повторить позже."""
+
+
+class _PartialWrite(Exception):
+    """БД отказала посреди построчной записи: первые done строк обработаны, из них записаны written."""
+
+    def __init__(self, written: list, done: int, error: BaseException):
+        super().__init__(str(error))
+        self.written = written
+        self.done = done
+        self.error = error
+
+
+class ChatWriter:
+    def __init__(self, interval: float, batch: int, id_block: int, max_pending: int):
+        self.interval = interval
+        self.batch = batch
+        self.id_block = id_block
+        self.max_pending = max_pending
+        self._pending = []  # (строка для INSERT, сообщение в формате API)
+        self._ids = deque()
+        self._ids_lock = asyncio.Lock()
+        self._clock = None  # (localtimestamp БД, time.monotonic() в момент его получения)
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        self.flushed = 0
+        self.batches = 0
+        self.rejected = 0
+        self.saturated = 0
+        self.ids_reserved = 0
+
+    async def _reserve_ids(self, db: AsyncSession) -> list:
+        # Имя последовательности — литерал, а не параметр: nextval ждёт regclass
+        rows = (await db.execute(
+            select(func.nextval(literal_column("'messages_id_seq'")), func.localtimestamp())
+            .select_from(func.generate_series(1, self.id_block)))).all()
+        self._clock = (rows[0][1], time.monotonic())
+        return [message_id for message_id, _ in rows]
+
+    def _now(self) -> datetime.datetime:
+        """Текущее время по часам БД (см. _reserve_ids)."""
+        db_now, received = self._clock
+        return db_now + datetime.timedelta(seconds=time.monotonic() - received)
+
+    async def _next_id(self, db: AsyncSession) -> int:
+        if not self._ids:
+            async with self._ids_lock:
+                if not self._ids:
+                    ids = await self._reserve_ids(db)
+                    self._ids.extend(ids)
+                    self.ids_reserved += len(ids)
+        return self._ids.popleft()
+
+    async def submit(self, db: AsyncSession, user_id: int, content: str, user_name=None) -> dict:
+        """
+        Ставит сообщение в очередь записи; возвращает его в формате API (с id).
+        Saturated, если очередь заполнена (БД не успевает или недоступна).
+        """
+        if len(self._pending) >= self.max_pending:
+            # Сообщение в очередь не попадает (и id на него не тратится) — повтор отправки
+            # не создаст дубликата
+            self.saturated += 1
+            self._wakeup.set()
+            raise Saturated()
+        message_id = await self._next_id(db)
+        message = models.Message(id=message_id, user_id=user_id, content=content, timestamp=self._now())
+        payload = chat_hub.message_payload(message, user_name)
+        self._pending.append(({"id": message.id, "user_id": user_id, "content": content,
+                                "timestamp": message.timestamp}, payload))
+        self._wakeup.set()
+        return payload
+
+    async def _write(self, rows: list) -> list:
+        """Пишет строки пачки; возвращает индексы записанных."""
+        try:
+            async with database.AsyncSessionLocal() as db:
+                await db.execute(insert(models.Message), rows)
+                await db.commit()
+            return list(range(len(rows)))
+        except IntegrityError:
+            pass
+        # Пачку отвергла одна из строк — пишем по одной, отвергнутые пропускаем
+        written = []
+        done = 0
+        try:
+            async with database.AsyncSessionLocal() as db:
+                for i, row in enumerate(rows):
+                    try:
+                        await db.execute(insert(models.Message), [row])
+                        await db.commit()
+                        written.append(i)
+                    except IntegrityError as e:
+                        await db.rollback()
+                        self.rejected += 1
+                        print(f"Сообщение {row['id']} не сохранено: {e}")
+                    done = i + 1
+        except BaseException as e:
+            # Первые done строк уже обработаны — повторять нужно только остаток
+            raise _PartialWrite(written, done, e)
+        return written
+
+    async def flush(self) -> int:
+        """Сбрасывает очередь в БД пачками; возвращает число записанных сообщений."""
+        # Сбросы по одному: иначе пачки, возвращённые в очередь после ошибки, перемешаются
+        async with self._flush_lock:
+            total = 0
+            while self._pending:
+                batch, self._pending = self._pending[:self.batch], self._pending[self.batch:]
+                try:
+                    written = await self._write([row for row, _ in batch])
+                except _PartialWrite as e:
+                    # Записанное публикуем, остаток пачки вернётся в начало очереди
+                    self._pending[:0] = batch[e.done:]
+                    await self._publish([batch[i][1] for i in e.written])
+                    raise e.error
+                except BaseException:
+                    # БД недоступна или задача отменена — пачка вернётся в начало очереди
+                    self._pending[:0] = batch
+                    raise
+                self.batches += 1
+                total += await self._publish([batch[i][1] for i in written])
+            return total
+
+    async def _publish(self, payloads: list) -> int:
+        self.flushed += len(payloads)
+        if payloads:
+            try:
+                await chat_hub.hub.publish_many(payloads)
+            except Exception as e:
+                print(f"Не удалось разослать сообщения чата: {e}")
+                chat_hub.hub.reset()
+        return len(payloads)
+
+    async def _loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if len(self._pending) < self.batch:
+                # Собираем пачку в течение интервала
+                await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Не удалось записать сообщения чата: {e}")
+                await asyncio.sleep(self.interval * 100)
+                self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Останавливает фоновую запись и сбрасывает остаток очереди (при shutdown)."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"При остановке не записано сообщений чата: {len(self._pending)} ({e})")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "saturated": self.saturated,
+            "ids_reserved": self.ids_reserved,
+        }
+
+
+writer = ChatWriter(CHAT_FLUSH_INTERVAL, CHAT_FLUSH_BATCH, CHAT_ID_BLOCK, CHAT_WRITE_MAX_PENDING)
@@ -0,0 +1,183 @@
+"""
+Кэш результатов компиляции C++ и Java.
+
+Ключ — sha256 от языка, флагов компилятора и исходного кода. Артефакты
+хранятся на диске в каталоге <COMPILE_CACHE_DIR>/<ключ>/, при превышении
+лимита размера удаляются давно не использовавшиеся записи (LRU).
+Ошибки компиляции тоже кэшируются: для того же кода они те же.
+Одновременные компиляции одинакового кода объединяются в одну.
+"""
+import asyncio
+import contextlib
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+CACHE_DIR = os.environ.get("COMPILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "codequest-compile-cache"))
+CACHE_MAX_BYTES = int(os.environ.get("COMPILE_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+# Файл в каталоге записи, в котором хранится вывод неудачной компиляции
+ERROR_FILE = "compile_error.txt"
+# Префикс каталогов, в которых идёт сборка (незавершённые записи)
+BUILD_PREFIX = "tmp-"
+
+
+class CompiledArtifact:
+    """Запись кэша: каталог с артефактами или текст ошибки компиляции."""
+
+    def __init__(self, key: str, path: Path, error=None):
+        self.key = key
+        self.path = path
+        self.error = error
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class CompileCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # ключ -> размер; порядок = давность использования
+        self._total_bytes = 0
+        self._inflight = {}  # ключ -> задача компиляции
+        self._leases = Counter()  # ключ -> число запусков, использующих запись прямо сейчас
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(language: str, source: str, flags) -> str:
+        digest = hashlib.sha256()
+        for part in (language, "\0".join(flags), source):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\x00\x01")
+        return digest.hexdigest()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
+
+    def _load(self):
+        """Восстанавливает индекс из каталога кэша (после перезапуска приложения)."""
+        if self._loaded:
+            return
+        self._loaded = True
+        self.root.mkdir(parents=True, exist_ok=True)
+        entries = []
+        for path in self.root.iterdir():
+            if not path.is_dir():
+                continue
+            if path.name.startswith(BUILD_PREFIX):
+                # Сборка, прерванная падением процесса
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            entries.append((path.stat().st_mtime, path.name, _dir_size(path)))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _artifact(self, key: str) -> CompiledArtifact:
+        path = self.root / key
+        error_path = path / ERROR_FILE
+        error = error_path.read_text(encoding="utf-8") if error_path.exists() else None
+        return CompiledArtifact(key, path, error)
+
+    def _evict(self):
+        for key in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if self._leases[key]:
+                continue
+            size = self._entries.pop(key)
+            self._total_bytes -= size
+            self.evictions += 1
+            shutil.rmtree(self.root / key, ignore_errors=True)
+
+    async def _build(self, key: str, compile_fn) -> CompiledArtifact:
+        build_dir = Path(tempfile.mkdtemp(prefix=BUILD_PREFIX, dir=self.root))
+        try:
+            result = await compile_fn(str(build_dir))
+            if result.returncode != 0:
+                (build_dir / ERROR_FILE).write_text(result.stderr, encoding="utf-8")
+            final_dir = self.root / key
+            try:
+                os.rename(build_dir, final_dir)
+            except OSError:
+                # Запись уже появилась (например, её собрал другой процесс uvicorn)
+                shutil.rmtree(build_dir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+
+        size = _dir_size(final_dir)
+        self._entries[key] = size
+        self._total_bytes += size
+        return self._artifact(key)
+
+    @contextlib.asynccontextmanager
+    async def compiled(self, language: str, source: str, flags, compile_fn):
+        """
+        Возвращает скомпилированный артефакт, при промахе вызывая compile_fn(build_dir).
+        Пока блок with выполняется, запись не будет удалена при вытеснении.
+        """
+        self._load()
+        key = self.make_key(language, source, flags)
+
+        if key in self._entries and (self.root / key).is_dir():
+            self.hits += 1
+            self._entries.move_to_end(key)
+            os.utime(self.root / key)
+            artifact = self._artifact(key)
+        else:
+            if key in self._entries:
+                # Каталог удалили извне — забываем запись
+                self._total_bytes -= self._entries.pop(key)
+            task = self._inflight.get(key)
+            if task is None:
+                self.misses += 1
+                task = asyncio.ensure_future(self._build(key, compile_fn))
+                self._inflight[key] = task
+                task.add_done_callback(lambda t: self._build_done(key, t))
+            else:
+                self.coalesced += 1
+            # shield: отмена одного запроса не прерывает компиляцию, которую ждут другие
+            artifact = await asyncio.shield(task)
+
+        self._leases[key] += 1
+        try:
+            yield artifact
+        finally:
+            self._leases[key] -= 1
+            if not self._leases[key]:
+                del self._leases[key]
+            self._evict()
+
+    def _build_done(self, key: str, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # помечаем исключение как обработанное
+
+
+cache = CompileCache(CACHE_DIR, CACHE_MAX_BYTES)
@@ -0,0 +1,66 @@
+"""
+Множества выполненных задач по пользователям.
+
+Списки задач (/tasks, /api/tasks) отмечают выполненные задачи проверкой
+task_id in set — O(1) на задачу вместо поиска по списку. Множество пользователя
+загружается из user_tasks один раз и затем пополняется в complete_task этого
+процесса; запись живёт COMPLETION_INDEX_TTL секунд, поэтому задачи, выполненные
+через другой процесс uvicorn, появятся здесь не позже чем через это время.
+"""
+import os
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models
+
+COMPLETION_INDEX_TTL = float(os.environ.get("COMPLETION_INDEX_TTL", "30"))
+COMPLETION_INDEX_SIZE = int(os.environ.get("COMPLETION_INDEX_SIZE", "10000"))
+
+
+class CompletionIndex:
+    def __init__(self, ttl: float, max_users: int):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._users = OrderedDict()  # id пользователя -> (множество id задач, когда устаревает)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, db: AsyncSession, user_id: int) -> set:
+        """Id задач, выполненных пользователем (множество не изменять)."""
+        entry = self._users.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            self._users.move_to_end(user_id)
+            return entry[0]
+
+        self.misses += 1
+        completed = set(await db.scalars(
+            select(models.UserTask.task_id).where(models.UserTask.user_id == user_id)))
+        self._users[user_id] = (completed, time.monotonic() + self.ttl)
+        self._users.move_to_end(user_id)
+        if len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return completed
+
+    def add(self, user_id: int, task_id: int):
+        """Отмечает задачу выполненной (вызывается после commit в complete_task)."""
+        entry = self._users.get(user_id)
+        if entry is not None:
+            entry[0].add(task_id)
+
+    def invalidate(self, user_id: int):
+        self._users.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "task_ids": sum(len(entry[0]) for entry in self._users.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+index = CompletionIndex(COMPLETION_INDEX_TTL, COMPLETION_INDEX_SIZE)
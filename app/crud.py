@@ -1,6 +1,12 @@
-from sqlalchemy import func
+import json
+import os
+import time
+
+from sqlalchemy import exists, func, insert, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session, joinedload
-from . import models, auth, schemas
+from . import models, auth, schemas, user_cache, completion_index, leaderboard, achievements
 from typing import List, Optional
 
 
@@ -23,6 +29,7 @@ def create_user(db: Session, user_create_schema: schemas.UserCreate, hashed_pass
     db.add(user)
     db.commit()
     db.refresh(user)
+    leaderboard.board.update(user.id, user.total_xp, user.name, user.avatar)
     return user
 
 
@@ -80,31 +87,128 @@ def is_task_completed(db: Session, user_id: int, task_id: int) -> bool:
     ).first() is not None
 
 
-def complete_task(db: Session, user_id: int, task_id: int):
-    """Отмечает задачу как выполненную и начисляет XP."""
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    task = db.query(models.Task).filter(models.Task.id == task_id).first()
-
-    if not user or not task:
-        return {"success": False, "message": "Пользователь или задача не найдены."}
+# Ошибки, после которых завершение задачи можно безопасно повторить:
+# конфликт сериализации, взаимоблокировка и потерянное соединение
+RETRYABLE_SQLSTATES = {"40001", "40P01"}
+COMPLETE_TASK_RETRIES = int(os.environ.get("COMPLETE_TASK_RETRIES", "3"))
+
+
+def is_retryable_error(error: DBAPIError) -> bool:
+    # psycopg2 хранит код ошибки в pgcode, asyncpg — в sqlstate
+    code = getattr(error.orig, "pgcode", None) or getattr(error.orig, "sqlstate", None)
+    return error.connection_invalidated or code in RETRYABLE_SQLSTATES
+
+
+def complete_task_statement(user_id: int, task_id: int):
+    """
+    Один запрос на завершение задачи:
+    INSERT INTO user_tasks ... ON CONFLICT DO NOTHING RETURNING, и только если строка
+    вставлена — запись в журнал xp_events и UPDATE users SET total_xp = total_xp + награда RETURNING.
+    Там же обновляются счётчики user_progress для правил достижений (app/achievements.py).
+    Повторное или одновременное завершение ничего не вставляет и XP не начисляет.
+    Возвращает строку (total_xp, xp_reward, title и счётчики до/после, см.
+    achievements.progress_columns) или ничего.
+    """
+    task = select(models.Task.id, models.Task.xp_reward, models.Task.title, models.Task.language).where(
+        models.Task.id == task_id).cte("task")
+    inserted = (
+        pg_insert(models.UserTask)
+        .from_select(["user_id", "task_id"],
+                     select(literal(user_id), task.c.id).where(
+                         exists().where(models.User.id == user_id)))
+        .on_conflict_do_nothing(index_elements=["user_id", "task_id"])
+        .returning(models.UserTask.task_id)
+        .cte("inserted")
+    )
+    # Запись в журнал XP (app/xp_rollup.py) — тоже только для вставленной строки
+    solved = (
+        select(task.c.id, task.c.xp_reward, task.c.language)
+        .select_from(inserted.join(task, inserted.c.task_id == task.c.id))
+        .cte("solved")
+    )
+    ledger = (
+        insert(models.XpEvent)
+        .from_select(["user_id", "amount", "source", "source_id"],
+                     select(literal(user_id), func.coalesce(solved.c.xp_reward, 0), literal("task"), solved.c.id))
+        .cte("ledger")
+    )
+    progress_before, progress = achievements.progress_ctes(user_id, solved)
+    # UPDATE ... FROM task, inserted: строка пользователя обновляется, только если вставка произошла
+    return (
+        update(models.User)
+        .where(models.User.id == user_id, inserted.c.task_id == task.c.id, progress.c.user_id == models.User.id)
+        .values(total_xp=func.coalesce(models.User.total_xp, 0) + func.coalesce(task.c.xp_reward, 0))
+        .returning(models.User.total_xp, task.c.xp_reward, task.c.title,
+                   *achievements.progress_columns(progress_before, progress))
+        .add_cte(ledger)
+    )
 
-    if is_task_completed(db, user_id, task_id):
-        return {"success": False, "message": f"Задача '{task.title}' уже была выполнена ранее."}
 
-    # Создание записи о выполнении
-    user_task_completion = models.UserTask(user_id=user_id, task_id=task_id)
-    db.add(user_task_completion)
+def complete_task_result(row, task, granted=()) -> dict:
+    """
+    Ответ complete_task: row — результат complete_task_statement, task — задача, если строки нет,
+    granted — названия полученных достижений.
+    """
+    if row is not None:
+        # Расчет уровня (логика в модели User, но мы можем обновить ее здесь для наглядности)
+        new_level = row.total_xp // 1000
+        message = f"Задача '{row.title}' выполнена! Получено {row.xp_reward or 0} XP. Ваш новый уровень: {new_level}"
+        if granted:
+            message += f". Новые достижения: {', '.join(granted)}"
+        return {"success": True, "message": message, "achievements": list(granted)}
+    if task is None:
+        return {"success": False, "message": "Пользователь или задача не найдены."}
+    return {"success": False, "message": f"Задача '{task.title}' уже была выполнена ранее."}
 
-    # Начисление XP
-    user.total_xp += task.xp_reward
 
+def complete_task(db: Session, user_id: int, task_id: int):
+    """Отмечает задачу как выполненную и начисляет XP (атомарно, см. complete_task_statement)."""
+    for attempt in range(COMPLETE_TASK_RETRIES + 1):
+        try:
+            row = db.execute(complete_task_statement(user_id, task_id)).first()
+            db.commit()
+            break
+        except DBAPIError as e:
+            db.rollback()
+            if attempt == COMPLETE_TASK_RETRIES or not is_retryable_error(e):
+                raise
+            time.sleep(0.01 * 2 ** attempt)
+
+    if row is None:
+        # Ничего не начислено — выясняем причину (редкий путь, отдельный запрос)
+        task = None
+        if db.get(models.User, user_id) is not None:
+            task = db.get(models.Task, task_id)
+        if task is not None:
+            # Задача уже была выполнена (возможно, через другой процесс)
+            completion_index.index.add(user_id, task_id)
+        return complete_task_result(None, task)
+
+    user_cache.cache.invalidate(user_id)
+    completion_index.index.add(user_id, task_id)
+    leaderboard.board.update(user_id, row.total_xp)
+    # Достижения — только если событие пересекло порог правила
+    granted = achievements.engine.award_sync(db, achievements.crossed_rules(row), user_id)
+    return complete_task_result(row, None, granted)
+
+
+def create_submission(db: Session, user_id: int, task_id: int, language: str, passed: bool,
+                      results: list, metrics: dict):
+    """Сохраняет посылку с результатами и метриками проверки."""
+    submission = models.Submission(
+        user_id=user_id,
+        task_id=task_id,
+        language=language,
+        passed=passed,
+        results=json.dumps(results, ensure_ascii=False),
+        cpu_time_ms=metrics.get("cpu_time_ms"),
+        wall_time_ms=metrics.get("wall_time_ms"),
+        peak_rss_kb=metrics.get("peak_rss_kb"),
+    )
+    db.add(submission)
     db.commit()
-
-    # Расчет уровня (логика в модели User, но мы можем обновить ее здесь для наглядности)
-    new_level = user.total_xp // 1000
-
-    return {"success": True,
-            "message": f"Задача '{task.title}' выполнена! Получено {task.xp_reward} XP. Ваш новый уровень: {new_level}"}
+    db.refresh(submission)
+    return submission
 
 
 # --- Достижения (Achievements) ---
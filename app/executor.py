@@ -0,0 +1,529 @@
+"""
+Подсистема выполнения пользовательского кода.
+
+Все процессы запускаются через asyncio, поэтому компиляция и запуск программ
+не блокируют цикл событий uvicorn. Для каждого языка действует собственный
+лимит одновременных запусков, а глубина очереди ожидающих запусков доступна
+через get_stats().
+"""
+import asyncio
+import codecs
+import concurrent.futures
+import os
+import re
+import signal
+import subprocess
+import time
+
+from . import compile_cache, jvm_pool, python_pool, workspace
+
+# Лимиты одновременных запусков по умолчанию (переопределяются переменными
+# окружения EXECUTOR_LIMIT_PYTHON, EXECUTOR_LIMIT_CPP и т.д.)
+DEFAULT_LIMITS = {
+    "python": 4,
+    "javascript": 4,
+    "cpp": 2,
+    "java": 2,
+}
+
+# Названия языков, которые присылает фронтенд, приводим к внутренним
+LANGUAGE_ALIASES = {
+    "c++": "cpp",
+    "js": "javascript",
+}
+
+# Python-код выполняется пулом «тёплых» интерпретаторов; PYTHON_WORKER_POOL=0
+# возвращает запуск отдельного процесса python на каждый запуск
+USE_PYTHON_POOL = os.environ.get("PYTHON_WORKER_POOL", "1") != "0"
+
+# Java-код выполняется долгоживущими JVM (компиляция в памяти); JAVA_RUNNER=process
+# возвращает запуск javac + java на каждый запуск. Если JVM-воркер не удалось
+# подготовить (нет JDK), тоже используется javac + java.
+USE_JVM_RUNNER = os.environ.get("JAVA_RUNNER", "jvm") != "process"
+
+RUN_TIMEOUT = 5  # секунд на выполнение программы
+COMPILE_TIMEOUT = 10  # секунд на компиляцию
+
+# Ограничения песочницы (sandbox_limits) для запусков и проверки решений
+SANDBOX_MEMORY_MB = int(os.environ.get("SANDBOX_MEMORY_MB", "256"))
+SANDBOX_MAX_FILE_MB = 16
+
+# Сколько байт может вывести программа (stdout и stderr вместе); при превышении процесс убивается
+MAX_OUTPUT_BYTES = int(os.environ.get("EXECUTOR_MAX_OUTPUT_KB", "1024")) * 1024
+# Размер частей, которыми читается и передаётся вывод программы
+OUTPUT_CHUNK_BYTES = 4096
+
+# Сколько байт stderr процесса проверки сохраняем для сообщения об ошибке
+MAX_STDERR_BYTES = 64 * 1024
+# Максимальная длина строки stdout процесса проверки
+MAX_LINE_BYTES = 1024 * 1024
+
+# Флаги компиляторов входят в ключ кэша компиляции
+CPP_FLAGS = []
+JAVAC_FLAGS = []
+
+
+class ProcessResult:
+    """Результат завершившегося процесса."""
+
+    def __init__(self, returncode: int, stdout: str, stderr: str):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def output(self) -> str:
+        return self.stdout or self.stderr
+
+
+class OutputLimitExceeded(Exception):
+    """Программа вывела больше MAX_OUTPUT_BYTES и была остановлена; result — вывод до лимита."""
+
+    def __init__(self, result: ProcessResult):
+        super().__init__(f"Ошибка: Вывод программы превысил {MAX_OUTPUT_BYTES // 1024} КБ, выполнение остановлено")
+        self.result = result
+
+
+class LanguageSlots:
+    """Ограничитель одновременных запусков для одного языка."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.running = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+
+    async def __aenter__(self):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.running -= 1
+        self.completed += 1
+        self.semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "completed": self.completed,
+        }
+
+
+def _limit_from_env(language: str, default: int) -> int:
+    value = os.environ.get(f"EXECUTOR_LIMIT_{language.upper()}")
+    try:
+        return max(1, int(value)) if value else default
+    except ValueError:
+        return default
+
+
+def sandbox_limits(cpu_seconds: float, limit_memory: bool = True):
+    """
+    Возвращает preexec_fn, ограничивающий процесс через rlimit: процессорное время,
+    размер создаваемых файлов, core-дампы и (если limit_memory) адресное пространство.
+    Для node и java адресное пространство не ограничиваем: V8 и JVM резервируют
+    много виртуальной памяти, для них память задаётся их собственными флагами.
+    """
+    def apply():
+        import resource
+        cpu = int(cpu_seconds) + 1
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        max_file = SANDBOX_MAX_FILE_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_FSIZE, (max_file, max_file))
+        if limit_memory:
+            memory = SANDBOX_MEMORY_MB * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+    return apply if os.name == "posix" else None
+
+
+slots = {language: LanguageSlots(_limit_from_env(language, limit)) for language, limit in DEFAULT_LIMITS.items()}
+
+# Размер пула совпадает с лимитом одновременных Python-запусков
+python_workers = python_pool.PythonWorkerPool(size=slots["python"].limit)
+# JVM-воркер выполняет одно задание: на процессорное время — старт, компиляция в памяти и запуск
+java_workers = jvm_pool.JvmWorkerPool(size=slots["java"].limit,
+                                      preexec_fn=sandbox_limits(COMPILE_TIMEOUT + RUN_TIMEOUT, limit_memory=False))
+
+
+async def start():
+    """Прогревает пулы воркеров и рабочих каталогов (вызывается при старте приложения)."""
+    workspace.pool.start()
+    if USE_PYTHON_POOL:
+        await python_workers.start()
+    if USE_JVM_RUNNER:
+        await java_workers.prepare()
+
+
+async def stop():
+    await python_workers.close()
+    await java_workers.close()
+    workspace.pool.close()
+
+
+def normalize_language(language: str):
+    """Возвращает внутреннее имя языка или None, если язык не поддерживается."""
+    language = (language or "").lower()
+    language = LANGUAGE_ALIASES.get(language, language)
+    return language if language in slots else None
+
+
+def get_stats() -> dict:
+    """Метрики исполнителя: лимиты, число запущенных и ожидающих процессов."""
+    stats = {language: slot.stats() for language, slot in slots.items()}
+    stats["python_pool"] = python_workers.stats()
+    stats["jvm_pool"] = java_workers.stats()
+    stats["compile_cache"] = compile_cache.cache.stats()
+    stats["workspaces"] = workspace.pool.stats()
+    return stats
+
+
+class _OutputCollector:
+    """Собирает вывод процесса по частям, следя за общим лимитом на stdout и stderr."""
+
+    def __init__(self, on_output=None, limit: int = MAX_OUTPUT_BYTES):
+        self.on_output = on_output
+        self.limit = limit
+        self.size = 0
+        self.exceeded = False
+        self.chunks = {"stdout": [], "stderr": []}
+
+    async def read(self, name: str, stream, kill):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            chunk = await stream.read(OUTPUT_CHUNK_BYTES)
+            final = not chunk
+            if self.size + len(chunk) > self.limit:
+                chunk = chunk[:self.limit - self.size]
+                final = True
+                if not self.exceeded:
+                    self.exceeded = True
+                    kill()
+            self.size += len(chunk)
+            text = decoder.decode(chunk, final=final)
+            if text:
+                self.chunks[name].append(text)
+                if self.on_output is not None:
+                    self.on_output(name, text)
+            if final:
+                return
+
+    def result(self, returncode: int) -> ProcessResult:
+        return ProcessResult(returncode, "".join(self.chunks["stdout"]), "".join(self.chunks["stderr"]))
+
+
+def _kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def run_process(args, timeout: float, cwd: str = None, on_output=None, preexec_fn=None) -> ProcessResult:
+    """
+    Запускает процесс без блокировки цикла событий.
+    stdout и stderr читаются частями; если задан on_output(поток, текст), каждая часть
+    передаётся ему сразу, как только программа её вывела.
+    При превышении времени процесс убивается и выбрасывается subprocess.TimeoutExpired,
+    при превышении MAX_OUTPUT_BYTES — OutputLimitExceeded.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        preexec_fn=preexec_fn,
+        # Своя группа процессов: при убийстве не останется порождённых программой процессов
+        start_new_session=True,
+    )
+    output = _OutputCollector(on_output)
+    kill = lambda: _kill_group(process.pid)
+    readers = asyncio.gather(output.read("stdout", process.stdout, kill),
+                             output.read("stderr", process.stderr, kill))
+    deadline = time.monotonic() + timeout
+    try:
+        await asyncio.wait_for(readers, timeout)
+        await asyncio.wait_for(process.wait(), max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(args, timeout)
+    finally:
+        kill()
+        readers.cancel()
+        await process.wait()
+
+    result = output.result(process.returncode)
+    if output.exceeded:
+        raise OutputLimitExceeded(result)
+    return result
+
+
+async def _read_capped(stream, limit: int) -> bytes:
+    """Читает поток до конца, сохраняя только первые limit байт."""
+    chunks = []
+    size = 0
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            return b"".join(chunks)
+        if size < limit:
+            chunks.append(chunk[:limit - size])
+            size += len(chunks[-1])
+
+
+# Потоки, ожидающие завершения процессов проверки через os.wait4 и пишущие им stdin
+_process_threads = concurrent.futures.ThreadPoolExecutor(max_workers=64, thread_name_prefix="codequest-process")
+
+
+class StreamingProcess:
+    """
+    Процесс, stdout которого читается построчно по мере появления
+    (используется проверкой решений, чтобы остановиться на первой ошибке).
+    Используется как async with; при выходе из блока процесс убивается, если ещё жив.
+
+    Завершения процесса мы ждём сами через os.wait4 (а не через asyncio), чтобы
+    получить его rusage: процессорное время и пиковый RSS. После выхода из блока
+    доступны returncode, rusage, wall_time и stderr.
+    """
+
+    def __init__(self, args, timeout: float, cwd: str = None, stdin_data: bytes = b"", preexec_fn=None):
+        self.args = args
+        self.timeout = timeout
+        self.cwd = cwd
+        self.stdin_data = stdin_data
+        self.preexec_fn = preexec_fn
+        self.process = None
+        self.returncode = None
+        self.rusage = None
+        self.wall_time = None
+        self.stderr = ""
+        self._stdout = None
+        self._stderr_task = None
+        self._stdin_task = None
+        self._waiter = None
+        self._started = None
+        self._finished = None
+        self._deadline = None
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        # fork/exec (и preexec_fn) занимают заметное время — делаем их не в цикле событий,
+        # а в том же потоке, который потом ждёт процесс через wait4
+        spawned = loop.create_future()
+        self._waiter = loop.run_in_executor(_process_threads, self._spawn_and_wait, loop, spawned)
+        self._waiter.add_done_callback(self._on_exit)
+        try:
+            await asyncio.shield(spawned)
+        except asyncio.CancelledError:
+            # Процесс всё равно запустится — убиваем его, как только он появится
+            spawned.add_done_callback(lambda _: self.process is not None and self.kill())
+            raise
+        self._deadline = self._started + self.timeout
+        try:
+            self._stdout = await self._connect(loop, self.process.stdout)
+            stderr = await self._connect(loop, self.process.stderr)
+            self._stderr_task = asyncio.ensure_future(_read_capped(stderr, MAX_STDERR_BYTES))
+            self._stdin_task = loop.run_in_executor(_process_threads, self._feed_stdin)
+        except BaseException:
+            self.kill()
+            raise
+        return self
+
+    def _spawn_and_wait(self, loop, spawned):
+        # Выполняется в потоке _process_threads; spawned завершается, как только процесс запущен
+        try:
+            self.process = subprocess.Popen(
+                self.args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.cwd,
+                preexec_fn=self.preexec_fn,
+                # Своя группа процессов: при убийстве не останется порождённых решением процессов
+                start_new_session=True,
+            )
+        except BaseException as e:
+            loop.call_soon_threadsafe(spawned.set_exception, e)
+            return None
+        self._started = time.monotonic()
+        loop.call_soon_threadsafe(spawned.set_result, None)
+        return os.wait4(self.process.pid, 0)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.kill()
+        _, status, self.rusage = await self._waiter
+        self.returncode = os.waitstatus_to_exitcode(status)
+        # Процесс уже собран wait4 — Popen не должен пытаться ждать его сам
+        self.process.returncode = self.returncode
+        self.wall_time = self._finished - self._started
+        if self._stdin_task is not None:
+            await self._stdin_task
+        if self._stderr_task is not None:
+            self.stderr = (await self._stderr_task).decode("utf-8", errors="replace")
+
+    @staticmethod
+    async def _connect(loop, pipe) -> asyncio.StreamReader:
+        reader = asyncio.StreamReader(limit=MAX_LINE_BYTES)
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        return reader
+
+    def _feed_stdin(self):
+        try:
+            self.process.stdin.write(self.stdin_data)
+            self.process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # процесс завершился, не дочитав stdin
+
+    def _on_exit(self, _):
+        self._finished = time.monotonic()
+
+    @property
+    def cpu_time(self) -> float:
+        """Процессорное время (user + system) в секундах по данным wait4."""
+        return self.rusage.ru_utime + self.rusage.ru_stime if self.rusage else 0.0
+
+    @property
+    def peak_rss_kb(self) -> int:
+        """Пиковый RSS процесса в килобайтах (ru_maxrss в Linux измеряется в КБ)."""
+        return self.rusage.ru_maxrss if self.rusage else 0
+
+    def kill(self):
+        # Группу убиваем, даже если сам процесс уже завершился: могли остаться его потомки
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def lines(self):
+        """Строки stdout по мере появления; при превышении времени — subprocess.TimeoutExpired."""
+        while True:
+            remaining = self._deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, self.timeout)
+            try:
+                line = await asyncio.wait_for(self._stdout.readline(), remaining)
+            except asyncio.TimeoutError:
+                raise subprocess.TimeoutExpired(self.args, self.timeout)
+            except (ValueError, asyncio.LimitOverrunError):
+                # Слишком длинная строка без перевода строки — дальше не читаем
+                return
+            if not line:
+                return
+            yield line.decode("utf-8", errors="replace")
+
+
+async def execute(language: str, code: str, on_output=None) -> str:
+    """
+    Выполняет код на указанном языке и возвращает вывод программы.
+    Язык должен быть предварительно проверен через normalize_language().
+
+    Если задан on_output(поток, текст), вывод передаётся ему по мере появления
+    ("stdout", "stderr"; ошибка компиляции — "stderr"), в том числе из пулов воркеров.
+    """
+    # Каждый запуск работает в своём пустом каталоге из пула (см. app/workspace.py)
+    async with slots[language]:
+        async with workspace.pool.acquire() as workdir:
+            if language == "python":
+                return await _run_python(code, workdir, on_output)
+            if language == "javascript":
+                return (await run_process(["node", "-e", code], RUN_TIMEOUT, cwd=workdir, on_output=on_output,
+                                          preexec_fn=sandbox_limits(RUN_TIMEOUT, limit_memory=False))).output
+            if language == "cpp":
+                return await _run_cpp(code, workdir, on_output)
+            if language == "java":
+                return await _run_java(code, workdir, on_output)
+    raise ValueError(f"Неподдерживаемый язык: {language}")
+
+
+def _compile_error(error: str, on_output) -> str:
+    if on_output is not None:
+        on_output("stderr", error)
+    return error
+
+
+async def _run_python(code: str, workdir: str, on_output=None) -> str:
+    if USE_PYTHON_POOL:
+        response = await python_workers.run({"code": code, "max_output": MAX_OUTPUT_BYTES,
+                                             "stream": on_output is not None}, RUN_TIMEOUT, on_output)
+        result = ProcessResult(response["returncode"], response["stdout"], response["stderr"])
+        if response.get("truncated"):
+            raise OutputLimitExceeded(result)
+        return result.output
+
+    with open(os.path.join(workdir, 'main.py'), 'w', encoding='utf-8') as src_file:
+        src_file.write(code)
+
+    # -u: без буферизации, чтобы вывод приходил сразу
+    return (await run_process(['python', '-u', 'main.py'], RUN_TIMEOUT, cwd=workdir, on_output=on_output,
+                              preexec_fn=sandbox_limits(RUN_TIMEOUT))).output
+
+
+async def _run_cpp(code: str, workdir: str, on_output=None) -> str:
+    async def build(build_dir: str) -> ProcessResult:
+        with open(os.path.join(build_dir, 'main.cpp'), 'w', encoding='utf-8') as src_file:
+            src_file.write(code)
+        return await run_process(['g++', *CPP_FLAGS, 'main.cpp', '-o', 'main'], COMPILE_TIMEOUT, cwd=build_dir)
+
+    # 1. Компиляция (повторный запуск того же кода берёт готовый бинарник из кэша)
+    async with compile_cache.cache.compiled('cpp', code, CPP_FLAGS, build) as artifact:
+        if artifact.error is not None:
+            return _compile_error(artifact.error, on_output)
+
+        # 2. Запуск
+        return (await run_process([str(artifact.path / 'main')], RUN_TIMEOUT, cwd=workdir,
+                                  on_output=on_output, preexec_fn=sandbox_limits(RUN_TIMEOUT))).output
+
+
+async def _run_java(code: str, workdir: str, on_output=None) -> str:
+    class_name = "Main"  # Поиск имени класса для запуска
+    match = re.search(r'class\s+(\w+)', code)
+    if match:
+        class_name = match.group(1)
+
+    if USE_JVM_RUNNER and await java_workers.prepare():
+        return await _run_java_in_jvm(class_name, code, on_output)
+
+    async def build(build_dir: str) -> ProcessResult:
+        # Имя файла совпадает с именем класса, иначе javac не примет public class
+        with open(os.path.join(build_dir, class_name + '.java'), 'w', encoding='utf-8') as src_file:
+            src_file.write(code)
+        return await run_process(['javac', *JAVAC_FLAGS, '-d', '.', class_name + '.java'], COMPILE_TIMEOUT,
+                                 cwd=build_dir)
+
+    # 1. Компиляция (повторный запуск того же кода берёт готовые .class из кэша)
+    async with compile_cache.cache.compiled('java', code, JAVAC_FLAGS, build) as artifact:
+        if artifact.error is not None:
+            return _compile_error(artifact.error, on_output)
+
+        # 2. Запуск
+        return (await run_process(['java', '-cp', str(artifact.path), class_name], RUN_TIMEOUT, cwd=workdir,
+                                  on_output=on_output,
+                                  preexec_fn=sandbox_limits(RUN_TIMEOUT, limit_memory=False))).output
+
+
+async def _run_java_in_jvm(class_name: str, code: str, on_output=None) -> str:
+    # Ограничение RUN_TIMEOUT JavaRunner применяет только к main(); общий таймаут
+    # включает ещё и компиляцию в памяти
+    response = await java_workers.run({"class_name": class_name, "source": code, "timeout": RUN_TIMEOUT,
+                                       "max_output": MAX_OUTPUT_BYTES, "stream": on_output is not None},
+                                      COMPILE_TIMEOUT + RUN_TIMEOUT, on_output)
+    if response["kind"] == "TIMEOUT":
+        raise subprocess.TimeoutExpired(["java", class_name], RUN_TIMEOUT)
+    if response["kind"] == "COMPILE":
+        return _compile_error(response["stderr"], on_output)
+    result = ProcessResult(response["returncode"], response["stdout"], response["stderr"])
+    if response["kind"] == "LIMIT":
+        raise OutputLimitExceeded(result)
+    return result.output
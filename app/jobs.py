@@ -0,0 +1,234 @@
+"""
+Очередь заданий исполнителя кода (один процесс приложения).
+
+Посылки задач и запуски из песочницы (/api/run-code) не выполняются внутри
+HTTP-запроса: они ставятся в очередь, а фиксированное число воркеров забирает
+задания по приоритету. Посылки (PRIORITY_SUBMIT) всегда обслуживаются раньше
+запусков (PRIORITY_RUN); внутри одного приоритета пользователи обслуживаются
+по кругу, так что пачка посылок одного пользователя не задерживает остальных.
+
+Ход выполнения задания публикуется событиями (queued, started, progress,
+done, failed), которые можно получать через /api/jobs/{id}/events (SSE).
+"""
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from . import executor
+
+PRIORITY_SUBMIT = 0
+PRIORITY_RUN = 1
+
+# Сколько заданий выполняется одновременно; по умолчанию — сколько всего слотов у исполнителя
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", sum(slot.limit for slot in executor.slots.values())))
+# Ограничения очереди: всего и на одного пользователя
+MAX_QUEUED_JOBS = int(os.environ.get("JOB_QUEUE_MAX", "1000"))
+MAX_QUEUED_JOBS_PER_USER = int(os.environ.get("JOB_QUEUE_MAX_PER_USER", "20"))
+# Сколько секунд хранится результат завершённого задания
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", "600"))
+# Интервал пустых сообщений SSE, чтобы прокси не закрывали соединение
+KEEPALIVE_INTERVAL = 15
+
+
+class QueueFull(Exception):
+    """Очередь (общая или пользователя) заполнена; текст — сообщение для пользователя."""
+
+
+class Job:
+    """Задание очереди: состояние, результат и журнал событий."""
+
+    def __init__(self, kind: str, owner: str, priority: int, handler):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner  # "user:<id>" или "ip:<адрес>" — по нему делится очередь и проверяется доступ
+        self.priority = priority
+        self.handler = handler  # async handler(job) -> результат (JSON-сериализуемый)
+        self.status = "queued"
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.events = []
+        self._changed = asyncio.Event()
+        self._done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def publish(self, event: str, data: dict):
+        self.events.append((len(self.events) + 1, event, data))
+        # Будим всех ждущих и заводим новое событие для следующих ожиданий
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def report_progress(self, done: int, total: int):
+        self.progress = {"done": done, "total": total}
+        self.publish("progress", self.progress)
+
+    async def wait(self):
+        """Ждёт завершения задания и возвращает его результат (или бросает RuntimeError)."""
+        await self._done.wait()
+        if self.status == "failed":
+            raise RuntimeError(self.error)
+        return self.result
+
+    async def stream(self, after: int = 0):
+        """
+        События задания с номера after + 1 (для переподключения по Last-Event-ID),
+        затем новые по мере появления. None — пора отправить keep-alive.
+        """
+        while True:
+            while after < len(self.events):
+                yield self.events[after]
+                after += 1
+            if self.finished:
+                return
+            try:
+                await asyncio.wait_for(self._changed.wait(), KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield None
+
+    def snapshot(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    def __init__(self, workers: int = JOB_WORKERS, max_queued: int = MAX_QUEUED_JOBS,
+                 max_queued_per_user: int = MAX_QUEUED_JOBS_PER_USER, result_ttl: int = JOB_RESULT_TTL):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.result_ttl = result_ttl
+        self.jobs = {}  # id -> Job, включая завершённые (пока не истёк result_ttl)
+        # приоритет -> OrderedDict(владелец -> deque заданий); порядок владельцев = очередь обхода по кругу
+        self._queues = {PRIORITY_SUBMIT: OrderedDict(), PRIORITY_RUN: OrderedDict()}
+        self._queued = 0
+        self._queued_by_owner = {}
+        self._ready = asyncio.Semaphore(0)
+        self._tasks = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_time_total = 0.0
+        self._started_total = 0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind: str, owner: str, handler, priority: int) -> Job:
+        """Ставит задание в очередь; QueueFull, если очередь или лимит пользователя исчерпаны."""
+        self._prune()
+        if self._queued >= self.max_queued:
+            self.rejected += 1
+            raise QueueFull("Сервер перегружен, попробуйте позже")
+        if self._queued_by_owner.get(owner, 0) >= self.max_queued_per_user:
+            self.rejected += 1
+            raise QueueFull("Слишком много заданий в очереди, дождитесь завершения предыдущих")
+
+        job = Job(kind, owner, priority, handler)
+        self.jobs[job.id] = job
+        self._queues[priority].setdefault(owner, deque()).append(job)
+        self._queued += 1
+        self._queued_by_owner[owner] = self._queued_by_owner.get(owner, 0) + 1
+        job.publish("queued", {"id": job.id})
+        self._ready.release()
+        return job
+
+    def get(self, job_id: str):
+        job = self.jobs.get(job_id)
+        if job is not None and job.finished and time.time() - job.finished_at > self.result_ttl:
+            return None
+        return job
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": {name: sum(len(jobs) for jobs in self._queues[priority].values())
+                       for name, priority in (("submit", PRIORITY_SUBMIT), ("run", PRIORITY_RUN))},
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self._wait_time_total / self._started_total * 1000) if self._started_total else 0,
+        }
+
+    def _next_job(self) -> Job:
+        # Самый высокий приоритет, в нём — следующий по кругу владелец
+        for priority in sorted(self._queues):
+            owners = self._queues[priority]
+            if not owners:
+                continue
+            owner, jobs = next(iter(owners.items()))
+            job = jobs.popleft()
+            if jobs:
+                owners.move_to_end(owner)
+            else:
+                del owners[owner]
+            self._queued -= 1
+            self._queued_by_owner[owner] -= 1
+            if not self._queued_by_owner[owner]:
+                del self._queued_by_owner[owner]
+            return job
+        raise RuntimeError("очередь пуста")
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            job = self._next_job()
+            self.running += 1
+            job.status = "running"
+            job.started_at = time.time()
+            self._wait_time_total += job.started_at - job.created_at
+            self._started_total += 1
+            job.publish("started", {})
+            try:
+                job.result = await job.handler(job)
+                job.status = "done"
+                self.completed += 1
+                job.publish("done", job.result)
+            except asyncio.CancelledError:
+                job.status, job.error = "failed", "Задание отменено"
+                job.publish("failed", {"error": job.error})
+                raise
+            except Exception as e:
+                job.status, job.error = "failed", f"Произошла внутренняя ошибка сервера: {e}"
+                self.failed += 1
+                job.publish("failed", {"error": job.error})
+            finally:
+                job.finished_at = time.time()
+                job.handler = None  # замыкание держит код посылки — больше не нужно
+                job._done.set()
+                self.running -= 1
+
+    def _prune(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished and now - job.finished_at > self.result_ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+queue = JobQueue()
@@ -0,0 +1,535 @@
+"""
+Проверка решений задач на тестовых кейсах.
+
+Для каждого языка генерируется обвязка (harness), которая загружает решение,
+получает через stdin список кейсов и печатает результат каждого кейса отдельной
+строкой сразу после его выполнения — вместе с затраченным процессорным временем,
+временем по часам и пиковым RSS. Кейсы делятся на части, которые выполняются
+параллельно в нескольких процессах обвязки (не больше, чем ядер процессора).
+Сравнение с ожидаемым значением делается здесь, поэтому при early_exit
+проверка останавливается на первом проваленном кейсе.
+
+Формат test_cases задачи — JSON-массив [{"input": "add(2, 3)", "expected": "5"}, ...],
+где input — выражение на языке задачи. Python и JavaScript вычисляют выражения
+из stdin; в C++ и Java выражения компилируются в обвязку, а через stdin
+передаются номера кейсов, которые нужно выполнить.
+"""
+import asyncio
+import contextlib
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import subprocess
+import time
+from string import Template
+
+from . import compile_cache, executor, workspace
+
+JUDGE_TIMEOUT = 10  # секунд на все кейсы одной посылки
+
+# Сколько процессов обвязки может работать одновременно (на все посылки сразу)
+JUDGE_MAX_PROCESSES = int(os.environ.get("JUDGE_MAX_PROCESSES", os.cpu_count() or 1))
+# Меньше стольких кейсов на процесс не делим: запуск процесса дороже лёгкого кейса
+JUDGE_MIN_CASES_PER_PROCESS = int(os.environ.get("JUDGE_MIN_CASES_PER_PROCESS", "5"))
+
+_process_slots = asyncio.Semaphore(JUDGE_MAX_PROCESSES)
+
+# Секрет для маркера строк с результатами: обычный вывод решения (в том числе
+# строки, похожие на результаты) не спутать с результатом кейса. Защитой от
+# умышленной подделки маркер не является: решение работает в одном процессе с
+# обвязкой и может её прочитать. Но строка результата несёт только вычисленное
+# значение (сравнение с expected делается здесь) и метрики, поэтому подделка
+# даёт не больше, чем решение, которое само печатает ответы; метрики справочные.
+_MARKER_SECRET = secrets.token_bytes(16)
+
+PYTHON_HARNESS = Template(r'''import io
+import json
+import resource
+import sys
+import time
+import traceback
+
+_cq_cases = json.loads(sys.stdin.read())
+sys.stdin = io.StringIO("")
+_cq_stdout = sys.stdout
+
+
+def _cq_report(payload):
+    _cq_stdout.write("\n" + $marker + " " + json.dumps(payload) + "\n")
+    _cq_stdout.flush()
+
+
+_cq_namespace = {"__name__": "__solution__"}
+try:
+    exec(compile($code, "<solution>", "exec"), _cq_namespace)
+except BaseException:
+    _cq_type, _cq_value, _cq_tb = sys.exc_info()
+    _cq_report({"case": -1, "error": "".join(traceback.format_exception(_cq_type, _cq_value, _cq_tb.tb_next))})
+    sys.exit(1)
+
+for _cq_index, _cq_expression in _cq_cases:
+    _cq_cpu, _cq_wall = time.process_time(), time.perf_counter()
+    try:
+        _cq_payload = {"case": _cq_index, "actual": str(eval(_cq_expression, _cq_namespace))}
+    except Exception as _cq_error:
+        _cq_payload = {"case": _cq_index, "error": type(_cq_error).__name__ + ": " + str(_cq_error)}
+    _cq_payload.update(cpu_ms=(time.process_time() - _cq_cpu) * 1000,
+                       wall_ms=(time.perf_counter() - _cq_wall) * 1000,
+                       rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    _cq_report(_cq_payload)
+''')
+
+JAVASCRIPT_HARNESS = Template(r'''const fs = require("fs");
+const vm = require("vm");
+
+const cqCases = JSON.parse(fs.readFileSync(0, "utf8"));
+const cqReport = (payload) => process.stdout.write("\n" + $marker + " " + JSON.stringify(payload) + "\n");
+const cqContext = vm.createContext({ console, require });
+const cqMetrics = (cpu, wall) => {
+    const used = process.cpuUsage(cpu);
+    return {
+        cpu_ms: (used.user + used.system) / 1000,
+        wall_ms: Number(process.hrtime.bigint() - wall) / 1e6,
+        rss_kb: process.resourceUsage().maxRSS,
+    };
+};
+
+try {
+    vm.runInContext($code, cqContext, { filename: "solution.js" });
+} catch (error) {
+    cqReport({ case: -1, error: String((error && error.stack) || error) });
+    process.exit(1);
+}
+
+for (const [index, expression] of cqCases) {
+    const cpu = process.cpuUsage();
+    const wall = process.hrtime.bigint();
+    let payload;
+    try {
+        payload = { case: index, actual: String(vm.runInContext(expression, cqContext)) };
+    } catch (error) {
+        payload = { case: index, error: String(error) };
+    }
+    cqReport(Object.assign(payload, cqMetrics(cpu, wall)));
+}
+''')
+
+CPP_HARNESS = Template(r'''#define main codequest_user_main
+$code
+#undef main
+
+#include <chrono>
+#include <cstdio>
+#include <ctime>
+#include <exception>
+#include <iostream>
+#include <sstream>
+#include <string>
+#include <sys/resource.h>
+
+static std::string cq_escape(const std::string& value) {
+    std::string result;
+    for (unsigned char c : value) {
+        switch (c) {
+            case '"': result += "\\\""; break;
+            case '\\': result += "\\\\"; break;
+            case '\n': result += "\\n"; break;
+            case '\r': result += "\\r"; break;
+            case '\t': result += "\\t"; break;
+            default:
+                if (c < 0x20) {
+                    char buffer[8];
+                    std::snprintf(buffer, sizeof buffer, "\\u%04x", c);
+                    result += buffer;
+                } else {
+                    result += static_cast<char>(c);
+                }
+        }
+    }
+    return result;
+}
+
+static void cq_report(int index, const char* key, const std::string& value,
+                      std::clock_t cpu_start, std::chrono::steady_clock::time_point wall_start) {
+    double cpu_ms = 1000.0 * (std::clock() - cpu_start) / CLOCKS_PER_SEC;
+    double wall_ms = std::chrono::duration<double, std::milli>(std::chrono::steady_clock::now() - wall_start).count();
+    struct rusage usage;
+    getrusage(RUSAGE_SELF, &usage);
+    std::cout << "\n" << $marker << " {\"case\": " << index << ", \"" << key << "\": \""
+              << cq_escape(value) << "\", \"cpu_ms\": " << cpu_ms << ", \"wall_ms\": " << wall_ms
+              << ", \"rss_kb\": " << usage.ru_maxrss << "}" << std::endl;
+}
+
+template <typename T>
+static std::string cq_str(const T& value) {
+    std::ostringstream out;
+    out << std::boolalpha << value;
+    return out.str();
+}
+
+int main() {
+    int cq_index;
+    while (std::cin >> cq_index) {
+        std::clock_t cq_cpu = std::clock();
+        auto cq_wall = std::chrono::steady_clock::now();
+        const char* cq_key = "actual";
+        std::string cq_value;
+        try {
+            switch (cq_index) {
+$cases
+                default: continue;
+            }
+        } catch (const std::exception& error) {
+            cq_key = "error";
+            cq_value = error.what();
+        } catch (...) {
+            cq_key = "error";
+            cq_value = "unknown exception";
+        }
+        cq_report(cq_index, cq_key, cq_value, cq_cpu, cq_wall);
+    }
+    return 0;
+}
+''')
+
+JAVA_HARNESS = Template(r'''$code
+
+class CodeQuestJudge {
+    private static final java.lang.management.ThreadMXBean CQ_THREADS =
+            java.lang.management.ManagementFactory.getThreadMXBean();
+
+    private static String cqEscape(String value) {
+        StringBuilder result = new StringBuilder();
+        for (char c : value.toCharArray()) {
+            switch (c) {
+                case '"': result.append("\\\""); break;
+                case '\\': result.append("\\\\"); break;
+                case '\n': result.append("\\n"); break;
+                case '\r': result.append("\\r"); break;
+                case '\t': result.append("\\t"); break;
+                default:
+                    if (c < 0x20) {
+                        result.append(String.format("\\u%04x", (int) c));
+                    } else {
+                        result.append(c);
+                    }
+            }
+        }
+        return result.toString();
+    }
+
+    private static long cqPeakRssKb() {
+        try {
+            for (String line : java.nio.file.Files.readAllLines(java.nio.file.Paths.get("/proc/self/status"))) {
+                if (line.startsWith("VmHWM:")) {
+                    return Long.parseLong(line.replaceAll("\\D", ""));
+                }
+            }
+        } catch (Exception ignored) {
+        }
+        return -1;
+    }
+
+    private static void cqReport(int index, String key, String value, long cpuStart, long wallStart) {
+        double cpuMs = (CQ_THREADS.getCurrentThreadCpuTime() - cpuStart) / 1e6;
+        double wallMs = (System.nanoTime() - wallStart) / 1e6;
+        System.out.print("\n" + $marker + " {\"case\": " + index + ", \"" + key + "\": \"" + cqEscape(value)
+                + "\", \"cpu_ms\": " + cpuMs + ", \"wall_ms\": " + wallMs + ", \"rss_kb\": " + cqPeakRssKb() + "}\n");
+        System.out.flush();
+    }
+
+    public static void main(String[] args) {
+        java.util.Scanner cqInput = new java.util.Scanner(System.in);
+        while (cqInput.hasNextInt()) {
+            int cqIndex = cqInput.nextInt();
+            long cqCpu = CQ_THREADS.getCurrentThreadCpuTime();
+            long cqWall = System.nanoTime();
+            String cqKey = "actual";
+            String cqValue;
+            try {
+                switch (cqIndex) {
+$cases
+                    default: continue;
+                }
+            } catch (Throwable error) {
+                cqKey = "error";
+                cqValue = error.toString();
+            }
+            cqReport(cqIndex, cqKey, cqValue, cqCpu, cqWall);
+        }
+    }
+}
+''')
+
+JAVA_JUDGE_CLASS = "CodeQuestJudge"
+
+
+class CompileError(Exception):
+    """Решение не скомпилировалось; текст — вывод компилятора."""
+
+
+class JudgeResult:
+    """
+    Итог проверки: результаты по кейсам в формате, который ожидает фронтенд,
+    и суммарные метрики посылки (по rusage процессов обвязки).
+    """
+
+    def __init__(self, results: list, all_passed: bool, cpu_time_ms: int = 0, wall_time_ms: int = 0,
+                 peak_rss_kb: int = 0, timed_out: bool = False):
+        self.results = results
+        self.all_passed = all_passed
+        self.timed_out = timed_out
+        self.cpu_time_ms = cpu_time_ms
+        self.wall_time_ms = wall_time_ms
+        self.peak_rss_kb = peak_rss_kb
+
+    def metrics(self) -> dict:
+        return {"cpu_time_ms": self.cpu_time_ms, "wall_time_ms": self.wall_time_ms, "peak_rss_kb": self.peak_rss_kb}
+
+
+def parse_test_cases(raw: str) -> list:
+    """Разбирает task.test_cases; ValueError, если формат неверный."""
+    test_cases = json.loads(raw or "[]")
+    if not isinstance(test_cases, list) or not all(isinstance(case, dict) and "input" in case for case in test_cases):
+        raise ValueError("test_cases должен быть JSON-массивом объектов с полем input")
+    if not test_cases:
+        # Без кейсов проверять нечего — иначе засчитывалось бы любое решение
+        raise ValueError("У задачи нет тестовых кейсов")
+    return test_cases
+
+
+def _marker(language: str, code: str, test_cases: list) -> str:
+    # Маркер детерминирован для одной и той же посылки, чтобы скомпилированная
+    # обвязка C++/Java попадала в кэш компиляции при повторной проверке
+    digest = hmac.new(_MARKER_SECRET, f"{language}\0{code}\0{json.dumps(test_cases)}".encode("utf-8"),
+                      hashlib.sha256).hexdigest()[:24]
+    return f"__CQ_{digest}__"
+
+
+def _expected_variants(expected) -> set:
+    if isinstance(expected, str):
+        return {expected.strip()}
+    # Для не-строк (true, 5, [1, 2]) принимаем и str() Python, и JSON-запись
+    return {str(expected).strip(), json.dumps(expected).strip()}
+
+
+def _case_metrics(payload: dict) -> dict:
+    """Метрики кейса из строки обвязки; rss_kb — пиковый RSS процесса на момент окончания кейса."""
+    metrics = {}
+    for key, digits in (("cpu_ms", 3), ("wall_ms", 3), ("rss_kb", 0)):
+        try:
+            value = float(payload[key])
+        except (KeyError, TypeError, ValueError):
+            value = -1
+        metrics[key] = (round(value, digits) if digits else int(value)) if value >= 0 else None
+    return metrics
+
+
+def _check_case(index: int, case: dict, payload: dict) -> dict:
+    result = {"test_id": index + 1, "input": case.get("input"), "metrics": _case_metrics(payload)}
+    if "error" in payload:
+        result.update(passed=False, message=f"Ошибка в тесте {index + 1}: {payload['error']}")
+        return result
+
+    expected = case.get("expected", "")
+    actual = str(payload.get("actual", "")).strip()
+    if actual in _expected_variants(expected):
+        result.update(passed=True, message="Тест пройден")
+    else:
+        result.update(passed=False,
+                      message=f"Тест не пройден. Ожидалось: '{expected}', Получено: '{actual}'")
+    return result
+
+
+def _compiled_cases(test_cases: list, statement: str) -> str:
+    return "\n".join(
+        f"                case {index}: {statement.format(index=index, expression=case['input'])} break;"
+        for index, case in enumerate(test_cases)
+    )
+
+
+def _split_cases(count: int) -> list:
+    """Делит номера кейсов между процессами обвязки (по кругу, чтобы тяжёлые кейсы не попали в одну часть)."""
+    processes = max(1, min(JUDGE_MAX_PROCESSES, count // max(JUDGE_MIN_CASES_PER_PROCESS, 1)))
+    return [list(range(part, count, processes)) for part in range(processes)]
+
+
+@contextlib.asynccontextmanager
+async def _harness(language: str, code: str, test_cases: list, marker: str, workdir: str):
+    """
+    Готовит обвязку; отдаёт (команда, preexec_fn, stdin_for), где stdin_for(номера кейсов)
+    строит stdin процесса, выполняющего эти кейсы. CompileError при ошибке компиляции.
+    """
+    quoted_marker = json.dumps(marker)
+    memory_limit = executor.sandbox_limits(JUDGE_TIMEOUT)
+    no_memory_limit = executor.sandbox_limits(JUDGE_TIMEOUT, limit_memory=False)
+
+    if language in ("python", "javascript"):
+        def stdin_for(indices: list) -> bytes:
+            return json.dumps([[index, test_cases[index]["input"]] for index in indices]).encode("utf-8")
+
+        if language == "python":
+            path = os.path.join(workdir, "harness.py")
+            source = PYTHON_HARNESS.substitute(marker=quoted_marker, code=repr(code))
+            args, preexec_fn = ["python", "-I", path], memory_limit
+        else:
+            path = os.path.join(workdir, "harness.js")
+            source = JAVASCRIPT_HARNESS.substitute(marker=quoted_marker, code=json.dumps(code))
+            args = ["node", f"--max-old-space-size={executor.SANDBOX_MEMORY_MB}", path]
+            preexec_fn = no_memory_limit
+        with open(path, "w", encoding="utf-8") as harness_file:
+            harness_file.write(source)
+        yield args, preexec_fn, stdin_for
+        return
+
+    def stdin_for(indices: list) -> bytes:
+        return " ".join(str(index) for index in indices).encode("ascii")
+
+    if language == "cpp":
+        source = CPP_HARNESS.substitute(
+            marker=quoted_marker, code=code,
+            cases=_compiled_cases(test_cases, 'cq_value = cq_str(({expression}));'),
+        )
+        flags = executor.CPP_FLAGS
+
+        async def build(build_dir: str):
+            with open(os.path.join(build_dir, "judge.cpp"), "w", encoding="utf-8") as src_file:
+                src_file.write(source)
+            return await executor.run_process(["g++", *flags, "judge.cpp", "-o", "judge"],
+                                              executor.COMPILE_TIMEOUT, cwd=build_dir)
+    else:
+        source = JAVA_HARNESS.substitute(
+            marker=quoted_marker, code=code,
+            cases=_compiled_cases(test_cases, 'cqValue = String.valueOf(({expression}));'),
+        )
+        flags = executor.JAVAC_FLAGS
+        # public class решения задаёт имя файла
+        match = re.search(r'public\s+(?:final\s+|abstract\s+)*class\s+(\w+)', code)
+        file_name = (match.group(1) if match else "Solution") + ".java"
+
+        async def build(build_dir: str):
+            with open(os.path.join(build_dir, file_name), "w", encoding="utf-8") as src_file:
+                src_file.write(source)
+            return await executor.run_process(["javac", *flags, "-d", ".", file_name],
+                                              executor.COMPILE_TIMEOUT, cwd=build_dir)
+
+    async with compile_cache.cache.compiled(f"judge-{language}", source, flags, build) as artifact:
+        if artifact.error is not None:
+            raise CompileError(artifact.error)
+        if language == "cpp":
+            yield [str(artifact.path / "judge")], memory_limit, stdin_for
+        else:
+            yield (["java", f"-Xmx{executor.SANDBOX_MEMORY_MB}m", "-cp", str(artifact.path), JAVA_JUDGE_CLASS],
+                   no_memory_limit, stdin_for)
+
+
+class _JudgeRun:
+    """Общее состояние проверки одной посылки, которую выполняют несколько процессов обвязки."""
+
+    def __init__(self, test_cases: list, marker: str, early_exit: bool, progress=None):
+        self.test_cases = test_cases
+        self.marker = marker
+        self.early_exit = early_exit
+        self.progress = progress
+        self.verdicts = {}
+        self.error = None
+        self.timed_out = False
+        self.processes = []  # завершённые процессы — для rusage
+
+    async def run_part(self, indices: list, args, preexec_fn, stdin: bytes, workdir: str) -> bool:
+        """Выполняет часть кейсов в отдельном процессе; True — проверку нужно остановить."""
+        process = executor.StreamingProcess(args, JUDGE_TIMEOUT, cwd=workdir, stdin_data=stdin, preexec_fn=preexec_fn)
+        async with _process_slots:
+            try:
+                async with process:
+                    stop = await self._read_verdicts(process, set(indices))
+            finally:
+                if process.rusage is not None:
+                    self.processes.append(process)
+        if stop:
+            return True
+        if any(index not in self.verdicts for index in indices):
+            # Процесс завершился раньше, чем выдал результаты всех своих кейсов
+            self.error = f"Ошибка выполнения кода:\n{process.stderr or 'процесс завершился аварийно'}"
+            return True
+        return False
+
+    async def _read_verdicts(self, process, pending: set) -> bool:
+        async for line in process.lines():
+            position = line.find(self.marker)
+            if position < 0:
+                continue  # обычный вывод решения
+            try:
+                payload = json.loads(line[position + len(self.marker):])
+                index = int(payload["case"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            if index == -1:
+                self.error = f"Ошибка выполнения кода:\n{payload.get('error', '')}"
+                return True
+            if index not in pending:
+                continue
+            pending.discard(index)
+            self.verdicts[index] = _check_case(index, self.test_cases[index], payload)
+            if self.progress is not None:
+                self.progress(len(self.verdicts), len(self.test_cases))
+            if self.early_exit and not self.verdicts[index]["passed"]:
+                return True
+            if not pending:
+                break
+        return False
+
+
+async def judge(code: str, language: str, test_cases: list, early_exit: bool = True, progress=None) -> JudgeResult:
+    """
+    Проверяет решение на всех кейсах; кейсы выполняются параллельно в нескольких процессах.
+    language — внутреннее имя языка (см. executor.normalize_language).
+    progress(выполнено, всего) вызывается после каждого проверенного кейса.
+    """
+    run = _JudgeRun(test_cases, _marker(language, code, test_cases), early_exit, progress)
+    started = time.monotonic()
+
+    async with executor.slots[language]:
+        async with workspace.pool.acquire() as workdir:
+            try:
+                async with _harness(language, code, test_cases, run.marker, workdir) as (args, preexec_fn, stdin_for):
+                    started = time.monotonic()  # время компиляции в метрики посылки не входит
+                    parts = [asyncio.ensure_future(run.run_part(indices, args, preexec_fn, stdin_for(indices), workdir))
+                             for indices in _split_cases(len(test_cases))]
+                    try:
+                        for finished in asyncio.as_completed(parts):
+                            if await finished:
+                                break
+                    finally:
+                        # Ошибка или провал при early_exit: остальные процессы больше не нужны
+                        for part in parts:
+                            part.cancel()
+                        await asyncio.gather(*parts, return_exceptions=True)
+            except CompileError as e:
+                run.error = f"Ошибка компиляции:\n{e}"
+            except subprocess.TimeoutExpired:
+                run.timed_out = True
+                run.error = f"Ошибка: Время выполнения превышено (максимум {JUDGE_TIMEOUT} секунд)"
+
+    results = []
+    if run.error is not None:
+        results.append({"test_id": "all", "passed": False, "message": run.error})
+    for index, case in enumerate(test_cases):
+        if index in run.verdicts:
+            results.append(run.verdicts[index])
+        else:
+            results.append({"test_id": index + 1, "input": case.get("input"), "passed": False, "skipped": True,
+                            "message": "Тест не выполнен"})
+
+    all_passed = (run.error is None and bool(test_cases) and len(run.verdicts) == len(test_cases)
+                  and all(r["passed"] for r in run.verdicts.values()))
+    return JudgeResult(
+        results, all_passed,
+        cpu_time_ms=round(sum(process.cpu_time for process in run.processes) * 1000),
+        wall_time_ms=round((time.monotonic() - started) * 1000),
+        peak_rss_kb=max((process.peak_rss_kb for process in run.processes), default=0),
+        timed_out=run.timed_out,
+    )
@@ -0,0 +1,338 @@
+import javax.tools.FileObject;
+import javax.tools.ForwardingJavaFileManager;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.SimpleJavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+import java.io.BufferedReader;
+import java.io.ByteArrayInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.FileDescriptor;
+import java.io.FileInputStream;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.io.StringWriter;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.URI;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+import java.util.Arrays;
+import java.util.Base64;
+import java.util.Collections;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+
+/**
+ * JVM-воркер CodeQuest (см. app/jvm_pool.py): запускается заранее и выполняет ровно
+ * одно задание, после чего завершается. Потоки, статическое состояние и System.out/err
+ * одного решения не достаются решению другого пользователя.
+ *
+ * Задание — одна строка stdin: "<таймаут мс> <лимит вывода, байт> <base64 имя класса> <base64 исходник> <0|1>",
+ * где последнее поле — потоковый режим: вывод решения ещё и пересылается по мере
+ * появления строками "OUTPUT <stdout|stderr> <base64 часть>".
+ * Исходник компилируется в памяти через javax.tools, классы загружаются отдельным
+ * загрузчиком на каждый запуск, после чего вызывается main().
+ * Ответ — одна строка stdout: "<RUN|COMPILE|TIMEOUT|LIMIT> <код выхода> <base64 stdout> <base64 stderr>".
+ * LIMIT — решение вывело больше разрешённого и было остановлено.
+ */
+public class JavaRunner {
+
+    private static final Base64.Encoder ENCODER = Base64.getEncoder();
+    private static final Base64.Decoder DECODER = Base64.getDecoder();
+
+    /** Исходный код, хранящийся в памяти. */
+    static final class SourceFile extends SimpleJavaFileObject {
+        private final String code;
+
+        SourceFile(String className, String code) {
+            super(URI.create("string:///" + className.replace('.', '/') + Kind.SOURCE.extension), Kind.SOURCE);
+            this.code = code;
+        }
+
+        @Override
+        public CharSequence getCharContent(boolean ignoreEncodingErrors) {
+            return code;
+        }
+    }
+
+    /** Байткод класса, записываемый компилятором в память. */
+    static final class ClassFile extends SimpleJavaFileObject {
+        private final ByteArrayOutputStream bytes = new ByteArrayOutputStream();
+
+        ClassFile(String className, Kind kind) {
+            super(URI.create("mem:///" + className.replace('.', '/') + kind.extension), kind);
+        }
+
+        @Override
+        public OutputStream openOutputStream() {
+            return bytes;
+        }
+
+        byte[] toByteArray() {
+            return bytes.toByteArray();
+        }
+    }
+
+    static final class MemoryFileManager extends ForwardingJavaFileManager<StandardJavaFileManager> {
+        private final Map<String, ClassFile> classes = new HashMap<>();
+
+        MemoryFileManager(StandardJavaFileManager fileManager) {
+            super(fileManager);
+        }
+
+        @Override
+        public JavaFileObject getJavaFileForOutput(Location location, String className,
+                                                   JavaFileObject.Kind kind, FileObject sibling) {
+            ClassFile file = new ClassFile(className, kind);
+            classes.put(className, file);
+            return file;
+        }
+    }
+
+    /** Загрузчик классов одного запуска: статическое состояние решений не переживает запуск. */
+    static final class SubmissionClassLoader extends ClassLoader {
+        private final Map<String, ClassFile> classes;
+
+        SubmissionClassLoader(Map<String, ClassFile> classes) {
+            // Родитель — платформенный загрузчик: классы самого воркера решению не видны
+            super(ClassLoader.getPlatformClassLoader());
+            this.classes = classes;
+        }
+
+        @Override
+        protected Class<?> findClass(String name) throws ClassNotFoundException {
+            ClassFile file = classes.get(name);
+            if (file == null) {
+                throw new ClassNotFoundException(name);
+            }
+            byte[] bytes = file.toByteArray();
+            return defineClass(name, bytes, 0, bytes.length);
+        }
+    }
+
+    /** Бросается из write(), когда вывод решения превысил лимит; Error — чтобы не перехватывался catch (Exception). */
+    static final class OutputLimitError extends Error {
+        OutputLimitError() {
+            super("output limit exceeded", null, false, false);
+        }
+    }
+
+    /** Буфер вывода с общим для stdout и stderr лимитом; name != null — потоковый режим. */
+    static final class CappedOutputStream extends ByteArrayOutputStream {
+        private final long[] budget;
+        private final String name;
+        private boolean attached = true;
+
+        CappedOutputStream(long[] budget, String name) {
+            this.budget = budget;
+            this.name = name;
+        }
+
+        /** После ответа на задание потоки, оставленные решением, больше ничего не пересылают. */
+        synchronized void detach() {
+            attached = false;
+        }
+
+        private void emit(byte[] bytes, int offset, int length) {
+            if (name != null && attached && length > 0) {
+                byte[] chunk = Arrays.copyOfRange(bytes, offset, offset + length);
+                synchronized (JavaRunner.class) {
+                    protocolOut.print("OUTPUT " + name + " " + ENCODER.encodeToString(chunk) + "\n");
+                    protocolOut.flush();
+                }
+            }
+        }
+
+        @Override
+        public synchronized void write(int b) {
+            write(new byte[]{(byte) b}, 0, 1);
+        }
+
+        @Override
+        public synchronized void write(byte[] bytes, int offset, int length) {
+            if (length > budget[0]) {
+                super.write(bytes, offset, (int) budget[0]);
+                emit(bytes, offset, (int) budget[0]);
+                budget[0] = 0;
+                throw new OutputLimitError();
+            }
+            budget[0] -= length;
+            super.write(bytes, offset, length);
+            emit(bytes, offset, length);
+        }
+    }
+
+    /** Перехват System.exit() из кода решения (работает, пока JVM разрешает SecurityManager). */
+    static final class ExitException extends SecurityException {
+        final int status;
+
+        ExitException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    /**
+     * Только перехватывает System.exit(), остальное разрешает: решение изолировано не
+     * SecurityManager, а процессом — отдельная JVM на задание, свой каталог и rlimit (см. app/jvm_pool.py).
+     */
+    @SuppressWarnings("removal")
+    static final class ExitTrap extends SecurityManager {
+        @Override
+        public void checkPermission(Permission perm) {
+        }
+
+        @Override
+        public void checkExit(int status) {
+            if (!shuttingDown) {
+                throw new ExitException(status);
+            }
+        }
+    }
+
+    private static final JavaCompiler COMPILER = ToolProvider.getSystemJavaCompiler();
+    private static final StandardJavaFileManager STANDARD_FILE_MANAGER =
+            COMPILER.getStandardFileManager(null, null, StandardCharsets.UTF_8);
+
+    private static PrintStream protocolOut;
+    private static volatile boolean shuttingDown = false;
+
+    public static void main(String[] args) throws Exception {
+        BufferedReader requests = new BufferedReader(
+                new InputStreamReader(new FileInputStream(FileDescriptor.in), StandardCharsets.UTF_8));
+        protocolOut = new PrintStream(new FileOutputStream(FileDescriptor.out), false, "UTF-8");
+        // Канал ответов доступен только воркеру: System.out всё время, кроме запуска
+        // решения, указывает на stderr, поэтому вывод оставшихся потоков решения
+        // не попадёт в протокол
+        System.setOut(new PrintStream(new FileOutputStream(FileDescriptor.err), true, "UTF-8"));
+
+        try {
+            installExitTrap();
+        } catch (UnsupportedOperationException | SecurityException ignored) {
+            // Новые JVM запрещают SecurityManager: System.exit() просто завершит воркер,
+            // а пул на стороне Python заменит его новым.
+        }
+
+        String line = requests.readLine();
+        if (line != null) {
+            String[] parts = line.split(" ", -1);
+            long timeoutMs = Long.parseLong(parts[0]);
+            long maxOutput = Long.parseLong(parts[1]);
+            String className = decode(parts[2]);
+            String source = decode(parts[3]);
+            boolean stream = parts.length > 4 && parts[4].equals("1");
+            handle(className, source, timeoutMs, maxOutput, stream);
+        }
+        // Не ждём потоков, оставленных решением (в том числе зависшего main() после TIMEOUT)
+        shuttingDown = true;
+        Runtime.getRuntime().halt(0);
+    }
+
+    @SuppressWarnings("removal")
+    private static void installExitTrap() {
+        System.setSecurityManager(new ExitTrap());
+    }
+
+    private static void handle(String className, String source, long timeoutMs, long maxOutput, boolean stream)
+            throws InterruptedException {
+        // 1. Компиляция в памяти
+        StringWriter compilerOutput = new StringWriter();
+        MemoryFileManager fileManager = new MemoryFileManager(STANDARD_FILE_MANAGER);
+        List<String> options = List.of("-proc:none", "-Xlint:none");
+        boolean compiled = COMPILER.getTask(compilerOutput, fileManager, null, options, null,
+                Collections.singletonList(new SourceFile(className, source))).call();
+        if (!compiled) {
+            respond("COMPILE", 1, "", compilerOutput.toString());
+            return;
+        }
+
+        // 2. Запуск main() в отдельном потоке с перехватом вывода
+        long[] budget = {maxOutput};
+        CappedOutputStream stdout = new CappedOutputStream(budget, stream ? "stdout" : null);
+        CappedOutputStream stderr = new CappedOutputStream(budget, stream ? "stderr" : null);
+        int[] exitCode = {0};
+        boolean[] limitExceeded = {false};
+
+        Thread runner = new Thread(() -> {
+            try {
+                Class<?> mainClass = new SubmissionClassLoader(fileManager.classes).loadClass(className);
+                Method mainMethod = mainClass.getMethod("main", String[].class);
+                mainMethod.setAccessible(true);
+                mainMethod.invoke(null, (Object) new String[0]);
+            } catch (InvocationTargetException e) {
+                Throwable cause = e.getCause();
+                if (cause instanceof ExitException) {
+                    exitCode[0] = ((ExitException) cause).status;
+                } else if (cause instanceof OutputLimitError) {
+                    limitExceeded[0] = true;
+                    exitCode[0] = 1;
+                } else {
+                    printStackTrace(cause, limitExceeded);
+                    exitCode[0] = 1;
+                }
+            } catch (ClassNotFoundException | NoSuchMethodException e) {
+                System.err.println("Ошибка: не найден метод public static void main(String[]) в классе " + className);
+                exitCode[0] = 1;
+            } catch (OutputLimitError e) {
+                limitExceeded[0] = true;
+                exitCode[0] = 1;
+            } catch (Throwable e) {
+                printStackTrace(e, limitExceeded);
+                exitCode[0] = 1;
+            }
+        });
+
+        PrintStream originalOut = System.out;  // stderr, см. main()
+        PrintStream originalErr = System.err;
+        System.setIn(new ByteArrayInputStream(new byte[0]));
+        System.setOut(new PrintStream(stdout, true, StandardCharsets.UTF_8));
+        System.setErr(new PrintStream(stderr, true, StandardCharsets.UTF_8));
+        boolean finished;
+        try {
+            runner.start();
+            runner.join(timeoutMs);
+            finished = !runner.isAlive();
+        } finally {
+            System.out.flush();
+            System.err.flush();
+            stdout.detach();
+            stderr.detach();
+            System.setOut(originalOut);
+            System.setErr(originalErr);
+        }
+
+        if (!finished) {
+            respond("TIMEOUT", -1, stdout.toString(StandardCharsets.UTF_8), stderr.toString(StandardCharsets.UTF_8));
+            return;
+        }
+        respond(limitExceeded[0] ? "LIMIT" : "RUN", exitCode[0], stdout.toString(StandardCharsets.UTF_8), stderr.toString(StandardCharsets.UTF_8));
+    }
+
+    private static void printStackTrace(Throwable error, boolean[] limitExceeded) {
+        try {
+            error.printStackTrace();
+        } catch (OutputLimitError e) {
+            limitExceeded[0] = true;
+        }
+    }
+
+    private static String decode(String value) {
+        return new String(DECODER.decode(value), StandardCharsets.UTF_8);
+    }
+
+    private static String encode(String value) {
+        return ENCODER.encodeToString(value.getBytes(StandardCharsets.UTF_8));
+    }
+
+    private static void respond(String kind, int exitCode, String stdout, String stderr) {
+        synchronized (JavaRunner.class) {
+            protocolOut.print(kind + " " + exitCode + " " + encode(stdout) + " " + encode(stderr) + "\n");
+            protocolOut.flush();
+        }
+    }
+}
@@ -0,0 +1,119 @@
+"""
+Пул долгоживущих JVM для запуска Java-решений.
+
+Каждый воркер — процесс java с классом JavaRunner (app/jvm/JavaRunner.java),
+который компилирует решение в памяти и запускает его в отдельном загрузчике
+классов. Так запуск Java не платит за старт javac, а старт JVM происходит
+заранее, в фоне. Сам JavaRunner компилируется один раз при старте пула.
+
+Как и Python-воркеры, JVM однопользовательская: выполняет одно задание и
+заменяется новой (System.out/err, статическое состояние и потоки решения
+общие на всю JVM). Воркеры работают в отдельном каталоге с теми же rlimit,
+что и обычный запуск java (executor.sandbox_limits).
+"""
+import asyncio
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from .worker_pool import WorkerPool
+
+RUNNER_SOURCE = Path(__file__).parent / "jvm" / "JavaRunner.java"
+RUNNER_CLASS = "JavaRunner"
+JAVA_EXECUTABLE = os.environ.get("JAVA_EXECUTABLE", "java")
+JAVAC_EXECUTABLE = os.environ.get("JAVAC_EXECUTABLE", "javac")
+
+# Параметры JVM воркера: быстрый старт и ограничение кучи
+JVM_OPTIONS = ["-XX:+UseSerialGC", "-XX:TieredStopAtLevel=1", "-Xss8m",
+               "-Xmx" + os.environ.get("JVM_WORKER_HEAP", "256m")]
+
+
+def _b64(value: str) -> str:
+    return base64.b64encode(value.encode("utf-8")).decode("ascii")
+
+
+def _unb64(value: str) -> str:
+    return base64.b64decode(value).decode("utf-8", errors="replace")
+
+
+class JvmWorkerPool(WorkerPool):
+    """Пул JVM-воркеров. Задание: {"class_name", "source", "timeout", "max_output", "stream"}."""
+
+    def __init__(self, size: int, preexec_fn=None):
+        super().__init__(size, max_runs=1, preexec_fn=preexec_fn)
+        self.classpath = None
+        self.workdir = None
+        self.available = None  # None — ещё не проверяли, False — java/javac недоступны
+
+    async def prepare(self) -> bool:
+        """Компилирует JavaRunner (один раз на версию исходника) и запускает воркеры."""
+        if self.available is None:
+            self.available = await self._compile_runner()
+        if self.available:
+            await self.start()
+        return self.available
+
+    async def _compile_runner(self) -> bool:
+        source = RUNNER_SOURCE.read_bytes()
+        runner_dir = Path(tempfile.gettempdir()) / "codequest-jvm-runner" / hashlib.sha256(source).hexdigest()[:16]
+        if not (runner_dir / (RUNNER_CLASS + ".class")).exists():
+            runner_dir.parent.mkdir(parents=True, exist_ok=True)
+            build_dir = Path(tempfile.mkdtemp(prefix="build-", dir=runner_dir.parent))
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    JAVAC_EXECUTABLE, "-d", str(build_dir), str(RUNNER_SOURCE),
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL,
+                )
+                if await process.wait() != 0:
+                    return False
+                try:
+                    os.rename(build_dir, runner_dir)
+                except OSError:
+                    pass  # уже скомпилирован другим процессом
+            except OSError:
+                return False
+            finally:
+                shutil.rmtree(build_dir, ignore_errors=True)
+        self.classpath = str(runner_dir)
+        return True
+
+    def command(self) -> list:
+        return [JAVA_EXECUTABLE, *JVM_OPTIONS, "-cp", self.classpath, RUNNER_CLASS]
+
+    def cwd(self) -> str:
+        # Воркеры работают в отдельном каталоге, а не в каталоге приложения
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp(prefix="codequest-java-")
+        return self.workdir
+
+    def encode_request(self, payload) -> bytes:
+        timeout_ms = int(payload["timeout"] * 1000)
+        stream = 1 if payload.get("stream") else 0
+        line = (f"{timeout_ms} {payload['max_output']} {_b64(payload['class_name'])} "
+                f"{_b64(payload['source'])} {stream}\n")
+        return line.encode("ascii")
+
+    def decode_response(self, line: bytes) -> dict:
+        line = line.decode("ascii").rstrip("\n")
+        if line.startswith("OUTPUT "):
+            _, name, data = line.split(" ", 2)
+            return {"kind": "OUTPUT", "stream": name, "data": _unb64(data)}
+        kind, returncode, stdout, stderr = line.split(" ", 3)
+        return {"kind": kind, "returncode": int(returncode), "stdout": _unb64(stdout), "stderr": _unb64(stderr)}
+
+    def output_chunk(self, message: dict):
+        if message["kind"] == "OUTPUT":
+            return message["stream"], message["data"]
+        return None
+
+    def crash_response(self) -> dict:
+        return {
+            "kind": "RUN",
+            "returncode": -1,
+            "stdout": "",
+            "stderr": "Ошибка: JVM аварийно завершилась (System.exit() или превышен лимит памяти)",
+        }
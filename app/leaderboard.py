@@ -0,0 +1,189 @@
+"""
+Таблица лидеров по XP в памяти процесса.
+
+Пользователи хранятся в отсортированном списке ключей (-total_xp, id), поэтому
+место пользователя находится двоичным поиском (O(log n)), а первые K мест — срез
+списка; сортировки таблицы users на каждый запрос нет.
+
+Индекс строится из БД при старте и обновляется сразу при начислении XP
+(complete_task), регистрации и смене аватара в этом процессе. Изменения,
+сделанные другими процессами uvicorn, подтягиваются раз в
+LEADERBOARD_REFRESH_INTERVAL секунд дельтой: строки users, записанные
+транзакциями не старше горизонта видимости прошлого обновления (users.xid,
+см. xp_rollup.visibility_horizon), — так не теряются и долгие транзакции.
+Пользователи, которых этот процесс обновил сам, пока шёл запрос дельты, из неё
+не берутся (значение в памяти не старее) и перечитываются следующей дельтой.
+"""
+import asyncio
+import bisect
+import os
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models, xp_rollup
+
+LEADERBOARD_REFRESH_INTERVAL = float(os.environ.get("LEADERBOARD_REFRESH_INTERVAL", "30"))
+
+
+class Leaderboard:
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._keys = []  # отсортированные (-total_xp, id)
+        self._users = {}  # id -> (total_xp, имя, аватар)
+        self._horizon = None  # горизонт видимости на момент прошлой загрузки
+        self._touched = None  # пользователи, обновлённые в процессе во время запроса дельты
+        self._recheck = set()  # их перечитываем следующей дельтой
+        self._refresher = None
+        self.rebuilds = 0
+        self.refreshes = 0
+        self.updates = 0
+
+    @staticmethod
+    def _columns():
+        return select(models.User.id, models.User.total_xp, models.User.name, models.User.avatar)
+
+    async def load(self, db: AsyncSession):
+        """Перестраивает индекс по таблице users."""
+        # Горизонт берётся до чтения: всё, что записано до него, чтение увидит
+        horizon = await db.scalar(select(xp_rollup.visibility_horizon()))
+        rows = await self._read(db, self._columns())
+        users = {user_id: (total_xp or 0, name, avatar) for user_id, total_xp, name, avatar in rows}
+        for user_id in self._touched_users():
+            if user_id in self._users:
+                users[user_id] = self._users[user_id]
+        self._keys = sorted((-entry[0], user_id) for user_id, entry in users.items())
+        self._users = users
+        self._horizon = horizon
+        self.rebuilds += 1
+
+    async def refresh(self, db: AsyncSession):
+        """Подтягивает пользователей, изменённых после прошлой загрузки."""
+        if self._horizon is None:
+            await self.load(db)
+            return
+        horizon = await db.scalar(select(xp_rollup.visibility_horizon()))
+        recheck, self._recheck = self._recheck, set()
+        try:
+            changed = models.User.xid >= self._horizon
+            if recheck:
+                changed |= models.User.id.in_(recheck)
+            rows = await self._read(db, self._columns().where(changed))
+        except BaseException:
+            self._recheck |= recheck
+            raise
+        touched = self._touched_users()
+        for user_id, total_xp, name, avatar in rows:
+            if user_id not in touched:
+                self._set(user_id, (total_xp or 0, name, avatar))
+        self._horizon = horizon
+        self.refreshes += 1
+
+    async def _read(self, db: AsyncSession, statement) -> list:
+        self._touched = set()
+        try:
+            return (await db.execute(statement)).all()
+        finally:
+            self._recheck |= self._touched
+
+    def _touched_users(self) -> set:
+        touched, self._touched = self._touched or set(), None
+        return touched
+
+    def _touch(self, user_id: int):
+        if self._touched is not None:
+            self._touched.add(user_id)
+
+    def _set(self, user_id: int, entry: tuple):
+        old = self._users.get(user_id)
+        if old == entry:
+            return
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old[0], user_id))]
+        self._users[user_id] = entry
+        bisect.insort(self._keys, (-entry[0], user_id))
+
+    def update(self, user_id: int, total_xp: int, name: Optional[str] = None, avatar: Optional[str] = None):
+        """Новое значение XP пользователя; имя и аватар меняются, если переданы."""
+        self._touch(user_id)
+        old = self._users.get(user_id)
+        if old is not None:
+            name = old[1] if name is None else name
+            avatar = old[2] if avatar is None else avatar
+        self._set(user_id, (total_xp, name, avatar))
+        self.updates += 1
+
+    def update_profile(self, user_id: int, name: Optional[str] = None, avatar: Optional[str] = None):
+        """Новые имя и/или аватар пользователя, который уже есть в индексе."""
+        old = self._users.get(user_id)
+        if old is not None:
+            self.update(user_id, old[0], name, avatar)
+
+    def remove(self, user_id: int):
+        self._touch(user_id)
+        old = self._users.pop(user_id, None)
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old[0], user_id))]
+
+    def rank_of_xp(self, total_xp: int) -> int:
+        # Одинаковый XP — одинаковое место (1, 2, 2, 4): 1 + число пользователей с большим XP
+        return bisect.bisect_left(self._keys, (-total_xp,)) + 1
+
+    def _entry(self, position: int) -> dict:
+        total_xp, user_id = -self._keys[position][0], self._keys[position][1]
+        _, name, avatar = self._users[user_id]
+        return {
+            "rank": self.rank_of_xp(total_xp),
+            "user_id": user_id,
+            "name": name,
+            "avatar": avatar,
+            "total_xp": total_xp,
+            "level": max(1, total_xp // models.XP_PER_LEVEL + 1),
+        }
+
+    def top(self, k: int) -> list:
+        return [self._entry(position) for position in range(min(k, len(self._keys)))]
+
+    def around(self, user_id: int, radius: int) -> Optional[dict]:
+        """Место пользователя и по radius соседей выше и ниже; None, если пользователя нет в индексе."""
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        position = bisect.bisect_left(self._keys, (-entry[0], user_id))
+        start, end = max(0, position - radius), min(len(self._keys), position + radius + 1)
+        return {
+            **self._entry(position),
+            "total_users": len(self._keys),
+            "neighbours": [self._entry(i) for i in range(start, end)],
+        }
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    await self.refresh(db)
+            except Exception as e:
+                # БД недоступна — продолжаем с текущим индексом до следующей попытки
+                print(f"Не удалось обновить таблицу лидеров: {e}")
+
+    async def start(self):
+        if self._refresher is not None:
+            return
+        async with database.AsyncSessionLocal() as db:
+            await self.load(db)
+        self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+
+    def stats(self) -> dict:
+        return {"users": len(self._keys), "rebuilds": self.rebuilds, "refreshes": self.refreshes,
+                "updates": self.updates}
+
+
+board = Leaderboard(LEADERBOARD_REFRESH_INTERVAL)
@@ -2,20 +2,25 @@ import tempfile
 from cmath import e
 from typing import Optional, List
 import re
-from fastapi import Request, Depends, HTTPException, status, File, UploadFile, Form, FastAPI, Cookie, APIRouter
-from fastapi.openapi.models import Response
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+import json
+import base64
+import hashlib
+import asyncio
+from fastapi import Request, Depends, HTTPException, status, File, UploadFile, Form, FastAPI, Cookie, APIRouter, Query, \
+    WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from jose import jwt, JWTError
 from sqlalchemy.engine import result
-from sqlalchemy.orm import Session, joinedload  # Импортируем joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 from pathlib import Path
 import shutil
 import os
-from . import models, crud, auth, database, schemas
-from .database import get_db
+from . import models, async_crud, auth, database, schemas, executor, judge, jobs, verdict_cache, user_cache, password_hasher, \
+    task_catalog, completion_index, leaderboard, xp_rollup, achievements, chat_hub, chat_cache, chat_writer, chat_archive, avatars
+from .database import get_async_db
 import subprocess
 
 app = FastAPI()
@@ -26,6 +31,8 @@ if not os.path.exists("uploads"):
     os.makedirs("uploads")
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 templates = Jinja2Templates(directory="app/templates")
+# {{ user.avatar|avatar(64) }} — копия аватара нужного размера
+templates.env.filters["avatar"] = avatars.sized_url
 security = HTTPBearer()
 
 # Получаем путь к папке static, относительно текущего файла (main.py)
@@ -36,33 +43,53 @@ app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 UPLOAD_DIR = Path("uploads/avatars")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-# Зависимость: Получение текущего пользователя
-def get_current_user(
+# Зависимость: Получение текущего пользователя.
+# Возвращает снимок пользователя из кэша (app/user_cache.py); чтобы изменить
+# пользователя, загрузите его из БД.
+async def get_current_user(
         token: Optional[str] = Cookie(None),
-        db: Session = Depends(get_db)  # Используем Depends(get_db)
-) -> models.User:
+        db: AsyncSession = Depends(get_async_db)
+) -> user_cache.UserSnapshot:
     # Если токен отсутствует (пользователь не залогинен), перенаправляем на логин
     if not token:
         # Для страниц, требующих аутентификации, бросаем 401
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
     try:
-        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-        user_id: int = payload.get("id")
+        user_id = user_cache.cache.user_id_for_token(token)
         if user_id is None:
             # Ошибка токена, но пользователь может быть анонимным на некоторых страницах
             raise HTTPException(status_code=401, detail="Неверный токен (нет ID)")
     except JWTError:
         raise HTTPException(status_code=401, detail="Неверный или истекший токен")
 
-    # Ищем пользователя в базе данных
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if user is None:
+    # Сначала кэш, затем база данных
+    user = user_cache.cache.get(user_id)
+    if user is not None:
+        return user
+    db_user = await async_crud.get_user_by_id(db, user_id)
+    if db_user is None:
         raise HTTPException(status_code=401, detail="Пользователь не найден")
-    return user
+    return user_cache.cache.put(db_user)
+
+def job_owner(request: Request, token: Optional[str]) -> str:
+    """Ключ владельца задания в очереди: пользователь по токену или, для анонимных запусков, IP-адрес."""
+    if token:
+        try:
+            user_id = user_cache.cache.user_id_for_token(token)
+            if user_id is not None:
+                return f"user:{user_id}"
+        except JWTError:
+            pass
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+def hashing_overloaded() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Сервер перегружен, повторите попытку через несколько секунд",
+                         headers={"Retry-After": "5"})
 
 # Зависимость: Проверка, является ли пользователь администратором
-def is_admin(current_user: models.User = Depends(get_current_user)):
+def is_admin(current_user: user_cache.UserSnapshot = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -90,7 +117,7 @@ def knowledge(request: Request):
     return templates.TemplateResponse("knowledge.html", {"request": request})
 
 @app.get("/challenges", response_class=HTMLResponse)
-def challenges(request: Request, user: models.User = Depends(get_current_user)):
+def challenges(request: Request, user: user_cache.UserSnapshot = Depends(get_current_user)):
     # Если зависимость get_current_user отработала, значит, токен валиден, и у нас есть user.
     return templates.TemplateResponse("challenges.html", {"request": request, "user": user})
 
@@ -121,13 +148,21 @@ def login_page(request: Request):
 
 
 @app.post("/login")
-async def login(request: Request, db: Session = Depends(database.get_db)):
+async def login(request: Request, db: AsyncSession = Depends(get_async_db)):
     form = await request.form()
     email = form.get("email")
     password = form.get("password")
-    user = crud.get_user_by_email(db, email)
-    if not user or not auth.verify_password(password, user.password):
-        return templates.TemplateResponse("login.html", {"request": request, "error": "Неверный email или пароль"})
+    user = await async_crud.get_user_by_email(db, email)
+    # bcrypt выполняется в пуле процессов, а не в цикле событий
+    try:
+        if not user or not await password_hasher.hasher.verify(password, user.password):
+            return templates.TemplateResponse("login.html", {"request": request, "error": "Неверный email или пароль"})
+        # Стоимость bcrypt поменялась — перехэшируем пароль, пока он известен
+        if auth.needs_rehash(user.password):
+            user.password = await password_hasher.hasher.hash(password)
+            await db.commit()
+    except password_hasher.Saturated:
+        raise hashing_overloaded()
     token = auth.create_access_token(data={"id": user.id})
     response = RedirectResponse(url="/profile", status_code=status.HTTP_303_SEE_OTHER)
     response.set_cookie(key="token", value=token, httponly=True, max_age=86400)
@@ -140,7 +175,7 @@ def register_page(request: Request):
 
 
 @app.post("/register")
-async def register(request: Request, db: Session = Depends(database.get_db)):
+async def register(request: Request, db: AsyncSession = Depends(get_async_db)):
     form = await request.form()
     name = form.get("name")
     email = form.get("email")
@@ -154,7 +189,7 @@ async def register(request: Request, db: Session = Depends(database.get_db)):
     if password != confirm:
         return templates.TemplateResponse("register.html", {"request": request, "error": "Пароли не совпадают"})
 
-    if crud.get_user_by_email(db, email):
+    if await async_crud.get_user_by_email(db, email):
         return templates.TemplateResponse("register.html",
                                           {"request": request, "error": "Пользователь с таким email уже существует"})
 
@@ -169,9 +204,12 @@ async def register(request: Request, db: Session = Depends(database.get_db)):
     except Exception as e:
         return templates.TemplateResponse("register.html", {"request": request, "error": f"Ошибка данных: {e}"})
 
-    # ИСПРАВЛЕНО: Используем правильное имя функции hash_password
-    hashed_pw = auth.hash_password(user_create_schema.password)
-    user = crud.create_user(db, user_create_schema, hashed_pw)
+    # bcrypt выполняется в пуле процессов, а не в цикле событий
+    try:
+        hashed_pw = await password_hasher.hasher.hash(user_create_schema.password)
+    except password_hasher.Saturated:
+        raise hashing_overloaded()
+    user = await async_crud.create_user(db, user_create_schema, hashed_pw)
 
     if not user:
         return templates.TemplateResponse("register.html",
@@ -184,44 +222,28 @@ async def register(request: Request, db: Session = Depends(database.get_db)):
 
 
 @app.get("/profile", response_class=HTMLResponse)
-def profile(request: Request, user: models.User = Depends(get_current_user)):
+def profile(request: Request, user: user_cache.UserSnapshot = Depends(get_current_user)):
     return templates.TemplateResponse("profile.html", {"request": request, "user": user})
 
 
-@app.post("/upload-avatar")
+@app.post("/upload-avatar", status_code=status.HTTP_202_ACCEPTED)
 async def upload_avatar(
-        file: UploadFile = File(...),
-        current_user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        request: Request,
+        current_user: user_cache.UserSnapshot = Depends(get_current_user),
 ):
-    # Логика загрузки аватара (оставлена без изменений)
-    if not file.content_type or not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="Разрешены только изображения")
-
-    content = await file.read()
-    if len(content) > 5 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="Файл слишком большой (макс. 5 МБ)")
-
-    if current_user.avatar and not current_user.avatar.startswith("http"):
-        old_path = Path("uploads") / current_user.avatar.lstrip("/")
-        if old_path.exists():
-            old_path.unlink()
-
-    ext = Path(file.filename).suffix.lower()
-    if ext not in {".png", ".jpg", ".jpeg", ".gif", ".webp"}:
-        raise HTTPException(status_code=400, detail="Недопустимое расширение файла")
-
-    filename = f"avatar-{current_user.id}{ext}"
-    file_path = Path("uploads/avatars") / filename
-
-    with open(file_path, "wb") as f:
-        f.write(content)
-
-    avatar_url = f"/uploads/avatars/{filename}"
-    current_user.avatar = avatar_url
-    db.commit()
+    """
+    Загрузка аватара потоком с проверкой размера по ходу чтения (app/avatars.py).
+    WebP-копии 32/64/256 делаются в фоне; avatarPath — URL, по которому появится аватар.
+    """
+    try:
+        source, _ = await avatars.receive_upload(request, "file")
+        avatar_url = avatars.pipeline.submit(current_user.id, source)
+    except avatars.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except avatars.Saturated:
+        raise HTTPException(status_code=503, detail="Сервер перегружен, попробуйте позже")
 
-    return JSONResponse(content={"message": "Аватар успешно загружен", "avatarPath": avatar_url})
+    return {"message": "Аватар загружен и обрабатывается", "avatarPath": avatar_url}
 
 
 # ==================================
@@ -229,39 +251,45 @@ async def upload_avatar(
 # ==================================
 
 @app.get("/tasks", response_class=HTMLResponse)
-def tasks_page(request: Request, user: models.User = Depends(get_current_user), db: Session = Depends(database.get_db)):
-    # 1. Получаем все задачи
-    all_tasks = crud.get_all_tasks(db)
-    # 2. Получаем ID выполненных задач для текущего пользователя
-    completed_task_ids = crud.get_completed_task_ids_by_user(db, user.id)
-
-    # 3. Добавляем флаг is_completed к каждой задаче
-    tasks_with_status = []
-    for task in all_tasks:
-        # Используем Pydantic для преобразования модели БД в словарь
-        task_data = schemas.Task.model_validate(task).model_dump()
-        # Добавляем статус выполнения
-        task_data['is_completed'] = task.id in completed_task_ids
-        tasks_with_status.append(task_data)
+async def tasks_page(request: Request, user: user_cache.UserSnapshot = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    # 1. Получаем все задачи (из каталога в памяти, см. app/task_catalog.py)
+    catalog = await task_catalog.catalog.snapshot(db)
+    # 2. Множество ID выполненных задач текущего пользователя (см. app/completion_index.py)
+    completed_task_ids = await completion_index.index.get(db, user.id)
+
+    # 3. Добавляем флаг is_completed к каждой задаче за один проход (словари каталога не изменяем — копируем)
+    tasks_with_status = [{**task, 'is_completed': task['id'] in completed_task_ids}
+                         for task in catalog.tasks.values()]
 
     return templates.TemplateResponse("tasks.html", {"request": request, "user": user, "tasks": tasks_with_status})
 
 # НОВЫЙ ЭНДПОИНТ: Получение одной задачи по ID
 @app.get("/api/tasks/{task_id}", response_model=schemas.Task)
-def get_single_task(task_id: int, db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
-    task = crud.get_task_by_id(db, task_id)
-    if task is None:
+async def get_single_task(task_id: int, request: Request, db: AsyncSession = Depends(get_async_db),
+                          user: user_cache.UserSnapshot = Depends(get_current_user)):
+    # JSON задачи сериализован заранее, один раз на версию каталога
+    catalog = await task_catalog.catalog.snapshot(db)
+    body = catalog.detail_json.get(task_id)
+    if body is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
-    return task
+    headers = {"ETag": f'"tasks-{catalog.version}-{task_id}"', "Cache-Control": "private, no-cache"}
+    if etag_matches(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.post("/api/tasks/complete/{task_id}")
 async def complete_task_api(
         task_id: int,
-        user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        user_id: Optional[int] = None,
+        admin_user: user_cache.UserSnapshot = Depends(is_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
-    """API-эндпоинт для выполнения задачи (используется AJAX)."""
-    result = crud.complete_task(db, task_id, user.id)
+    """
+    Засчитывает задачу без проверки решения — только для администратора
+    (ручное начисление; ?user_id= — кому, по умолчанию самому администратору).
+    Пользователи решают задачи через /api/tasks/submit/{task_id}.
+    """
+    result = await async_crud.complete_task(db, user_id if user_id is not None else admin_user.id, task_id)
 
     if result["success"]:
         return JSONResponse(content={"success": True, "message": result["message"]}, status_code=status.HTTP_200_OK)
@@ -273,81 +301,278 @@ async def complete_task_api(
 async def submit_task_solution(
         task_id: int,
         request: Request,
-        user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        user: user_cache.UserSnapshot = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
     """
-    ВРЕМЕННАЯ ФИКСАЦИЯ: Игнорирует код пользователя и сразу завершает задачу,
-    чтобы обойти ошибку subprocess.
+    Принимает код пользователя и ставит его проверку в очередь (см. app/jobs.py).
+    Возвращает id задания; результат — через /api/jobs/{id} или /api/jobs/{id}/events.
+    Если такой же код уже проверялся на текущих кейсах задачи, вердикт берётся
+    из кэша (app/verdict_cache.py) и результат возвращается сразу, без очереди.
     """
+    try:
+        data = await request.json()
+    except:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Неверный формат JSON')
 
-    # 1. Получаем задачу, чтобы узнать награду (XP) и название
-    task = crud.get_task_by_id(db, task_id)
+    user_code = data.get('code', '')
+    language = executor.normalize_language(data.get('language', ''))
+
+    if not user_code:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Код пустой')
+
+    task = (await task_catalog.catalog.snapshot(db)).get(task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="Задача не найдена")
 
-    # 2. Вызываем функцию завершения задачи напрямую
-    complete_result = crud.complete_task(db, user.id, task_id)
+    if language is None or language != executor.normalize_language(task['language']):
+        return JSONResponse(
+            {'success': False, 'message': f"Язык кода не соответствует языку задачи '{task['language']}'", 'results': []},
+            status_code=status.HTTP_400_BAD_REQUEST)
 
-    # 3. Возвращаем успешный ответ, чтобы фронтенд продолжил работу
-    if complete_result["success"]:
-        # Формируем сообщение, как будто задача была пройдена идеально
-        message = f"Задача '{task.title}' завершена (проверка кода временно отключена). Начислено {task.xp_reward} XP."
+    # 1. Парсинг тестовых кейсов
+    try:
+        test_cases = judge.parse_test_cases(task['test_cases'])
+    except ValueError:
+        return JSONResponse({'success': False, 'message': 'Ошибка: Неверный формат тестовых кейсов в задаче.',
+                             'results': []},
+                            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    user_id, task_language, xp_reward = user.id, task['language'], task['xp_reward']
+    cache_key = verdict_cache.cache.make_key(task_id, task['test_cases'], language, user_code)
+
+    async def grade(job: Optional[jobs.Job]) -> dict:
+        # 2. Запуск кейсов (параллельно на нескольких процессах); проверка останавливается на первой ошибке.
+        # Одинаковые посылки берут вердикт из кэша или ждут уже идущую проверку
+        progress = job.report_progress if job is not None else None
+        try:
+            verdict = await verdict_cache.cache.judge(
+                cache_key, lambda on_progress: judge.judge(user_code, language, test_cases, progress=on_progress),
+                progress)
+        except FileNotFoundError:
+            return {'success': False, 'message': f"Компилятор/интерпретатор для языка '{task_language}' не найден.",
+                    'results': []}
+
+        # Задание выполняется после ответа на запрос — нужна своя сессия БД
+        async with database.AsyncSessionLocal() as job_db:
+            # 3. Сохранение посылки с метриками проверки
+            submission = await async_crud.create_submission(job_db, user_id, task_id, language, verdict.all_passed,
+                                                            verdict.results, verdict.metrics())
+            response = {"results": verdict.results, "metrics": verdict.metrics(), "submission_id": submission.id}
+
+            # 4. Завершение задачи, если все тесты пройдены
+            if not verdict.all_passed:
+                return {"success": False, "message": "Не все тесты пройдены.", **response}
+            complete_result = await async_crud.complete_task(job_db, user_id, task_id)
+            if complete_result["success"]:
+                message = f"Все тесты пройдены! Задача завершена. Начислено {xp_reward} XP."
+            else:
+                message = f"Все тесты пройдены, но {complete_result['message']}"
+            return {"success": True, "message": message, **response}
 
-        # Фиктивные результаты, чтобы фронтенд не сломался, если он ожидает массив results
-        mock_results = [{"test_id": 1, "passed": True}]
+    if verdict_cache.cache.get(cache_key) is not None:
+        return JSONResponse(await grade(None), status_code=status.HTTP_200_OK)
 
-        return JSONResponse({"success": True, "message": message, "results": mock_results},
-                            status_code=status.HTTP_200_OK)
-    else:
-        # Если crud.complete_task вернул ошибку (например, задача уже выполнена)
-        return JSONResponse({"success": False, "message": complete_result['message'], "results": []},
-                            status_code=status.HTTP_200_OK)
+    try:
+        job = jobs.queue.submit("submit", f"user:{user_id}", grade, jobs.PRIORITY_SUBMIT)
+    except jobs.QueueFull as e:
+        return JSONResponse({'success': False, 'message': str(e), 'results': []},
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return JSONResponse({"job_id": job.id, "status": job.status,
+                         "status_url": f"/api/jobs/{job.id}", "events_url": f"/api/jobs/{job.id}/events"},
+                        status_code=status.HTTP_202_ACCEPTED)
+
+
+def get_job_for_request(job_id: str, request: Request, token: Optional[str]) -> jobs.Job:
+    job = jobs.queue.get(job_id)
+    # Чужое задание не отличаем от несуществующего
+    if job is None or job.owner != job_owner(request, token):
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str, request: Request, token: Optional[str] = Cookie(None)):
+    """Состояние задания очереди: статус, прогресс и результат."""
+    return JSONResponse(get_job_for_request(job_id, request, token).snapshot())
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request, token: Optional[str] = Cookie(None)):
+    """События задания в формате Server-Sent Events; поддерживает переподключение по Last-Event-ID."""
+    job = get_job_for_request(job_id, request, token)
+    try:
+        after = int(request.headers.get("last-event-id", "0"))
+    except ValueError:
+        after = 0
+
+    async def event_stream():
+        async for item in job.stream(after):
+            if item is None:
+                yield ": keep-alive\n\n"
+                continue
+            event_id, event, data = item
+            yield f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+TASKS_PAGE_SIZE = 50
+TASKS_PAGE_MAX = 200
+
+
+def encode_task_cursor(task_id: int) -> str:
+    return base64.urlsafe_b64encode(str(task_id).encode()).decode().rstrip("=")
+
+
+def decode_task_cursor(cursor: str) -> int:
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный курсор")
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Проверка If-None-Match (слабое сравнение, как требует RFC 9110)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag.removeprefix("W/") for tag in header.split(","))
 
-    # Весь сложный код с парсингом JSON, tempfile и subprocess.run теперь игнорируется.
 
 @app.get("/api/tasks")
-def get_all_tasks_api(db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
-    """Возвращает все задачи в формате JSON."""
-    all_tasks = crud.get_all_tasks(db)
-    completed_task_ids = crud.get_completed_task_ids_by_user(db, user.id)
-
-    tasks_list = []
-    for task in all_tasks:
-        task_data = {
-            "id": task.id,
-            "title": task.title,
-            "description": task.description,
-            "difficulty": task.difficulty,
-            "language": task.language,
-            "xp_reward": task.xp_reward,
-            "is_completed": task.id in completed_task_ids,
-            "test_cases": task.test_cases  # как есть — строка JSON
-        }
-        tasks_list.append(task_data)
-
-    return tasks_list
+async def get_all_tasks_api(
+        request: Request,
+        cursor: Optional[str] = None,
+        limit: int = Query(TASKS_PAGE_SIZE, ge=1, le=TASKS_PAGE_MAX),
+        language: Optional[str] = None,
+        difficulty: Optional[str] = None,
+        completion: Optional[str] = Query(None, alias="status", pattern="^(completed|uncompleted)$"),
+        fields: Optional[str] = None,
+        db: AsyncSession = Depends(get_async_db),
+        user: user_cache.UserSnapshot = Depends(get_current_user)
+):
+    """
+    Страница задач в формате JSON: {"items": [...], "next_cursor": "..." или null}.
+    Следующая страница — ?cursor=<next_cursor>. Фильтры: language, difficulty,
+    status=completed|uncompleted. fields=id,title,... — какие поля вернуть
+    (по умолчанию без description и test_cases). Ответ с ETag; при совпадении
+    If-None-Match возвращается 304 без тела.
+    """
+    requested = [field.strip() for field in fields.split(",") if field.strip()] if fields \
+        else list(task_catalog.DEFAULT_LIST_FIELDS)
+    unknown = [field for field in requested if field not in task_catalog.LIST_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(unknown)}")
+    requested = list(dict.fromkeys(requested))
+
+    catalog = await task_catalog.catalog.snapshot(db)
+    completed_task_ids = await completion_index.index.get(db, user.id)
+    page_ids = catalog.page(
+        after_id=decode_task_cursor(cursor) if cursor else None,
+        limit=limit + 1,  # лишний id показывает, есть ли следующая страница
+        language=language,
+        difficulty=difficulty,
+        completed_ids=completed_task_ids,
+        completed=None if completion is None else completion == "completed",
+    )
+    next_cursor = encode_task_cursor(page_ids[limit - 1]) if len(page_ids) > limit else None
+    page_ids = page_ids[:limit]
+
+    # Тело ответа определяется версией каталога, параметрами и выполненными задачами страницы —
+    # ETag считаем по ним, не собирая сам ответ
+    completed_on_page = [task_id for task_id in page_ids if task_id in completed_task_ids]
+    etag_source = json.dumps([catalog.version, str(request.query_params), page_ids, completed_on_page])
+    etag = '"' + hashlib.sha256(etag_source.encode("utf-8")).hexdigest()[:32] + '"'
+    # Ответ зависит от пользователя (is_completed): только приватный кэш и с проверкой
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Cookie"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    items = []
+    for task_id in page_ids:
+        task = catalog.get(task_id)
+        items.append({field: task_id in completed_task_ids if field == "is_completed" else task[field]
+                      for field in requested})
+    body = json.dumps({"items": items, "next_cursor": next_cursor}, ensure_ascii=False, separators=(",", ":"))
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# ==================================
+# === ТАБЛИЦА ЛИДЕРОВ ===
+# ==================================
+
+@app.get("/api/leaderboard")
+def get_leaderboard(top: int = Query(10, ge=1, le=100)):
+    """Первые top пользователей по XP (индекс в памяти, см. app/leaderboard.py)."""
+    return {"total_users": leaderboard.board.stats()["users"], "top": leaderboard.board.top(top)}
+
+
+@app.get("/api/leaderboard/me")
+def get_my_leaderboard_position(radius: int = Query(2, ge=0, le=25),
+                                user: user_cache.UserSnapshot = Depends(get_current_user)):
+    """Место текущего пользователя и radius соседей выше и ниже."""
+    position = leaderboard.board.around(user.id, radius)
+    if position is None:
+        # Пользователь зарегистрирован через другой процесс и ещё не попал в индекс
+        leaderboard.board.update(user.id, user.total_xp or 0, user.name, user.avatar)
+        position = leaderboard.board.around(user.id, radius)
+    return position
+
+
+@app.get("/api/leaderboard/daily")
+async def get_daily_leaderboard(top: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_db)):
+    """Первые top пользователей по XP за сегодня (из сводки xp_daily)."""
+    return await xp_rollup.period_top(db, "day", top)
+
+
+@app.get("/api/leaderboard/weekly")
+async def get_weekly_leaderboard(top: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_db)):
+    """Первые top пользователей по XP за текущую неделю (из сводки xp_weekly)."""
+    return await xp_rollup.period_top(db, "week", top)
+
+
+@app.get("/api/xp/me")
+async def get_my_xp_stats(days: int = Query(30, ge=1, le=366),
+                          user: user_cache.UserSnapshot = Depends(get_current_user),
+                          db: AsyncSession = Depends(get_async_db)):
+    """XP текущего пользователя за сегодня, за неделю и по дням (сводки обновляются раз в несколько секунд)."""
+    return {"total_xp": user.total_xp, **await xp_rollup.user_stats(db, user.id, days)}
 
 # ==================================
 # === АДМИНИСТРАТИВНЫЕ РОУТЫ ===
 # ==================================
 
 @app.get("/admin", response_class=HTMLResponse)
-def admin_dashboard(request: Request, admin_user: models.User = Depends(is_admin)):
+def admin_dashboard(request: Request, admin_user: user_cache.UserSnapshot = Depends(is_admin)):
     # Главная страница админки
     return templates.TemplateResponse("admin/dashboard.html", {"request": request, "user": admin_user})
 
 
+@app.get("/admin/metrics")
+def admin_metrics(admin_user: user_cache.UserSnapshot = Depends(is_admin)):
+    """Метрики подсистем: очередь исполнителя кода по языкам, очередь заданий и т.п."""
+    return {"executor": executor.get_stats(), "jobs": jobs.queue.stats(), "verdict_cache": verdict_cache.cache.stats(),
+            "user_cache": user_cache.cache.stats(), "password_hasher": password_hasher.hasher.stats(),
+            "task_catalog": task_catalog.catalog.stats(), "completion_index": completion_index.index.stats(),
+            "leaderboard": leaderboard.board.stats(), "xp_rollup": xp_rollup.rollup.stats(),
+            "achievements": achievements.engine.stats(), "chat": chat_hub.hub.stats(),
+            "chat_cache": chat_cache.buffer.stats(), "chat_writer": chat_writer.writer.stats(),
+            "chat_archive": chat_archive.archive.stats(), "avatars": avatars.pipeline.stats()}
+
+
 @app.get("/admin/tasks/create", response_class=HTMLResponse)
-def admin_create_task_page(request: Request, admin_user: models.User = Depends(is_admin)):
+def admin_create_task_page(request: Request, admin_user: user_cache.UserSnapshot = Depends(is_admin)):
     # Страница создания новой задачи
     return templates.TemplateResponse("admin/create_task.html", {"request": request, "user": admin_user})
 
 @app.post("/admin/tasks/create")
 async def admin_create_task(
         request: Request,
-        admin_user: models.User = Depends(is_admin),  # Убеждаемся, что только админ может сюда POST-запрос
-        db: Session = Depends(database.get_db)
+        admin_user: user_cache.UserSnapshot = Depends(is_admin),  # Убеждаемся, что только админ может сюда POST-запрос
+        db: AsyncSession = Depends(get_async_db)
 ):
     form = await request.form()
     title = form.get("title")
@@ -398,7 +623,7 @@ async def admin_create_task(
             language=language,
             test_cases=test_cases,
         )
-        crud.create_task(db, task_schema)
+        await async_crud.create_task(db, task_schema)
 
         # Перенаправление с сообщением об успехе
         return RedirectResponse(
@@ -417,8 +642,8 @@ async def admin_create_task(
 @app.post("/admin/achievements/create")
 async def admin_create_achievement(
         request: Request,
-        admin_user: models.User = Depends(is_admin),
-        db: Session = Depends(database.get_db)
+        admin_user: user_cache.UserSnapshot = Depends(is_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     form = await request.form()
     title = form.get("title")
@@ -434,7 +659,7 @@ async def admin_create_achievement(
             description=description,
             xp_bonus=xp_bonus
         )
-        crud.create_achievement(db, achievement_schema)
+        await async_crud.create_achievement(db, achievement_schema)
         return JSONResponse(content={"message": "Достижение успешно создано"})
     except Exception as e:
         return JSONResponse(content={"error": f"Ошибка: {e}"}, status_code=500)
@@ -443,17 +668,52 @@ async def admin_create_achievement(
 @app.post("/admin/achievements/grant")
 async def admin_grant_achievement(
         request: Request,
-        admin_user: models.User = Depends(is_admin),
-        db: Session = Depends(database.get_db)
+        admin_user: user_cache.UserSnapshot = Depends(is_admin),
+        db: AsyncSession = Depends(get_async_db)
 ):
     form = await request.form()
     target_user_email = form.get("user_email")
-    achievement_id = form.get("achievement_id")
-
-    # ... логика поиска пользователя и выдачи достижения (CRUD-функция уже есть)
-    # Здесь нужна дополнительная логика для отображения формы выдачи и поиска пользователя
+    try:
+        achievement_id = int(form.get("achievement_id", ""))
+    except ValueError:
+        return JSONResponse(content={"error": "achievement_id должен быть числом"}, status_code=400)
 
-    return JSONResponse(content={"message": "Эндпоинт для выдачи достижений, требуется UI"})
+    user = await async_crud.get_user_by_email(db, target_user_email) if target_user_email else None
+    if user is None:
+        return JSONResponse(content={"error": "Пользователь не найден"}, status_code=404)
+    achievement = await db.get(models.Achievement, achievement_id)
+    if achievement is None:
+        return JSONResponse(content={"error": "Достижение не найдено"}, status_code=404)
+
+    # Тот же запрос, что и у правил: повторная выдача ничего не делает, бонус идёт через журнал XP
+    rows = (await db.execute(achievements.award_statement(
+        achievement.id, achievement.xp_bonus or 0, models.User.id == user.id))).all()
+    await db.commit()
+    achievements.engine.after_award(rows)
+    if not rows:
+        return JSONResponse(content={"message": "Достижение уже было выдано"})
+    # Как и при выдаче по правилам: бонус мог пересечь порог правил по total_xp
+    unlocked = await achievements.engine.award(
+        db, achievements.bonus_rules(rows[0].total_xp, achievement.xp_bonus or 0), user.id)
+    message = f"Достижение '{achievement.title}' выдано {user.email}"
+    if unlocked:
+        message += f"; за бонус XP также получены: {', '.join(unlocked)}"
+    return JSONResponse(content={"message": message})
+
+
+@app.post("/admin/achievements/backfill", status_code=status.HTTP_202_ACCEPTED)
+async def admin_backfill_achievement(
+        request: Request,
+        admin_user: user_cache.UserSnapshot = Depends(is_admin),
+):
+    """Повторно применяет правило ко всем пользователям в фоне (пакетами, см. app/achievements.py)."""
+    form = await request.form()
+    rule = achievements.RULES_BY_CODE.get(form.get("code"))
+    if rule is None:
+        return JSONResponse(content={"error": "Неизвестное правило"}, status_code=404)
+    if not achievements.engine.start_backfill(rule):
+        return JSONResponse(content={"error": "Правило уже применяется"}, status_code=409)
+    return {"message": f"Правило {rule.code} применяется ко всем пользователям"}
 
 
 # ==================================
@@ -461,41 +721,36 @@ async def admin_grant_achievement(
 # ==================================
 
 @app.get("/chat", response_class=HTMLResponse)
-def chat_page(request: Request, user: models.User = Depends(get_current_user)):
+def chat_page(request: Request, user: user_cache.UserSnapshot = Depends(get_current_user)):
     return templates.TemplateResponse("chat.html", {"request": request, "user": user})
 
 
-@app.get("/api/chat/messages", response_model=List[schemas.Message])
-def get_messages(db: Session = Depends(get_db)):
-    # ИСПРАВЛЕНО: Используем joinedload для однократного получения сообщений и связанных пользователей
-    # Получаем последние 50 сообщений и сразу загружаем связанного пользователя (N+1 fix)
-    messages_query = db.query(models.Message).options(joinedload(models.Message.user)).order_by(
-        models.Message.timestamp.desc()).limit(50)
-    messages = messages_query.all()
-
-    # Приводим к формату, удобному для JSON (включая имя пользователя)
-    messages_data = []
-    for msg in messages:
-        # Теперь user уже загружен благодаря joinedload, что предотвращает зависание
-        user_name = msg.user.name if msg.user else "Удаленный пользователь"
-
-        messages_data.append({
-            "id": msg.id,
-            "content": msg.content,
-            "timestamp": msg.timestamp,
-            "user_id": msg.user_id,
-            "user_name": user_name
-        })
-
-    # Реверсируем список, чтобы сначала были старые сообщения
-    return messages_data[::-1]
+@app.get("/api/chat/messages")
+async def get_messages(
+        since_id: Optional[int] = Query(None, ge=0),
+        before_id: Optional[int] = Query(None, ge=1),
+        limit: int = Query(50, ge=1, le=200),
+        db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Сообщения чата по возрастанию id: последние, новее since_id (дельта для опроса)
+    или страница истории перед before_id (в том числе из архива старых месяцев, chat_archive).
+    Последние сообщения отдаются из памяти (chat_cache).
+    """
+    if since_id is not None and before_id is not None:
+        raise HTTPException(status_code=400, detail="Укажите либо since_id, либо before_id")
+    if before_id is not None:
+        return await chat_archive.history(db, before_id, limit)
+    if since_id is not None:
+        return await chat_cache.buffer.since(db, since_id, limit)
+    return await chat_cache.buffer.latest(db, limit)
 
 
 @app.post("/api/chat/messages")
 async def send_message(
         request: Request,
-        user: models.User = Depends(get_current_user),
-        db: Session = Depends(get_db)
+        user: user_cache.UserSnapshot = Depends(get_current_user),
+        db: AsyncSession = Depends(get_async_db)
 ):
     form = await request.form()
     content = form.get("content")
@@ -503,20 +758,96 @@ async def send_message(
     if not content or len(content.strip()) == 0:
         raise HTTPException(status_code=400, detail="Сообщение не может быть пустым")
 
-    crud.send_message(db, user.id, content)
+    try:
+        await async_crud.send_message(db, user.id, content, user.name)
+    except chat_writer.Saturated:
+        raise HTTPException(status_code=503, detail="Сервер перегружен, попробуйте позже",
+                            headers={"Retry-After": "1"})
 
     return {"message": "Сообщение отправлено"}
 
 
+async def websocket_user(websocket: WebSocket) -> Optional[user_cache.UserSnapshot]:
+    """Пользователь веб-сокета по cookie token (как get_current_user); None — не авторизован."""
+    token = websocket.cookies.get("token")
+    if not token:
+        return None
+    try:
+        user_id = user_cache.cache.user_id_for_token(token)
+    except JWTError:
+        return None
+    if user_id is None:
+        return None
+    user = user_cache.cache.get(user_id)
+    if user is not None:
+        return user
+    # Сессия только на время поиска, а не на всё время соединения
+    async with database.AsyncSessionLocal() as db:
+        db_user = await async_crud.get_user_by_id(db, user_id)
+    return user_cache.cache.put(db_user) if db_user is not None else None
+
+
+async def push_chat_messages(websocket: WebSocket, queue):
+    # Отправляет клиенту сообщения из его очереди в хабе; None — клиент отстал и отключается
+    while True:
+        payload = await queue.get()
+        if payload is None:
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return
+        await websocket.send_json(payload)
+
+
+@app.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket):
+    """
+    Чат в реальном времени: новые сообщения приходят JSON-объектами в формате
+    /api/chat/messages. Клиент отправляет {"content": "..."}.
+    """
+    user = await websocket_user(websocket)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+
+    queue = chat_hub.hub.subscribe()
+    pusher = asyncio.create_task(push_chat_messages(websocket, queue))
+    try:
+        while True:
+            try:
+                data = json.loads(await websocket.receive_text())
+            except ValueError:
+                continue
+            content = data.get("content") if isinstance(data, dict) else None
+            if not isinstance(content, str) or not content.strip():
+                continue
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    await async_crud.send_message(db, user.id, content, user.name)
+            except chat_writer.Saturated:
+                # Очередь записи заполнена — клиенту нужно переподключиться позже
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                break
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError — сокет уже закрыт сервером (отставший клиент, см. push_chat_messages)
+        pass
+    finally:
+        chat_hub.hub.unsubscribe(queue)
+        pusher.cancel()
+        await asyncio.gather(pusher, return_exceptions=True)
+
+
 # =======================================================
 # === API ЭНДПОИНТЫ ДЛЯ ВЫПОЛНЕНИЯ КОДА (Компилятор) ===
 # =======================================================
 
 @app.post("/api/run-code")
-async def run_code(request: Request):
+async def run_code(request: Request, token: Optional[str] = Cookie(None)):
     """
     Эндпоинт для запуска кода на различных языках программирования.
     Поддерживаемые языки: Python, JavaScript, Java, C++, C#.
+    Запуск идёт через очередь заданий с приоритетом ниже, чем у посылок задач.
+    С {"stream": true} сразу возвращает id задания, а вывод программы приходит
+    событиями output по мере появления (/api/jobs/{id}/events).
     """
     try:
         data = await request.json()
@@ -525,126 +856,50 @@ async def run_code(request: Request):
 
     code = data.get('code', '')
     language = data.get('language', '').lower()
+    stream = bool(data.get('stream'))
 
     if not code:
         return JSONResponse({'error': 'Код пустой'}, status_code=status.HTTP_400_BAD_REQUEST)
 
-    output = ""
+    language = executor.normalize_language(language)
+    if language is None:
+        return JSONResponse({'error': 'Неподдерживаемый язык программирования'},
+                            status_code=status.HTTP_400_BAD_REQUEST)
+
+    async def run(job: jobs.Job) -> dict:
+        on_output = None
+        if stream:
+            on_output = lambda name, text: job.publish("output", {"stream": name, "data": text})
+        message = None
+        try:
+            # Запуск идёт через asyncio-подпроцессы и не блокирует остальные запросы
+            output = await executor.execute(language, code, on_output)
+        except subprocess.TimeoutExpired:
+            output = message = "Ошибка: Время выполнения превышено (максимум 5 секунд)"
+        except executor.OutputLimitExceeded as e:
+            message = str(e)
+            output = f"{e.result.output}\n{message}"
+        except FileNotFoundError as e:
+            output = message = f"Ошибка: Программа для языка '{language}' не найдена. Убедитесь, что компилятор/интерпретатор установлен и доступен в PATH."
+        if stream and message:
+            job.publish("output", {"stream": "system", "data": message})
+        return {'output': output}
 
     try:
-        if language == 'python':
-            # Запуск Python
-            with tempfile.NamedTemporaryFile(mode='w+', suffix='.py', delete=False, encoding='utf-8') as temp_file:
-                temp_file.write(code)
-                temp_file_path = temp_file.name
-
-            process = subprocess.run(
-                ['python', temp_file_path],
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                timeout=5
-            )
-            output = process.stdout or process.stderr
-            os.remove(temp_file_path)
-
-        elif language == 'javascript':
-            # Запуск JavaScript (Node.js)
-            process = subprocess.run(['node', '-e', code], capture_output=True, text=True, encoding='utf-8', timeout=5)
-            output = process.stdout or process.stderr
-
-        elif language == 'cpp':
-            # Компиляция и запуск C++ (g++)
-            with tempfile.NamedTemporaryFile(mode='w+', suffix='.cpp', delete=False, encoding='utf-8') as src_file:
-                src_file.write(code)
-                src_path = src_file.name
-            exe_path = src_path + '.out'
-
-            # 1. Компиляция
-            compile_process = subprocess.run(
-                ['g++', src_path, '-o', exe_path],
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                timeout=10
-            )
-
-            if compile_process.returncode != 0:
-                output = compile_process.stderr
-            else:
-                # 2. Запуск
-                run_process = subprocess.run(
-                    [exe_path],
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8',
-                    timeout=5
-                )
-                output = run_process.stdout or run_process.stderr
-
-            # 3. Очистка
-            os.remove(src_path)
-            if os.path.exists(exe_path):
-                os.remove(exe_path)
-
-        elif language == 'java':
-            # Компиляция и запуск Java (javac + java)
-            with tempfile.NamedTemporaryFile(mode='w+', suffix='.java', delete=False, encoding='utf-8') as src_file:
-                src_file.write(code)
-                src_path = src_file.name
-
-            class_name = "Main"  # Поиск имени класса для запуска
-            match = re.search(r'class\s+(\w+)', code)
-            if match:
-                class_name = match.group(1)
-
-            # 1. Компиляция
-            compile_process = subprocess.run(
-                ['javac', src_path],
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                timeout=10,
-                cwd=os.path.dirname(src_path)
-            )
-
-            if compile_process.returncode != 0:
-                output = compile_process.stderr
-            else:
-                # 2. Запуск
-                try:
-                    run_process = subprocess.run(
-                        ['java', '-cp', os.path.dirname(src_path), class_name],
-                        capture_output=True,
-                        text=True,
-                        encoding='utf-8',
-                        timeout=5
-                    )
-                    output = run_process.stdout or run_process.stderr
-                except Exception as e:
-                    output = str(e)
-
-            # 3. Очистка
-            try:
-                os.remove(src_path)
-                class_file = os.path.join(os.path.dirname(src_path), class_name + '.class')
-                if os.path.exists(class_file):
-                    os.remove(class_file)
-            except Exception as e:
-                output += f"\nОшибка при очистке временных файлов: {str(e)}"
-
-        else:
-            return JSONResponse({'error': 'Неподдерживаемый язык программирования'},
-                                status_code=status.HTTP_400_BAD_REQUEST)
-
-    except subprocess.TimeoutExpired:
-        output = "Ошибка: Время выполнения превышено (максимум 5 секунд)"
-    except FileNotFoundError as e:
-        output = f"Ошибка: Программа для языка '{language}' не найдена. Убедитесь, что компилятор/интерпретатор установлен и доступен в PATH."
-    except Exception as e:
-        output = f"Произошла внутренняя ошибка сервера: {str(e)}"
+        job = jobs.queue.submit("run", job_owner(request, token), run, jobs.PRIORITY_RUN)
+    except jobs.QueueFull as e:
+        return JSONResponse({'error': str(e)}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-    return JSONResponse({'output': output})
+    if stream:
+        return JSONResponse({"job_id": job.id, "events_url": f"/api/jobs/{job.id}/events"},
+                            status_code=status.HTTP_202_ACCEPTED)
+
+    try:
+        result = await job.wait()
+    except RuntimeError as e:
+        result = {'output': str(e)}
+
+    return JSONResponse(result)
 
 # ==================================
 # === Запуск и Инициализация ===
@@ -675,4 +930,35 @@ def create_admin():
     # Убеждаемся, что все таблицы созданы (ВАЖНО для PostgreSQL)
     models.Base.metadata.create_all(bind=database.engine)
 
-    db.close()
\ No newline at end of file
+    db.close()
+
+
+@app.on_event("startup")
+async def start_executor():
+    # Заранее запускаем воркеры исполнителя кода и очереди заданий
+    await executor.start()
+    jobs.queue.start()
+    # Таблица лидеров строится из БД один раз при старте
+    await leaderboard.board.start()
+    await xp_rollup.rollup.start()
+    # Правила достижений сводятся с БД; новые применяются ко всем пользователям в фоне
+    await achievements.engine.start()
+    await chat_hub.hub.start()
+    # Секции messages на текущий и следующие месяцы создаются до первой записи
+    await chat_archive.archive.start()
+    chat_writer.writer.start()
+
+
+@app.on_event("shutdown")
+async def stop_executor():
+    await jobs.queue.stop()
+    await leaderboard.board.stop()
+    await xp_rollup.rollup.stop()
+    # Сначала дописываем очередь сообщений чата, пока хаб и БД доступны
+    await chat_writer.writer.stop()
+    await chat_hub.hub.stop()
+    await chat_archive.archive.stop()
+    await executor.stop()
+    password_hasher.hasher.close()
+    await avatars.pipeline.stop()
+    await database.async_engine.dispose()
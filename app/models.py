@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, func, ForeignKey, event
+from sqlalchemy import ARRAY, Column, Integer, BigInteger, String, Boolean, DateTime, Date, Text, func, ForeignKey, Index, event, text
 from sqlalchemy.future import engine
 from sqlalchemy.orm import relationship, Session
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -20,6 +20,9 @@ class User(Base):
     avatar = Column(String)  # путь к аватару
     total_xp = Column(Integer, default=0)  # общий опыт
     created_at = Column(DateTime, default=func.now())
+    # id транзакции, последней изменившей строку: по нему таблица лидеров подтягивает изменения
+    xid = Column(BigInteger, server_default=text("(pg_current_xact_id()::text::bigint)"),
+                 onupdate=text("(pg_current_xact_id()::text::bigint)"), nullable=False, index=True)
 
     # Вычисляемое свойство для уровня
     # 1 уровень = 1000 XP. 0-999 XP = 1 уровень, 1000-1999 XP = 2 уровень и т.д.
@@ -62,9 +65,94 @@ class Task(Base):
 
     user = relationship("User", back_populates="tasks")
 
+    # Для постраничного списка /api/tasks: фильтр по языку или сложности + порядок по id
+    __table_args__ = (
+        Index("ix_tasks_language_id", "language", "id"),
+        Index("ix_tasks_difficulty_id", "difficulty", "id"),
+    )
+
+class CatalogVersion(Base):
+    """Номер версии кэшируемого каталога (например, задач): увеличивается при каждом его изменении."""
+    __tablename__ = "catalog_versions"
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+class Submission(Base):
+    """Посылка решения задачи: вердикт и метрики проверки (по кейсам — в results)."""
+    __tablename__ = "submissions"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    task_id = Column(Integer, ForeignKey("tasks.id"), nullable=False, index=True)
+    language = Column(String, nullable=False)
+    passed = Column(Boolean, default=False)
+    results = Column(Text)  # JSON-массив результатов по кейсам, включая cpu_ms, wall_ms и rss_kb
+    cpu_time_ms = Column(Integer)  # суммарное процессорное время процессов проверки
+    wall_time_ms = Column(Integer)  # время проверки по часам (без компиляции)
+    peak_rss_kb = Column(Integer)  # наибольший пиковый RSS среди процессов проверки
+    created_at = Column(DateTime, default=func.now())
+
+    user = relationship("User")
+    task = relationship("Task")
+
+class XpEvent(Base):
+    """Журнал начислений XP (только добавление): задача, достижение и т.п."""
+    __tablename__ = "xp_events"
+    id = Column(BigInteger, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    amount = Column(Integer, nullable=False)
+    source = Column(String, nullable=False)  # "task" или "achievement"
+    source_id = Column(Integer)  # id задачи или достижения
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    # id транзакции, записавшей событие: по нему сводки берут только завершённые транзакции
+    xid = Column(BigInteger, server_default=text("(pg_current_xact_id()::text::bigint)"), nullable=False)
+
+    __table_args__ = (Index("ix_xp_events_xid_id", "xid", "id"),)
+
+
+class XpDaily(Base):
+    """XP пользователя за день (сводка журнала xp_events, см. app/xp_rollup.py)."""
+    __tablename__ = "xp_daily"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    xp = Column(Integer, nullable=False, default=0)
+
+    # Таблица лидеров дня: WHERE day = ... ORDER BY xp DESC LIMIT k
+    __table_args__ = (Index("ix_xp_daily_day_xp", "day", "xp"),)
+
+
+class XpWeekly(Base):
+    """XP пользователя за неделю (week — понедельник недели)."""
+    __tablename__ = "xp_weekly"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    week = Column(Date, primary_key=True)
+    xp = Column(Integer, nullable=False, default=0)
+
+    # Таблица лидеров недели: WHERE week = ... ORDER BY xp DESC LIMIT k
+    __table_args__ = (Index("ix_xp_weekly_week_xp", "week", "xp"),)
+
+
+class RollupCursor(Base):
+    """Докуда журнал уже учтён в сводках: последнее учтённое событие по (xid, id)."""
+    __tablename__ = "rollup_cursors"
+    name = Column(String, primary_key=True)
+    last_event_id = Column(BigInteger, nullable=False, default=0)
+    last_xid = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+class UserProgress(Base):
+    """Счётчики пользователя для правил достижений (обновляются в complete_task, см. app/achievements.py)."""
+    __tablename__ = "user_progress"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    tasks_solved = Column(Integer, nullable=False, default=0)
+    languages = Column(ARRAY(String), nullable=False, default=list)  # языки решённых задач (в нижнем регистре)
+    streak_days = Column(Integer, nullable=False, default=0)  # дней подряд с решёнными задачами
+    best_streak_days = Column(Integer, nullable=False, default=0)
+    last_active_day = Column(Date)
+
+
 class Achievement(Base):
     __tablename__ = "achievements"
     id = Column(Integer, primary_key=True, index=True)
+    code = Column(String, unique=True)  # код правила из app/achievements.py; у созданных админом — NULL
     title = Column(String, unique=True)
     description = Column(Text)
     xp_bonus = Column(Integer, default=0)  # Дополнительный XP за достижение
@@ -103,9 +191,17 @@ class UserQuest(Base):
 
 class Message(Base):
     __tablename__ = "messages"
-    id = Column(Integer, primary_key=True, index=True)
+    # Таблица секционирована по месяцам (timestamp), поэтому timestamp входит в первичный ключ;
+    # секции создаёт и архивирует app/chat_archive.py
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     content = Column(Text, nullable=False)
-    timestamp = Column(DateTime, default=func.now())
+    timestamp = Column(DateTime, primary_key=True, default=func.now())
+
+    user = relationship("User", back_populates="messages")
 
-    user = relationship("User", back_populates="messages")
\ No newline at end of file
+    __table_args__ = (
+        # Постраничная история чата: WHERE (timestamp, id) < (...) ORDER BY timestamp DESC, id DESC
+        Index("ix_messages_timestamp_id", "timestamp", "id"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""
+Хэширование паролей (bcrypt) в пуле процессов.
+
+bcrypt занимает процессор на сотни миллисекунд, поэтому хэширование и проверка
+паролей выполняются в отдельных процессах, по одному на ядро, а не в цикле
+событий. Очередь ожидающих операций ограничена: при её переполнении
+выбрасывается Saturated, и эндпоинт отвечает 503 вместо того, чтобы копить
+запросы.
+"""
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+
+from . import auth
+
+HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+# Сколько операций может ждать или выполняться одновременно
+HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", HASH_WORKERS * 8))
+
+
+class Saturated(Exception):
+    """Очередь хэширования заполнена; запрос нужно повторить позже."""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._executor is None:
+            # forkserver: дочерние процессы не наследуют потоки и состояние приложения
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"))
+        return self._executor
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Saturated()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool(), fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(auth.hash_password, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(auth.verify_password, password, hashed_password)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+hasher = PasswordHasher(HASH_WORKERS, HASH_MAX_PENDING)
@@ -0,0 +1,58 @@
+"""
+Пул «тёплых» Python-интерпретаторов для запуска решений.
+
+Вместо запуска нового процесса python на каждое нажатие «Запустить» код
+отправляется уже работающему воркеру (app/python_worker.py) через pipe.
+
+Воркер однопользовательский: он выполняет ровно одно задание и заменяется
+новым, который пул запускает в фоне, пока идут другие запуски. Внутри одного
+интерпретатора решения не изолировать (общие модули, потоки, дескрипторы
+протокола), поэтому код разных пользователей никогда не попадает в один процесс,
+а старт интерпретатора по-прежнему не входит во время ответа.
+"""
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from .worker_pool import WorkerPool
+
+WORKER_SCRIPT = str(Path(__file__).parent / "python_worker.py")
+PYTHON_EXECUTABLE = os.environ.get("PYTHON_WORKER_EXECUTABLE", "python")
+
+
+class PythonWorkerPool(WorkerPool):
+    """Пул Python-воркеров, общающихся JSON-строками."""
+
+    def __init__(self, size: int):
+        super().__init__(size, max_runs=1)
+        self.workdir = None
+
+    def command(self) -> list:
+        # -I: изолированный режим (без PYTHON* переменных и пользовательского site-packages)
+        return [PYTHON_EXECUTABLE, "-I", WORKER_SCRIPT]
+
+    def cwd(self) -> str:
+        # Воркеры работают в отдельном каталоге, а не в каталоге приложения
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp(prefix="codequest-python-")
+        return self.workdir
+
+    def encode_request(self, payload) -> bytes:
+        return json.dumps(payload).encode("utf-8") + b"\n"
+
+    def decode_response(self, line: bytes) -> dict:
+        return json.loads(line)
+
+    def output_chunk(self, message: dict):
+        # {"output": "stdout"|"stderr", "data": текст} — часть вывода в потоковом режиме
+        if "output" in message:
+            return message["output"], message["data"]
+        return None
+
+    def crash_response(self) -> dict:
+        return {
+            "returncode": -1,
+            "stdout": "",
+            "stderr": "Ошибка: процесс выполнения аварийно завершился (возможно, превышен лимит памяти)",
+        }
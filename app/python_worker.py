@@ -0,0 +1,141 @@
+"""
+Процесс-воркер пула Python-интерпретаторов (см. app/python_pool.py).
+
+Запускается как отдельный скрипт, а не импортируется приложением: читает
+задание (JSON-строку) из stdin, выполняет код в чистом пространстве имён,
+отвечает JSON-строкой в stdout и завершается. С "stream": true вывод программы
+ещё и пересылается по мере появления строками {"output": поток, "data": текст}. Воркер однопользовательский —
+следующее задание получит новый процесс: всё, что решение оставило после себя
+(потоки, изменённые модули, открытые дескрипторы), умирает вместе с ним.
+"""
+import builtins
+import io
+import json
+import os
+import sys
+import traceback
+
+# Часто используемые модули импортируем заранее, чтобы import в решениях был мгновенным
+import collections  # noqa: F401
+import functools  # noqa: F401
+import itertools  # noqa: F401
+import math  # noqa: F401
+import random  # noqa: F401
+import re  # noqa: F401
+import string  # noqa: F401
+
+
+def limit_resources():
+    """
+    Ограничивает память воркера, размер создаваемых им файлов и запуск новых процессов
+    (лимиты действуют и на код пользователя).
+    """
+    try:
+        import resource
+        memory = int(os.environ.get("PYTHON_WORKER_MEMORY_MB", "256")) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+        max_file = int(os.environ.get("PYTHON_WORKER_MAX_FILE_MB", "16")) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_FSIZE, (max_file, max_file))
+        # RLIMIT_NPROC считается по всем процессам (и потокам) пользователя ОС, поэтому
+        # по умолчанию 0: решению нельзя ни fork, ни запускать потоки
+        processes = int(os.environ.get("PYTHON_WORKER_MAX_PROCESSES", "0"))
+        resource.setrlimit(resource.RLIMIT_NPROC, (processes, processes))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+class OutputLimitExceeded(BaseException):
+    """Решение вывело больше разрешённого (BaseException — чтобы не перехватывалось except Exception)."""
+
+
+class CappedOutput(io.StringIO):
+    """Буфер вывода с общим для stdout и stderr лимитом (в символах); emit(поток, текст) — потоковый режим."""
+
+    def __init__(self, budget: list, name: str, emit=None):
+        super().__init__()
+        self.budget = budget  # [оставшийся лимит], общий для обоих потоков
+        self.name = name
+        self.emit = emit
+
+    def write(self, text):
+        if len(text) > self.budget[0]:
+            self._write(text[:self.budget[0]])
+            self.budget[0] = 0
+            raise OutputLimitExceeded()
+        self.budget[0] -= len(text)
+        return self._write(text)
+
+    def _write(self, text):
+        if text and self.emit is not None:
+            self.emit(self.name, text)
+        return super().write(text)
+
+
+def run(code: str, stdin_text: str, max_output: int, emit=None) -> dict:
+    """Выполняет код в новом пространстве имён и возвращает его вывод."""
+    budget = [max_output]
+    stdout = CappedOutput(budget, "stdout", emit)
+    stderr = CappedOutput(budget, "stderr", emit)
+    truncated = False
+    # Копия builtins: решение не меняет builtins самого воркера, через которые он отвечает
+    namespace = {"__name__": "__main__", "__builtins__": dict(vars(builtins))}
+    returncode = 0
+
+    sys.stdin, sys.stdout, sys.stderr = io.StringIO(stdin_text), stdout, stderr
+    try:
+        exec(compile(code, "<solution>", "exec"), namespace)
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            returncode = e.code or 0
+        else:
+            returncode = 1
+            try:
+                print(e.code, file=stderr)
+            except OutputLimitExceeded:
+                truncated = True
+    except OutputLimitExceeded:
+        truncated = True
+        returncode = 1
+    except BaseException:
+        # Пропускаем кадр самого воркера, чтобы трассировка была как у обычного запуска
+        exc_type, exc, tb = sys.exc_info()
+        returncode = 1
+        try:
+            traceback.print_exception(exc_type, exc, tb.tb_next, file=stderr)
+        except OutputLimitExceeded:
+            truncated = True
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = sys.__stdin__, sys.__stdout__, sys.__stderr__
+
+    return {"returncode": returncode, "stdout": stdout.getvalue(), "stderr": stderr.getvalue(),
+            "truncated": truncated}
+
+
+def main():
+    # Протокол идёт через копии дескрипторов 0 и 1, а сами 0/1/2 направляем в /dev/null,
+    # чтобы прямые записи в дескрипторы из кода пользователя не ломали протокол.
+    requests = os.fdopen(os.dup(0), "rb")
+    responses = os.fdopen(os.dup(1), "wb")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+
+    limit_resources()
+
+    line = requests.readline()
+    if not line:
+        return
+    request = json.loads(line)
+
+    def send(message: dict):
+        responses.write(json.dumps(message).encode("utf-8") + b"\n")
+        responses.flush()
+
+    emit = (lambda name, text: send({"output": name, "data": text})) if request.get("stream") else None
+    send(run(request["code"], request.get("stdin", ""), request.get("max_output", 1024 * 1024), emit))
+    # Не ждём потоков, оставленных решением
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
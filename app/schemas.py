@@ -60,6 +60,8 @@ class TaskCreate(BaseModel):
     description: Optional[str] = None
     difficulty: str = "Другое"
     xp_reward: int = 10
+    language: str = "Python"
+    test_cases: Optional[str] = None  # JSON-строка с тестовыми кейсами
 
 
 class Task(TaskCreate):
@@ -67,7 +69,7 @@ class Task(TaskCreate):
     id: int
     is_completed: bool
     completed_at: Optional[datetime] = None
-    created_at: datetime
+    created_at: Optional[datetime] = None  # в модели Task такого столбца нет
 
     class Config:
         from_attributes = True
@@ -0,0 +1,157 @@
+"""
+Каталог задач в памяти процесса.
+
+Задачи меняются редко (создаёт их администратор), а читаются на каждой загрузке
+/tasks, /api/tasks и /api/tasks/{id}. Каталог держит все задачи в памяти вместе с
+заранее сериализованным JSON для /api/tasks/{id}; чтения — поиск в словаре.
+
+Версия каталога хранится в БД (catalog_versions, строка "tasks") и увеличивается
+в той же транзакции, что и любое добавление, изменение или удаление задачи
+(слушатели ORM ниже). Каждый процесс uvicorn сверяет свою версию с БД не чаще
+раза в TASK_CATALOG_CHECK_INTERVAL секунд (один запрос по первичному ключу)
+и перечитывает задачи, только если версия изменилась.
+"""
+import asyncio
+import bisect
+import itertools
+import os
+import time
+from typing import Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+
+TASK_CATALOG_CHECK_INTERVAL = float(os.environ.get("TASK_CATALOG_CHECK_INTERVAL", "1"))
+CATALOG_NAME = "tasks"
+SUMMARY_LENGTH = 120
+
+# Поля, которые можно запросить у /api/tasks (?fields=...); is_completed — для текущего пользователя
+LIST_FIELDS = ("id", "title", "summary", "description", "difficulty", "language", "xp_reward", "test_cases",
+               "is_completed")
+# По умолчанию список не содержит description и test_cases — они нужны только открытой задаче
+DEFAULT_LIST_FIELDS = ("id", "title", "summary", "difficulty", "language", "xp_reward", "is_completed")
+
+
+class Snapshot:
+    """Неизменяемое состояние каталога для одной версии."""
+
+    def __init__(self, version: int, tasks):
+        self.version = version
+        self.tasks = {}  # id -> словарь полей задачи (не изменять)
+        self.detail_json = {}  # id -> готовый JSON для /api/tasks/{id}
+        self.by_language = {}  # язык -> отсортированные id
+        self.by_difficulty = {}  # сложность -> отсортированные id
+        for task in sorted(tasks, key=lambda t: t.id):
+            self.tasks[task.id] = {
+                "id": task.id,
+                "title": task.title,
+                "summary": (task.description or "")[:SUMMARY_LENGTH],
+                "description": task.description,
+                "difficulty": task.difficulty,
+                "language": task.language,
+                "xp_reward": task.xp_reward,
+                "test_cases": task.test_cases,
+            }
+            self.detail_json[task.id] = schemas.Task.model_validate(task).model_dump_json()
+            self.by_language.setdefault(task.language, []).append(task.id)
+            self.by_difficulty.setdefault(task.difficulty, []).append(task.id)
+        self.ids = list(self.tasks)
+
+    def get(self, task_id: int) -> Optional[dict]:
+        return self.tasks.get(task_id)
+
+    def page(self, after_id: Optional[int], limit: int, language: Optional[str] = None,
+             difficulty: Optional[str] = None, completed_ids=None, completed: Optional[bool] = None) -> list:
+        """
+        Id задач страницы по возрастанию (keyset: id > after_id), не больше limit.
+        completed_ids — множество выполненных пользователем задач, нужно при фильтре completed.
+        """
+        candidates = self.ids
+        if language is not None:
+            candidates = self.by_language.get(language, [])
+        if difficulty is not None:
+            by_difficulty = self.by_difficulty.get(difficulty, [])
+            if len(by_difficulty) < len(candidates):
+                candidates = by_difficulty
+        start = bisect.bisect_right(candidates, after_id) if after_id is not None else 0
+
+        result = []
+        for task_id in itertools.islice(candidates, start, None):
+            task = self.tasks[task_id]
+            if language is not None and task["language"] != language:
+                continue
+            if difficulty is not None and task["difficulty"] != difficulty:
+                continue
+            if completed is not None and (task_id in completed_ids) != completed:
+                continue
+            result.append(task_id)
+            if len(result) == limit:
+                break
+        return result
+
+
+class TaskCatalog:
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self.checks = 0
+        self.reloads = 0
+
+    async def _db_version(self, db: AsyncSession) -> int:
+        version = await db.scalar(
+            select(models.CatalogVersion.version).where(models.CatalogVersion.name == CATALOG_NAME))
+        return version or 0
+
+    async def snapshot(self, db: AsyncSession) -> Snapshot:
+        """Текущий каталог; при необходимости сверяет версию с БД и перечитывает задачи."""
+        if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return self._snapshot
+        async with self._lock:
+            # Пока ждали блокировку, другой запрос мог уже всё проверить
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._snapshot
+            self.checks += 1
+            # Версию читаем до задач: если задачи поменяются между запросами, следующая проверка перечитает их
+            version = await self._db_version(db)
+            if self._snapshot is None or self._snapshot.version != version:
+                tasks = (await db.scalars(select(models.Task))).all()
+                self._snapshot = Snapshot(version, tasks)
+                self.reloads += 1
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def expire(self):
+        """Следующее чтение сверит версию с БД, не дожидаясь интервала."""
+        self._checked_at = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "version": self._snapshot.version if self._snapshot is not None else None,
+            "tasks": len(self._snapshot.tasks) if self._snapshot is not None else 0,
+            "checks": self.checks,
+            "reloads": self.reloads,
+        }
+
+
+catalog = TaskCatalog(TASK_CATALOG_CHECK_INTERVAL)
+
+_bump_version = (
+    pg_insert(models.CatalogVersion.__table__)
+    .values(name=CATALOG_NAME, version=1)
+    .on_conflict_do_update(index_elements=["name"],
+                           set_={"version": models.CatalogVersion.__table__.c.version + 1})
+)
+
+
+@event.listens_for(models.Task, "after_insert")
+@event.listens_for(models.Task, "after_update")
+@event.listens_for(models.Task, "after_delete")
+def _task_changed(mapper, connection, task):
+    # В той же транзакции, что и изменение задачи: версия меняется только вместе с данными
+    connection.execute(_bump_version)
+    catalog.expire()
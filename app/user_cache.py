@@ -0,0 +1,118 @@
+"""
+Кэш пользователей для get_current_user.
+
+Разобранные JWT запоминаются (токен -> id пользователя), а пользователи хранятся
+лёгкими снимками (UserSnapshot) с ограниченным временем жизни и числом записей.
+На горячем пути аутентификация — два поиска в словаре без запроса к БД.
+
+Снимок сбрасывается при изменении пользователя: явно после commit в местах,
+которые меняют пользователя (аватар, начисление XP), и слушателем ORM на любое
+обновление строки users (например, смену роли). В других процессах uvicorn
+снимок может отставать не дольше USER_CACHE_TTL секунд.
+"""
+import os
+import time
+from collections import OrderedDict
+
+from jose import jwt
+from sqlalchemy import event
+
+from . import auth, models
+
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+
+
+class UserSnapshot:
+    """Неизменяемая копия полей пользователя, не привязанная к сессии БД (без пароля)."""
+
+    __slots__ = ("id", "name", "last_name", "email", "role", "bio", "avatar", "total_xp", "created_at")
+
+    def __init__(self, user: models.User):
+        for field in self.__slots__:
+            object.__setattr__(self, field, getattr(user, field))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("UserSnapshot нельзя изменять — загрузите пользователя из БД")
+
+    @property
+    def level(self) -> int:
+        return max(1, (self.total_xp or 0) // models.XP_PER_LEVEL + 1)
+
+
+class UserCache:
+    def __init__(self, ttl: float, max_users: int, max_tokens: int):
+        self.ttl = ttl
+        self.max_users = max_users
+        self.max_tokens = max_tokens
+        self._tokens = OrderedDict()  # токен -> (id пользователя, срок действия токена)
+        self._users = OrderedDict()  # id -> (снимок, когда устаревает)
+        self.token_hits = 0
+        self.token_misses = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def user_id_for_token(self, token: str):
+        """Id пользователя из токена; JWTError, если токен неверный или истёк."""
+        entry = self._tokens.get(token)
+        if entry is not None and (entry[1] is None or entry[1] > time.time()):
+            self.token_hits += 1
+            self._tokens.move_to_end(token)
+            return entry[0]
+
+        self.token_misses += 1
+        self._tokens.pop(token, None)
+        payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+        user_id = payload.get("id")
+        if user_id is not None:
+            self._tokens[token] = (user_id, payload.get("exp"))
+            if len(self._tokens) > self.max_tokens:
+                self._tokens.popitem(last=False)
+        return user_id
+
+    def get(self, user_id: int):
+        entry = self._users.get(user_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            self._users.move_to_end(user_id)
+            return entry[0]
+        self.misses += 1
+        return None
+
+    def put(self, user: models.User) -> UserSnapshot:
+        snapshot = UserSnapshot(user)
+        self._users[user.id] = (snapshot, time.monotonic() + self.ttl)
+        self._users.move_to_end(user.id)
+        if len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, user_id: int):
+        if self._users.pop(user_id, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "tokens": len(self._tokens),
+            "hits": self.hits,
+            "misses": self.misses,
+            "token_hits": self.token_hits,
+            "token_misses": self.token_misses,
+            "invalidations": self.invalidations,
+        }
+
+
+cache = UserCache(USER_CACHE_TTL, USER_CACHE_SIZE, TOKEN_CACHE_SIZE)
+
+
+@event.listens_for(models.User, "after_update")
+def _user_updated(mapper, connection, user):
+    cache.invalidate(user.id)
+
+
+@event.listens_for(models.User, "after_delete")
+def _user_deleted(mapper, connection, user):
+    cache.invalidate(user.id)
@@ -0,0 +1,138 @@
+"""
+Кэш вердиктов проверки решений.
+
+Ключ — (id задачи, версия тестовых кейсов, язык, хэш кода с LF вместо CRLF).
+Версия кейсов — хэш текста task.test_cases, поэтому после правки кейсов старые
+вердикты больше не находятся; кроме того, при изменении test_cases через ORM
+записи задачи сразу удаляются (слушатель события ниже).
+Одинаковые проверки, идущие одновременно, объединяются в одну; её прогресс
+получают все ожидающие.
+"""
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+
+from sqlalchemy import event
+
+from . import models
+
+VERDICT_CACHE_SIZE = int(os.environ.get("VERDICT_CACHE_SIZE", "1000"))
+
+
+def test_cases_version(raw: str) -> str:
+    return hashlib.sha256((raw or "").encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_code(code: str) -> str:
+    """
+    Код для ключа кэша — как отправлен, только CRLF заменён на LF (браузер на Windows).
+    Пробелы в концах строк не трогаем: они могут быть внутри строковых литералов.
+    """
+    return code.replace("\r\n", "\n")
+
+
+class _Inflight:
+    """Идущая проверка и колбэки прогресса всех, кто её ждёт."""
+
+    def __init__(self):
+        self.task = None
+        self.listeners = []
+        self.last_progress = None
+
+    def progress(self, *args):
+        self.last_progress = args
+        for listener in list(self.listeners):
+            listener(*args)
+
+
+class VerdictCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # ключ -> JudgeResult; порядок = давность использования
+        self._inflight = {}  # ключ -> _Inflight
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(task_id: int, test_cases_raw: str, language: str, code: str) -> tuple:
+        code_hash = hashlib.sha256(normalize_code(code).encode("utf-8")).hexdigest()
+        return task_id, test_cases_version(test_cases_raw), language, code_hash
+
+    def get(self, key: tuple):
+        verdict = self._entries.get(key)
+        if verdict is not None:
+            self._entries.move_to_end(key)
+        return verdict
+
+    async def judge(self, key: tuple, run, progress=None):
+        """
+        Возвращает вердикт из кэша или вызывает run(progress) (корутина, возвращающая JudgeResult).
+        Если такая же проверка уже идёт, ждёт её результат вместо нового запуска.
+        progress(выполнено, всего) получает прогресс проверки, в том числе чужой, к которой
+        присоединились (сначала — последнее уже известное значение).
+        """
+        verdict = self.get(key)
+        if verdict is not None:
+            self.hits += 1
+            return verdict
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            self.misses += 1
+            inflight = _Inflight()
+            inflight.task = asyncio.ensure_future(run(inflight.progress))
+            self._inflight[key] = inflight
+            inflight.task.add_done_callback(lambda t: self._judge_done(key, t))
+        else:
+            self.coalesced += 1
+            if progress is not None and inflight.last_progress is not None:
+                progress(*inflight.last_progress)
+        if progress is not None:
+            inflight.listeners.append(progress)
+        try:
+            # shield: отмена одного ожидающего не прерывает проверку, которую ждут другие
+            return await asyncio.shield(inflight.task)
+        finally:
+            if progress is not None:
+                inflight.listeners.remove(progress)
+
+    def _judge_done(self, key: tuple, task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        verdict = task.result()
+        # Превышение времени могло быть вызвано нагрузкой на сервер — такой вердикт не запоминаем
+        if verdict.timed_out:
+            return
+        self._entries[key] = verdict
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate_task(self, task_id: int):
+        for key in [key for key in self._entries if key[0] == task_id]:
+            del self._entries[key]
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+        }
+
+
+cache = VerdictCache(VERDICT_CACHE_SIZE)
+
+
+@event.listens_for(models.Task.test_cases, "set")
+def _test_cases_changed(task, value, old_value, initiator):
+    if task.id is not None and value != old_value:
+        cache.invalidate_task(task.id)
@@ -0,0 +1,215 @@
+"""
+Пул заранее запущенных процессов-воркеров.
+
+Воркер запускается один раз и получает задания построчно через stdin, отвечая
+одной строкой в stdout. До ответа воркер может присылать строки с частями
+вывода программы (потоковый режим, см. output_chunk). Так мы платим за старт
+интерпретатора только при создании воркера, а не при каждом запуске кода.
+Воркер пересоздаётся после max_runs заданий, а также при падении или превышении
+времени выполнения. Формат строк задания и ответа определяют наследники.
+"""
+import asyncio
+import os
+import signal
+import subprocess
+import time
+
+# Максимальная длина строки ответа воркера (в байтах)
+MAX_RESPONSE_BYTES = 16 * 1024 * 1024
+
+
+class Worker:
+    """Один процесс-воркер и число выполненных им заданий."""
+
+    def __init__(self, process):
+        self.process = process
+        self.runs = 0
+
+    async def kill(self):
+        # Воркер — лидер своей группы процессов: убиваем всю группу, даже если сам он уже
+        # завершился, чтобы не осталось порождённых кодом пользователя процессов
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        await self.process.wait()
+
+
+class WorkerPool:
+    """Базовый пул воркеров. Наследники задают команду запуска и протокол."""
+
+    def __init__(self, size: int, max_runs: int = 100, preexec_fn=None):
+        self.size = size
+        self.max_runs = max_runs
+        self.preexec_fn = preexec_fn  # ограничения процесса воркера (например, executor.sandbox_limits)
+        self._idle = None  # asyncio.Queue с воркерами (None — место для нового воркера)
+        self._closed = False
+        self.spawned = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.timeouts = 0
+
+    # --- Переопределяется в наследниках ---
+
+    def command(self) -> list:
+        raise NotImplementedError
+
+    def cwd(self):
+        """Рабочий каталог воркеров (None — текущий)."""
+        return None
+
+    def encode_request(self, payload) -> bytes:
+        raise NotImplementedError
+
+    def decode_response(self, line: bytes):
+        raise NotImplementedError
+
+    def output_chunk(self, message):
+        """(поток, текст), если строка воркера — часть вывода программы, а не ответ; иначе None."""
+        return None
+
+    def crash_response(self):
+        """Ответ, который возвращается, если воркер умер во время задания."""
+        raise NotImplementedError
+
+    def should_replace(self, response) -> bool:
+        """Нужно ли заменить воркер после такого ответа."""
+        return False
+
+    # --- Жизненный цикл ---
+
+    async def start(self):
+        """Запускает воркеры заранее, чтобы первый запуск кода был «тёплым»."""
+        if self._idle is not None:
+            return
+        self._closed = False
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            try:
+                self._idle.put_nowait(await self._spawn())
+            except OSError:
+                # Интерпретатор недоступен — попробуем снова при первом запуске
+                self._idle.put_nowait(None)
+
+    async def close(self):
+        if self._idle is None:
+            return
+        self._closed = True
+        while not self._idle.empty():
+            worker = self._idle.get_nowait()
+            if worker is not None:
+                await worker.kill()
+        self._idle = None
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "spawned": self.spawned,
+            "recycled": self.recycled,
+            "crashed": self.crashed,
+            "timeouts": self.timeouts,
+        }
+
+    async def _spawn(self) -> Worker:
+        process = await asyncio.create_subprocess_exec(
+            *self.command(),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=MAX_RESPONSE_BYTES,
+            cwd=self.cwd(),
+            preexec_fn=self.preexec_fn,
+            # Своя группа процессов, как у run_process: Worker.kill убивает её целиком
+            start_new_session=True,
+        )
+        self.spawned += 1
+        return Worker(process)
+
+    async def _respawn(self):
+        try:
+            worker = await self._spawn()
+        except OSError:
+            worker = None
+        if self._closed or self._idle is None:
+            if worker is not None:
+                await worker.kill()
+            return
+        self._idle.put_nowait(worker)
+
+    def _release(self, worker, replace: bool):
+        """Возвращает воркер в пул или заменяет его новым в фоне."""
+        if self._closed or self._idle is None:
+            asyncio.get_running_loop().create_task(worker.kill())
+            return
+        if replace:
+            asyncio.get_running_loop().create_task(worker.kill())
+            asyncio.get_running_loop().create_task(self._respawn())
+        else:
+            self._idle.put_nowait(worker)
+
+    # --- Выполнение заданий ---
+
+    async def run(self, payload, timeout: float, on_output=None):
+        """
+        Отправляет задание свободному воркеру и ждёт ответ.
+        Части вывода, которые воркер присылает до ответа, передаются on_output(поток, текст).
+        При превышении времени воркер убивается и выбрасывается subprocess.TimeoutExpired.
+        """
+        await self.start()
+        worker = await self._idle.get()
+        if worker is None:
+            try:
+                worker = await self._spawn()
+            except BaseException:
+                self._idle.put_nowait(None)
+                raise
+
+        replace = True
+        deadline = time.monotonic() + timeout
+        try:
+            worker.process.stdin.write(self.encode_request(payload))
+            await worker.process.stdin.drain()
+            response = await self._read_response(worker, deadline, on_output)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._release(worker, replace=True)
+            raise subprocess.TimeoutExpired(self.command(), timeout)
+        except (BrokenPipeError, ConnectionResetError):
+            response = None
+        except ValueError:
+            # Ответ не по протоколу: воркеру больше нельзя доверять
+            self.crashed += 1
+            self._release(worker, replace=True)
+            raise
+        except BaseException:
+            # Отмена запроса и прочие ошибки: состояние воркера неизвестно
+            self._release(worker, replace=True)
+            raise
+
+        if response is None:
+            # Воркер упал (например, превысил лимит памяти)
+            self.crashed += 1
+            self._release(worker, replace=True)
+            return self.crash_response()
+
+        worker.runs += 1
+        if worker.runs >= self.max_runs:
+            self.recycled += 1
+        elif not self.should_replace(response):
+            replace = False
+        self._release(worker, replace=replace)
+        return response
+
+    async def _read_response(self, worker, deadline: float, on_output):
+        """Читает строки воркера до ответа; None — воркер завершился, не ответив."""
+        while True:
+            line = await asyncio.wait_for(worker.process.stdout.readline(), max(0.0, deadline - time.monotonic()))
+            if not line:
+                return None
+            message = self.decode_response(line)
+            chunk = self.output_chunk(message)
+            if chunk is None:
+                return message
+            if on_output is not None:
+                on_output(*chunk)
@@ -0,0 +1,148 @@
+"""
+Рабочие каталоги для запусков пользовательского кода.
+
+Каждый запуск получает собственный пустой каталог (файлы разных запусков не
+пересекаются, например Main.class двух одновременных Java-запусков). Каталоги
+берутся из заранее созданного пула на файловой системе в памяти (/dev/shm),
+после запуска очищаются и возвращаются в пул, а не создаются заново.
+Очистка идёт в отдельном потоке: каталог может быть большим, а цикл событий
+в это время обслуживает другие запросы.
+"""
+import asyncio
+import contextlib
+import os
+import shutil
+import tempfile
+from collections import deque
+from pathlib import Path
+
+
+def _default_root() -> str:
+    # /dev/shm — tmpfs в Linux; если его нет, используем обычный временный каталог
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm/codequest-workspaces"
+    return os.path.join(tempfile.gettempdir(), "codequest-workspaces")
+
+
+WORKSPACE_ROOT = os.environ.get("EXECUTOR_WORKSPACE_DIR", _default_root())
+# Сколько очищенных каталогов держим про запас
+WORKSPACE_POOL_SIZE = int(os.environ.get("EXECUTOR_WORKSPACE_POOL_SIZE", "16"))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkspacePool:
+    def __init__(self, root: str, size: int):
+        # Каждый процесс uvicorn работает в своём подкаталоге <root>/<pid>
+        self.root = Path(root)
+        self.size = size
+        self.base = None
+        self._free = deque()
+        self._counter = 0
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def start(self):
+        """Создаёт каталог процесса и заранее заполняет пул (вызывается при старте приложения)."""
+        if self.base is not None:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._remove_stale()
+        self.base = self.root / str(os.getpid())
+        shutil.rmtree(self.base, ignore_errors=True)
+        self.base.mkdir()
+        for _ in range(self.size):
+            self._free.append(self._create())
+
+    def close(self):
+        if self.base is not None:
+            shutil.rmtree(self.base, ignore_errors=True)
+            self.base = None
+            self._free.clear()
+
+    def _remove_stale(self):
+        # Каталоги процессов, которые завершились, не успев прибрать за собой
+        for path in self.root.iterdir():
+            if path.name.isdigit() and int(path.name) != os.getpid() and not _pid_alive(int(path.name)):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _create(self) -> Path:
+        self._counter += 1
+        path = self.base / f"ws-{self._counter}"
+        path.mkdir()
+        self.created += 1
+        return path
+
+    @staticmethod
+    def _wipe(path: Path):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.unlink(entry.path)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """Отдаёт пустой рабочий каталог (str) на время блока async with."""
+        self.start()
+        if self._free:
+            path = self._free.popleft()
+            self.reused += 1
+        else:
+            path = self._create()
+        self.in_use += 1
+        try:
+            yield str(path)
+        finally:
+            self.in_use -= 1
+            await self._release(path)
+
+    async def _release(self, path: Path):
+        keep = self.base is not None and len(self._free) < self.size
+        cleaned = await asyncio.to_thread(self._clean, path, keep)
+        if not cleaned:
+            if keep:
+                # Не получилось очистить — каталог в пул не возвращаем
+                self.discarded += 1
+            return
+        if self.base is None or len(self._free) >= self.size:
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        self._free.append(path)
+
+    def _clean(self, path: Path, keep: bool) -> bool:
+        """Очищает каталог для повторного использования (keep) или удаляет его; True — каталог пуст и цел."""
+        if keep:
+            try:
+                # Запуск мог поменять права на файлы — возвращаем владельцу доступ к каталогу
+                os.chmod(path, 0o700)
+                self._wipe(path)
+                return True
+            except OSError:
+                pass
+        shutil.rmtree(path, ignore_errors=True)
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "root": str(self.root),
+            "free": len(self._free),
+            "in_use": self.in_use,
+            "created": self.created,
+            "reused": self.reused,
+            "discarded": self.discarded,
+        }
+
+
+pool = WorkspacePool(WORKSPACE_ROOT, WORKSPACE_POOL_SIZE)
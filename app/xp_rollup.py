@@ -0,0 +1,174 @@
+"""
+Сводки журнала XP по дням и неделям.
+
+Каждое начисление XP пишется в xp_events (в том же запросе, что и начисление,
+см. crud.complete_task_statement). Фоновая задача раз в XP_ROLLUP_INTERVAL
+секунд переносит новые события в xp_daily и xp_weekly: один INSERT ... SELECT
+... GROUP BY ... ON CONFLICT DO UPDATE SET xp = xp + excluded.xp на каждую
+таблицу, по событиям после курсора (rollup_cursors). Курсор блокируется
+FOR UPDATE SKIP LOCKED, поэтому из нескольких процессов uvicorn партию
+сворачивает только один.
+
+Курсор идёт по (xid, id), где xid — id транзакции, записавшей событие. id
+выдаются до commit, и транзакция с меньшим id может закоммититься позже, чем с
+большим, сколько бы она ни длилась, — поэтому курсор по одному id терял бы такие
+события. Партия берётся только из транзакций старше горизонта видимости
+pg_snapshot_xmin(pg_current_snapshot()): все они уже завершены, и новых событий
+с таким xid не появится. Транзакция, которая ещё идёт, задерживает сворачивание
+событий новее неё, но её события не теряются. Запросы статистики читают сводки
+по первичному ключу, без просмотра журнала.
+"""
+import asyncio
+import datetime
+import os
+from typing import Optional
+
+from sqlalchemy import BigInteger, Date, String, cast, func, literal_column, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import database, models
+
+XP_ROLLUP_INTERVAL = float(os.environ.get("XP_ROLLUP_INTERVAL", "10"))
+XP_ROLLUP_BATCH = int(os.environ.get("XP_ROLLUP_BATCH", "10000"))
+CURSOR_NAME = "xp"
+
+
+def _week_of(value):
+    # Понедельник недели (date_trunc('week') в PostgreSQL начинает неделю с понедельника).
+    # 'week' — литерал, а не параметр: иначе с asyncpg выражения в SELECT и GROUP BY различаются
+    return cast(func.date_trunc(literal_column("'week'"), value), Date)
+
+
+def visibility_horizon():
+    """Горизонт видимости: транзакции с xid меньше него уже завершены (xid8 -> bigint через текст)."""
+    return cast(cast(func.pg_snapshot_xmin(func.pg_current_snapshot()), String), BigInteger)
+
+
+class XpRollup:
+    def __init__(self, interval: float, batch: int):
+        self.interval = interval
+        self.batch = batch
+        self._task = None
+        self.runs = 0
+        self.last_event_id = None
+
+    def _upsert(self, table, period_column: str, period, events):
+        rows = select(events.c.user_id, period, func.sum(events.c.amount)).group_by(events.c.user_id, period)
+        statement = pg_insert(table).from_select(["user_id", period_column, "xp"], rows)
+        return statement.on_conflict_do_update(
+            index_elements=["user_id", period_column],
+            set_={"xp": table.xp + statement.excluded.xp})
+
+    async def run_once(self, db: AsyncSession) -> Optional[int]:
+        """Сворачивает одну партию событий; возвращает id последнего учтённого события или None."""
+        last = (await db.execute(
+            select(models.RollupCursor.last_xid, models.RollupCursor.last_event_id)
+            .where(models.RollupCursor.name == CURSOR_NAME)
+            .with_for_update(skip_locked=True))).first()
+        if last is None:
+            # Курсор занят другим процессом
+            await db.rollback()
+            return None
+        last = tuple(last)
+
+        position = tuple_(models.XpEvent.xid, models.XpEvent.id)
+        # Горизонт считается в том же запросе, что и выборка: все события до него ему видны
+        batch = (
+            select(models.XpEvent.xid, models.XpEvent.id)
+            .where(position > last, models.XpEvent.xid < visibility_horizon())
+            .order_by(models.XpEvent.xid, models.XpEvent.id)
+            .limit(self.batch)
+            .subquery()
+        )
+        upto = (await db.execute(
+            select(batch.c.xid, batch.c.id).order_by(batch.c.xid.desc(), batch.c.id.desc()).limit(1))).first()
+        if upto is None:
+            await db.rollback()
+            return None
+        upto = tuple(upto)
+
+        events = (
+            select(models.XpEvent.user_id, models.XpEvent.amount, models.XpEvent.created_at)
+            .where(position > last, position <= upto)
+            .subquery()
+        )
+        await db.execute(self._upsert(models.XpDaily, "day", cast(events.c.created_at, Date), events))
+        await db.execute(self._upsert(models.XpWeekly, "week", _week_of(events.c.created_at), events))
+        await db.execute(
+            update(models.RollupCursor).where(models.RollupCursor.name == CURSOR_NAME)
+            .values(last_xid=upto[0], last_event_id=upto[1]))
+        await db.commit()
+        self.runs += 1
+        self.last_event_id = upto[1]
+        return upto[1]
+
+    async def _loop(self):
+        while True:
+            try:
+                async with database.AsyncSessionLocal() as db:
+                    # Догоняем журнал партиями, затем ждём следующего интервала
+                    while await self.run_once(db) is not None:
+                        pass
+            except Exception as e:
+                print(f"Не удалось обновить сводки XP: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        async with database.AsyncSessionLocal() as db:
+            await db.execute(pg_insert(models.RollupCursor).values(name=CURSOR_NAME, last_event_id=0)
+                             .on_conflict_do_nothing(index_elements=["name"]))
+            await db.commit()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "last_event_id": self.last_event_id}
+
+
+rollup = XpRollup(XP_ROLLUP_INTERVAL, XP_ROLLUP_BATCH)
+
+
+async def user_stats(db: AsyncSession, user_id: int, days: int) -> dict:
+    """XP пользователя за сегодня, за текущую неделю и по дням за последние days дней."""
+    today, week = (await db.execute(select(func.current_date(), _week_of(func.current_date())))).one()
+    daily = (await db.execute(
+        select(models.XpDaily.day, models.XpDaily.xp)
+        .where(models.XpDaily.user_id == user_id, models.XpDaily.day > today - datetime.timedelta(days=days))
+        .order_by(models.XpDaily.day))).all()
+    this_week = await db.scalar(
+        select(models.XpWeekly.xp).where(models.XpWeekly.user_id == user_id, models.XpWeekly.week == week))
+    by_day = dict(daily)
+    return {
+        "today": by_day.get(today, 0),
+        "this_week": this_week or 0,
+        "daily": [{"day": day.isoformat(), "xp": xp} for day, xp in daily],
+    }
+
+
+async def period_top(db: AsyncSession, period: str, k: int) -> dict:
+    """Первые k пользователей по XP за текущий день ("day") или неделю ("week")."""
+    if period == "day":
+        table, column, current = models.XpDaily, models.XpDaily.day, func.current_date()
+    else:
+        table, column, current = models.XpWeekly, models.XpWeekly.week, _week_of(func.current_date())
+    rows = (await db.execute(
+        select(table.user_id, table.xp, models.User.name, models.User.avatar, column)
+        .join(models.User, models.User.id == table.user_id)
+        .where(column == current)
+        .order_by(table.xp.desc(), table.user_id)
+        .limit(k))).all()
+
+    top = []
+    for position, (user_id, xp, name, avatar, _) in enumerate(rows):
+        # Одинаковый XP — одинаковое место
+        rank = top[-1]["rank"] if top and top[-1]["xp"] == xp else position + 1
+        top.append({"rank": rank, "user_id": user_id, "name": name, "avatar": avatar, "xp": xp})
+    return {"period": period, "start": rows[0][4].isoformat() if rows else None, "top": top}
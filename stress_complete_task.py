@@ -0,0 +1,84 @@
+"""
+Нагрузочная проверка crud.complete_task на настоящей PostgreSQL (БД из app/database.py).
+
+Много потоков одновременно завершают одни и те же задачи за одного пользователя.
+Ожидается: каждая задача засчитана ровно один раз, XP начислен без потерь и повторов,
+а журнал xp_events сходится с total_xp.
+
+    python stress_complete_task.py [потоков] [задач]
+"""
+import sys
+import threading
+import uuid
+
+from sqlalchemy import func
+
+from app import crud, models
+from app.database import SessionLocal, engine
+
+THREADS = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+TASKS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+XP_REWARD = 10
+
+
+def main():
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = models.User(name="stress", email=f"stress-{uuid.uuid4().hex}@example.com", password="-", total_xp=0)
+    tasks = [models.Task(title=f"stress-{i}", xp_reward=XP_REWARD) for i in range(TASKS)]
+    db.add_all([user, *tasks])
+    db.commit()
+    user_id, task_ids = user.id, [task.id for task in tasks]
+
+    successes = []
+    errors = []
+    barrier = threading.Barrier(THREADS)
+
+    def worker(n):
+        session = SessionLocal()
+        try:
+            barrier.wait()
+            # Каждый поток проходит все задачи, начиная со своей — так конфликты идут по всем задачам сразу
+            for i in range(TASKS):
+                task_id = task_ids[(n + i) % TASKS]
+                if crud.complete_task(session, user_id, task_id)["success"]:
+                    successes.append(task_id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db.expire_all()
+    total_xp = db.get(models.User, user_id).total_xp
+    completed = db.query(models.UserTask).filter(models.UserTask.user_id == user_id).count()
+    ledger_xp = db.query(func.coalesce(func.sum(models.XpEvent.amount), 0)).filter(
+        models.XpEvent.user_id == user_id).scalar()
+
+    ok = (not errors and sorted(successes) == sorted(task_ids)
+          and completed == TASKS and total_xp == TASKS * XP_REWARD and ledger_xp == total_xp)
+    if ok:
+        print(f"✅ {THREADS} потоков × {TASKS} задач: каждая засчитана один раз, XP = {total_xp}")
+    else:
+        print(f"❌ успешных завершений: {len(successes)} (ожидалось {TASKS}), записей: {completed}, "
+              f"XP: {total_xp} (ожидалось {TASKS * XP_REWARD}), XP в журнале: {ledger_xp}, ошибок: {len(errors)}")
+        for e in errors[:5]:
+            print("   ", repr(e))
+
+    for model in (models.XpDaily, models.XpWeekly, models.XpEvent, models.UserTask,
+                  models.UserAchievement, models.UserProgress):
+        db.query(model).filter(model.user_id == user_id).delete()
+    db.query(models.Task).filter(models.Task.id.in_(task_ids)).delete()
+    db.query(models.User).filter(models.User.id == user_id).delete()
+    db.commit()
+    db.close()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())